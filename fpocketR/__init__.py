@@ -1 +1,2 @@
-import rnavigate
\ No newline at end of file
+import rnavigate
+from fpocketR.api import find_pockets, PocketResult, FpocketParameters
@@ -10,12 +10,13 @@
 # -----------------------------------------------------
 import argparse
 import os
-import glob
-import pickle
+import sys
 import pandas as pd
 from pymol import cmd
 from prody import *
-from fpocketR import analyze, pocket, figures, util
+from fpocketR import (
+    analyze, pocket, figures, util, parallel, cache, workspace, ligands, results,
+    profiling, runner, ensemble, trajectory, structures, memory, outputs)
 confProDy(verbosity='none')
 # -----------------------------------------------------
 
@@ -43,6 +44,19 @@ def pipeline(
     zoom : float,
     connectpocket : bool,
     alignligand : str,
+    saveobj : bool = False,
+    cachedir : str = None,
+    refresh : bool = False,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+    tmpdir : str = workspace.DEFAULT_TMPDIR,
+    pdb_clean : str = None,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
+    render : str = 'inline',
+    results_db : str = None,
+    parameters : str = None,
+    traj : str = None,
+    frames : range = None,
 ):   
     """Runs pocket finding pipeline
 
@@ -68,6 +82,25 @@ def pipeline(
         zoom (float): Zoom buffer distance (Å) for creating 3D figures.
         connectpocket (boolean): Connects pockets in 2D figure (Default=False).
         alignligand (str): Align ligand to pymol output (Default=True).
+        saveobj (boolean): Export pocket surface .obj files (Default=False).
+        cachedir (str): Path to the cache directory (None disables caching).
+        refresh (boolean): Recalculates and replaces cached results.
+        cachesize (float): Maximum cache size in MB.
+        tmpdir (str): Directory for the run workspace (Default: inside {out}).
+        pdb_clean (str): Path to an already cleaned .pdb file shared between
+                         states ({pdb} is then the matching cleaned copy).
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (boolean): Download ligands missing from the ligand store from the PDBe.
+        render (str): Render figures now ('inline'), write a render spec for
+                      `fpocketR render` ('deferred'), or skip them ('none').
+        results_db (str): Path to a multistate results database to which the
+                          pocket characteristics and color maps are added.
+        parameters (str): Hash of the run parameters recorded with the state
+                          in the run manifest of {results_db}.
+        traj (str): Path to a trajectory of the topology {pdb}. State N is
+                    frame {frames}[N-1], written to the workspace as a single
+                    model input.
+        frames (range): Indices of the analyzed frames of {traj}.
 
     Returns:
         str: Path to clean .pdb input file.
@@ -76,93 +109,155 @@ def pipeline(
 
     """
 
-    # Checks if required input files are accessible/exist.
-    print('Checking input files.')
-    util.is_accessible(pdb, 'pdb')
+    # Tags the timings of every stage with the structure, state and pockets.
+    with profiling.tagged(name, state):
+        # Checks if required input files are accessible/exist.
+        with profiling.stage('input'):
+            print('Checking input files.')
+            util.is_accessible(pdb, 'pdb')
 
-    if chain is None:
-        chain = util.get_first_rna_chain(pdb)
-    else:
-        util.is_rna_chain(pdb, chain)
-
-    # Runs fpocket on input pdb file and manages output files.
-    analysis, yes = pocket.find_pockets(
-        pdb,
-        chain,
-        state,
-        m,
-        M,
-        i,
-        D,
-        A,
-        p,
-        out,
-        name,
-        yes,
-    )
-
-    # Checks if the analysis directory is accessible.
-    util.is_accessible(analysis, 'analysis directory')
-
-    # Get paths to fpocket input and output file.
-    (
-        pdb,
-        pdb_out,
-        pqr_out,
-        info_txt,
-        pockets_out,
-        pdb_code,
-        name,
-        ) = util.get_file_paths(analysis, name, pdb, state)
-
-    # Analyze fpocket data and create pocket characteristics dataframe.
-    (pc_df, rna_coords) = analyze.analyze_pockets(
-        pdb,
-        pqr_out,
-        pdb_out,
-        analysis,
-        name,
-        info_txt,
-        pockets_out,
-        pdb_code,
-        chain,
-        state,
-        ligandchain,
-        ligand,
-        m,
-        M,
-        i,
-        D,
-        A,
-        p,
-        qualityfilter,
-        knownnt,
-    )
-    
-    offset = util.get_offset(pdb, chain, offset) if offset is None else offset
-
-    # Generates 1D (.csv), 2D (.png, .svg), and 3D (.pdb, .pse, .png)
-    pocket_cmap = figures.make_figures(
-        pdb,
-        state,
-        pc_df,
-        rna_coords,
-        ss,
-        analysis,
-        name,
-        chain,
-        dpi,
-        zoom,
-        offset,
-        connectpocket,
-        alignligand
-    )
+            # Finds chains from the header without parsing the structure.
+            context = structures.get_context(pdb)
+            if chain is None:
+                chain = util.get_first_rna_chain(context)
+            else:
+                util.is_rna_chain(context, chain)
+
+        # Runs in a private workspace so concurrent runs never share files.
+        with workspace.workspace(out, name, tmpdir) as workdir, \
+                results.track_state(results_db, state, parameters) as started:
+            # Writes the frame of a trajectory as the input of this state.
+            if traj:
+                pdb, pdb_clean = trajectory.write_frame(
+                    pdb, traj, frames[state - 1], workdir, name)
+
+            # Runs fpocket on input pdb file and manages output files.
+            analysis, dest_dir, pdb, yes = pocket.find_pockets(
+                pdb,
+                chain,
+                state,
+                m,
+                M,
+                i,
+                D,
+                A,
+                p,
+                out,
+                name,
+                yes,
+                workdir,
+                pdb_clean,
+                cachedir,
+                refresh,
+                cachesize,
+                bool(traj),
+            )
+
+            # Checks if the analysis directory is accessible.
+            util.is_accessible(analysis, 'analysis directory')
+
+            # Get paths to fpocket input and output file.
+            (
+                pdb,
+                pdb_out,
+                pqr_out,
+                info_txt,
+                pdb_code,
+                name,
+                ) = util.get_file_paths(analysis, name, pdb, state)
+
+            # The cleaned copy is parsed once and shared by the later stages
+            # (and by all states that share it).
+            context = structures.get_context(pdb)
+
+            # Reuses the pocket characteristics from an identical earlier analysis.
+            pc_df = None
+            if cachedir:
+                pc_key = cache.get_characteristics_key(
+                    pdb, pdb_out, pqr_out, info_txt, name, chain, ligand, ligandchain,
+                    qualityfilter, knownnt, (m, M, i, D, A, p, state),
+                    (ligands.get_store_version(ligandstore), fetchligands))
+                if not refresh:
+                    pc_df = cache.load_characteristics(cachedir, pc_key)
+
+            if pc_df is not None:
+                print(f'Using cached pocket characteristics for {name}.\n')
+                _, out = analyze.get_real_sphere(pqr_out, pdb_out, analysis, name)
+                if saveobj:
+                    analyze.save_pocket_surfaces(analysis, name, len(pc_df))
+                rna_coords = outputs.get_out_atoms(out, name)
+
+            else:
+                # Analyze fpocket data and create pocket characteristics dataframe.
+                (pc_df, rna_coords) = analyze.analyze_pockets(
+                    context,
+                    pqr_out,
+                    pdb_out,
+                    analysis,
+                    name,
+                    info_txt,
+                    pdb_code,
+                    chain,
+                    state,
+                    ligandchain,
+                    ligand,
+                    m,
+                    M,
+                    i,
+                    D,
+                    A,
+                    p,
+                    qualityfilter,
+                    knownnt,
+                    saveobj,
+                    ligandstore,
+                    fetchligands,
+                )
+                if cachedir:
+                    cache.store_characteristics(cachedir, pc_key, pc_df, cachesize)
+            profiling.set_tags(Pockets=len(pc_df))
+
+            offset = util.get_offset(context, chain, offset) if offset is None else offset
+
+            # Low-memory runs release the parsed input before making figures
+            # (later states parse it again).
+            if memory.is_low_memory():
+                context.release()
+                memory.release()
+
+            # Generates 1D (.csv), 2D (.png, .svg), and 3D (.pdb, .pse, .png)
+            pocket_cmap, pocket_nt_color = figures.make_figures(
+                pdb,
+                state,
+                pc_df,
+                rna_coords,
+                ss,
+                analysis,
+                name,
+                chain,
+                dpi,
+                zoom,
+                offset,
+                connectpocket,
+                alignligand,
+                render,
+            )
+
+            # Moves the finished outputs from the workspace into the output directory.
+            workspace.commit(analysis, dest_dir)
+
+            # Records the finished state in the multistate results database.
+            if results_db:
+                results.append_state(
+                    results_db, state, pc_df, pocket_cmap, pocket_nt_color,
+                    parameters, dest_dir, started,
+                    analyze.get_pocket_centroids(rna_coords))
 
     return pc_df, out, pocket_cmap, chain, yes
 
 
 # -----------------------------------------------------
-def parseArgs():
+def get_parser() -> argparse.ArgumentParser:
     prs = argparse.ArgumentParser()
     pocket_type = prs.add_mutually_exclusive_group()
 
@@ -173,8 +268,8 @@ def parseArgs():
         type=str,
         required=True,
         default=None,
-        help='Path to a .pdb file, .cif file, or 4 charater PDB '
-        'indentification code.',
+        help='Path to a .pdb file, .cif file (either may be gzip-compressed, '
+        'e.g. .cif.gz), or 4 charater PDB indentification code.',
     )
     prs.add_argument(
         '-ss',
@@ -185,6 +280,22 @@ def parseArgs():
         help='Path to an .ss or other secondary structure file '
         'for generating secondary structure figures.',
     )
+    prs.add_argument(
+        '--traj',
+        type=str,
+        required=False,
+        default=None,
+        help='Path to a trajectory (.dcd) of the --pdb topology. Frames are '
+        'streamed and analyzed as states (None).',
+    )
+    prs.add_argument(
+        '--frames',
+        type=str,
+        required=False,
+        default=None,
+        help='Range of --traj frames to analyze as start:stop:step '
+        '(0-based, e.g. 0:10000:10) (all frames).',
+    )
     
 # fpocket parameter options
     prs.add_argument(
@@ -240,7 +351,18 @@ def parseArgs():
         help='fpocket -p flag. Maximum ratio of apolar a-spheres '
         'in a pocket (0.0).',
     )
-    
+    prs.add_argument(
+        '--sweep',
+        type=str,
+        nargs='+',
+        required=False,
+        default=None,
+        help='Runs fpocket for every combination of a grid of parameters '
+        'and writes one table keyed by the parameters, e.g. '
+        '--sweep m=3.0,3.2,3.4 i=30:50:10 (values or start:stop:step). '
+        'Other parameters keep their values (None).',
+    )
+
 # Output options
     prs.add_argument(
         '-o',
@@ -260,6 +382,97 @@ def parseArgs():
         help='Specify output filename prefix and output subdirectory name \
             (Default: "{PDB}_clean_out").',
     )
+    prs.add_argument(
+        '-obj',
+        '--saveobj',
+        required=False,
+        action='store_true',
+        help='Exports a PyMOL surface .obj file for each pocket (False).',
+    )
+    prs.add_argument(
+        '--no-cache',
+        dest='nocache',
+        required=False,
+        action='store_true',
+        help='Disables the fpocket output and pocket characteristics cache (False).',
+    )
+    prs.add_argument(
+        '--refresh',
+        required=False,
+        action='store_true',
+        help='Reruns fpocket and the analysis and replaces cached results (False).',
+    )
+    prs.add_argument(
+        '--cache-dir',
+        dest='cachedir',
+        type=str,
+        required=False,
+        default=cache.DEFAULT_CACHE_DIR,
+        help='Path to the cache directory (Default: $FPOCKETR_CACHE_DIR or '
+        '"~/.cache/fpocketR").',
+    )
+    prs.add_argument(
+        '--cache-size',
+        dest='cachesize',
+        type=float,
+        required=False,
+        default=cache.DEFAULT_CACHE_SIZE,
+        help='Maximum cache size in MB; least recently used results are '
+        'removed first (Default: $FPOCKETR_CACHE_SIZE or 2048).',
+    )
+    prs.add_argument(
+        '--tmpdir',
+        type=str,
+        required=False,
+        default=workspace.DEFAULT_TMPDIR,
+        help='Directory for temporary run workspaces, e.g. /dev/shm for tmpfs '
+        '(Default: $FPOCKETR_TMPDIR or inside --out).',
+    )
+    prs.add_argument(
+        '--fpocket-timeout',
+        dest='fpockettimeout',
+        type=float,
+        required=False,
+        default=runner.DEFAULT_TIMEOUT,
+        help='Seconds after which an fpocket run is killed '
+        '(Default: $FPOCKETR_FPOCKET_TIMEOUT or None).',
+    )
+    prs.add_argument(
+        '--max-memory',
+        dest='maxmemory',
+        type=float,
+        required=False,
+        default=memory.DEFAULT_MAX_MEMORY,
+        help='Memory budget in MB of the whole run. Enables low-memory analysis '
+        'and limits the number of parallel states to the budget left after the '
+        'main fpocketR process (Default: $FPOCKETR_MAX_MEMORY or None).',
+    )
+    prs.add_argument(
+        '--ligand-store',
+        dest='ligandstore',
+        type=str,
+        required=False,
+        default=ligands.DEFAULT_LIGAND_STORE,
+        help='Ligand property store used for QED scores, built with '
+        '`fpocketR ligands` (Default: $FPOCKETR_LIGAND_STORE or '
+        '"~/.cache/fpocketR/ligands.tsv").',
+    )
+    prs.add_argument(
+        '--fetch-missing-ligands',
+        dest='fetchligands',
+        required=False,
+        action='store_true',
+        help='Download ligands missing from the ligand store from the PDBe '
+        '(False: runs never use the network; add ligands with `fpocketR ligands`).',
+    )
+    prs.add_argument(
+        '--profile',
+        type=str,
+        required=False,
+        default=profiling.DEFAULT_PROFILE,
+        help='Appends the wall time, CPU time and memory use of every '
+        'pipeline stage to a JSON lines report (Default: $FPOCKETR_PROFILE or None).',
+    )
     prs.add_argument(
         '-y',
         '--yes',
@@ -277,6 +490,15 @@ def parseArgs():
         default=None,
         help='Specify the NMR states/model you would like to analyze. 0 for all (None).',
     )
+    prs.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of states to analyze in parallel when --state is 0, '
+        'or of --sweep combinations (1).',
+    )
     prs.add_argument(
         '-c',
         '--chain',
@@ -332,6 +554,15 @@ def parseArgs():
     )
     
 # Figure options
+    prs.add_argument(
+        '--render',
+        type=str,
+        required=False,
+        choices=figures.RENDER_MODES,
+        default='inline',
+        help='Render figures during the run (inline), write render specs for '
+        '`fpocketR render` (deferred), or skip figures (none) (inline).',
+    )
     prs.add_argument(
         '-dpi',
         '--dpi',
@@ -367,7 +598,11 @@ def parseArgs():
             If `bool`: input PDB file is used as the mobile structure.',
     )
 
-    args = prs.parse_args()
+    return prs
+
+
+def parseArgs():
+    args = get_parser().parse_args()
     return args
 
 def parse_int(string : str) -> list[int]:
@@ -401,6 +636,22 @@ def main(
     zoom : float,
     connectpocket : bool,
     alignligand : str,
+    jobs : int = 1,
+    saveobj : bool = False,
+    nocache : bool = False,
+    refresh : bool = False,
+    cachedir : str = cache.DEFAULT_CACHE_DIR,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+    tmpdir : str = workspace.DEFAULT_TMPDIR,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
+    render : str = 'inline',
+    profile : str = None,
+    sweep : list[str] = None,
+    fpockettimeout : float = runner.DEFAULT_TIMEOUT,
+    traj : str = None,
+    frames : str = None,
+    maxmemory : float = memory.DEFAULT_MAX_MEMORY,
 ):
     """Runs the fpocket analysis pipeline.
     Pipeline runs once: by default or if provided a user specified state
@@ -408,31 +659,100 @@ def main(
 
     Pipeline runs multiple times: if the -s flag is set to 0 (all).
     This feature is intended for analyzing NMR structures
-    with several modeled states.
+    with several modeled states. States are analyzed in {jobs} parallel
+    worker processes when the -j flag is greater than 1.
+
+    fpocket outputs and pocket characteristics are cached in {cachedir} and
+    reused by identical runs unless --no-cache or --refresh is used.
+
+    Every run works in its own temporary workspace (inside {out} or
+    {tmpdir}) and its results are moved into {out} when it finishes,
+    so the input file is never modified.
+
+    Multistate runs add the pocket characteristics and color maps of every
+    state to {out}/{name}_all_states.sqlite, which the all states outputs
+    are made from. The database also holds a run manifest (status, run
+    parameters, output checksums and timings per state), so an interrupted
+    run only repeats states that did not finish. The pockets of all states
+    are grouped into consensus pockets ({name}_consensus_pockets.csv).
+
+    Ligand QED scores are looked up in {ligandstore}; ligands missing from
+    the store are only downloaded from the PDBe with --fetch-missing-ligands.
+
+    Figures are rendered during the run unless --render is 'deferred'
+    (render specs are written for `fpocketR render`) or 'none'.
+
+    With --profile, the wall time, CPU time and memory use of every stage
+    are appended to a JSON lines report, including stages run by workers.
+
+    fpocket output is logged to {pdb stem}_fpocket.log in the fpocket output
+    directory. Runs longer than {fpockettimeout} seconds are killed, and runs
+    killed by a signal are retried ($FPOCKETR_FPOCKET_RETRIES times).
+
+    With --traj, the frames of a trajectory of the {pdb} topology are
+    analyzed as the states of a multistate run. Frames are read one at a
+    time and written to the workspace of their state as small single model
+    inputs, so no multi-model .pdb file is written.
+
+    With --max-memory, stages use views instead of copies and release the
+    parsed structures after each state, and parallel states are limited to
+    as many as fit in {maxmemory} MB, minus the RSS of this process, given
+    the measured peak RSS of a worker. The peak RSS of the run is printed when it finishes.
+
+    With --sweep, the structure is cleaned once and fpocket is run for every
+    combination of the parameter grid instead (see fpocketR.sweep).
     """
+    if profile:
+        profiling.enable(profile)
+
+    # Shared with worker processes through the environment.
+    runner.configure(fpockettimeout)
+    memory.configure(maxmemory)
 
-    # Check if pdb contains a file extension.
-    if len(pdb.split('.')) < 2:
+    # Analyzes the frames of a trajectory as the states of the topology.
+    if traj:
+        state = 0
+
+    # Fetches PDB identifiers that are not local files.
+    if util.is_pdb_id(pdb):
         pdb = util.fetch_pdb(pdb)
 
     # Set pdb name
     if name is None:
-        name = os.path.basename(pdb)[0:-4]
+        name = structures.get_name(pdb)
 
     # Set structure to align to.
     if alignligand == 'False' or alignligand == 'none':
         alignligand = None
     elif alignligand is None or alignligand == 'True':
         alignligand = pdb
-    elif len(alignligand.split('.')) < 2:
+    elif util.is_pdb_id(alignligand):
         alignligand = util.fetch_pdb(alignligand)
     elif not os.path.isfile(alignligand):
         alignligand = None
 
+    if out is None:
+        out = util.get_default_out(pdb, state)
+
+    if nocache:
+        cachedir = None
+    elif cachedir:
+        cachedir = os.path.abspath(cachedir)
+
+    if ligandstore:
+        ligandstore = os.path.abspath(ligandstore)
+
+    # Runs fpocket over a grid of parameters instead of the full pipeline.
+    if sweep:
+        from fpocketR.sweep import run_sweep
+        run_sweep(
+            pdb, sweep, chain, state, ligand, ligandchain, knownnt,
+            qualityfilter, dict(m=m, M=M, i=i, D=D, A=A, p=p), out, name,
+            jobs, cachedir, refresh, cachesize, tmpdir, ligandstore, fetchligands)
+        return
+
     # Runs pipeline for a single state of the input structure.
     if state != 0:
-        if out is None:
-            out = f'fpocketR_out'
         (_, _, _, _, _) = pipeline(
             pdb,
             ss,
@@ -456,86 +776,204 @@ def main(
             zoom,
             connectpocket,
             alignligand,
+            saveobj,
+            cachedir,
+            refresh,
+            cachesize,
+            tmpdir,
+            None,
+            ligandstore,
+            fetchligands,
+            render,
         )
 
     # Runs pipeline for multiple states of the input structure.
     elif state == 0:
-        if out is None:
-            out = f'Multistate_{pdb.split(".")[0]}'
-
-        try:
-            structure = parsePDB(pdb)
-            num_states = structure.numCoordsets()
-        except:
-            print('ERROR: Unable to perform multisate analysis.\n'
-                  f'The header for {pdb} does not contain state information.\n')
-            exit() 
-
-        state_tracker_filename = f"{out}/state_tracker.txt"
-        last_state = util.get_last_processed_state(state_tracker_filename)  # Get the last processed state
-        if last_state > 0:
-            start_state = last_state
+        if traj:
+            traj = os.path.abspath(traj)
+            frames = trajectory.get_frames(pdb, traj, frames)
+            num_states = len(frames)
+
+            # Records the frame analyzed as each state.
+            os.makedirs(out, exist_ok=True)
+            pd.DataFrame({'State': range(1, num_states + 1), 'Frame': frames}).to_csv(
+                f'{out}/{name}_frames.csv', index=False)
         else:
-            start_state = 1
-        for state in range(start_state, num_states + 1):
-            print(f'\nFinding pockets in state {state}/{num_states}...\n')
-            (pc_df, out, pocket_cmap, chain, yes) = pipeline(
-                pdb,
-                ss,
-                chain,
-                state,
-                ligand,
-                ligandchain,
-                knownnt,
-                offset,
-                qualityfilter,
-                m,
-                M,
-                i,
-                D,
-                A,
-                p,
-                out,
-                name,
-                dpi,
-                yes,
-                zoom,
-                connectpocket,
-                alignligand,
+            try:
+                num_states = structures.get_context(pdb).num_states
+            except:
+                print('ERROR: Unable to perform multisate analysis.\n'
+                      f'The header for {pdb} does not contain state information.\n')
+                exit() 
+
+        # Resumes by analyzing only the states that have not finished with
+        # the same input and options (all states with --refresh).
+        results_db = os.path.abspath(results.get_results_path(out, name))
+        parameters = cache.get_key(
+            cache.hash_file(pdb),
+            cache.hash_file(ss) if ss and os.path.isfile(ss) else ss,
+            chain, ligand, ligandchain, knownnt, offset, qualityfilter,
+            m, M, i, D, A, p, name, dpi, zoom, connectpocket, alignligand,
+            render, trajectory.get_trajectory_key(traj, frames) if traj else None,
+        )
+        all_states = list(range(1, num_states + 1))
+        if refresh:
+            states = all_states
+        else:
+            states = results.get_pending_states(results_db, all_states, parameters)
+        if len(states) < num_states:
+            print(f'Resuming: {num_states - len(states)}/{num_states} states '
+                  'already finished.\n')
+
+        # Cleans the input once so all states share the same clean .pdb file.
+        with workspace.workspace(out, name, tmpdir) as shared:
+            if traj:
+                # Each state writes its own frame from the topology.
+                pdb_clean = None
+                pdb_copy = os.path.abspath(pdb)
+            else:
+                pdb_clean = os.path.join(shared, f'{name}_clean.pdb')
+                pdb_copy = os.path.join(shared, f'{structures.get_name(pdb)}.pdb')
+                pocket.clean_pdb(pdb, pdb_clean, pdb_copy)
+
+            if jobs > 1 and states:
+                context = structures.get_context(pdb)
+                if chain is None:
+                    chain = util.get_first_rna_chain(context)
+                else:
+                    util.is_rna_chain(context, chain)
+
+                yes = util.confirm_overwrite(
+                    [os.path.join(out, f'{name}_clean_state{state}_out')
+                     for state in states],
+                    yes,
+                )
+
+                # Paths are made absolute for the worker processes.
+                pipeline_kwargs = dict(
+                    pdb=pdb_copy,
+                    ss=os.path.abspath(ss) if ss else ss,
+                    chain=chain,
+                    ligand=ligand,
+                    ligandchain=ligandchain,
+                    knownnt=knownnt,
+                    offset=offset,
+                    qualityfilter=qualityfilter,
+                    m=m,
+                    M=M,
+                    i=i,
+                    D=D,
+                    A=A,
+                    p=p,
+                    out=os.path.abspath(out),
+                    name=name,
+                    dpi=dpi,
+                    yes=yes,
+                    zoom=zoom,
+                    connectpocket=connectpocket,
+                    alignligand=os.path.abspath(alignligand) if alignligand else alignligand,
+                    saveobj=saveobj,
+                    cachedir=cachedir,
+                    refresh=refresh,
+                    cachesize=cachesize,
+                    tmpdir=os.path.abspath(tmpdir) if tmpdir else tmpdir,
+                    pdb_clean=pdb_clean,
+                    ligandstore=ligandstore,
+                    fetchligands=fetchligands,
+                    render=render,
+                    results_db=results_db,
+                    parameters=parameters,
+                    traj=traj,
+                    frames=frames,
+                )
+                print(f'\nFinding pockets in {len(states)} states '
+                      f'using {jobs} parallel jobs...\n')
+                parallel.run_states(pipeline_kwargs, states, jobs, maxmemory)
+
+            else:
+                for state in states:
+                    print(f'\nFinding pockets in state {state}/{num_states}...\n')
+                    (pc_df, out, pocket_cmap, chain, yes) = pipeline(
+                        pdb_copy,
+                        ss,
+                        chain,
+                        state,
+                        ligand,
+                        ligandchain,
+                        knownnt,
+                        offset,
+                        qualityfilter,
+                        m,
+                        M,
+                        i,
+                        D,
+                        A,
+                        p,
+                        out,
+                        name,
+                        dpi,
+                        yes,
+                        zoom,
+                        connectpocket,
+                        alignligand,
+                        saveobj,
+                        cachedir,
+                        refresh,
+                        cachesize,
+                        tmpdir,
+                        pdb_clean,
+                        ligandstore,
+                        fetchligands,
+                        render,
+                        results_db,
+                        parameters,
+                        traj,
+                        frames,
+                    )
+                    yes = yes
+
+        with profiling.stage('aggregation', Structure=name) as record:
+            # Reads the results of all states from the results database.
+            multistate_pocket_cmap, multistate_pocket_nt_color = results.read_maps(results_db)
+            if not multistate_pocket_cmap:
+                raise FileNotFoundError(f'No state results found in {results_db}')
+
+            # Generates csv output containing pocket characteristics for all states.
+            pc_all_states = results.read_pockets(results_db)
+            pc_all_states.to_csv(
+                f'{out}/{name}_all_states_pocket_characteristics.csv',
+                index=False, float_format='%.2g')
+            record['Pockets'] = len(pc_all_states)
+
+            # Groups the pockets of all states into consensus pockets.
+            members_df, sites_df = ensemble.find_sites(
+                pc_all_states, results.read_centroids(results_db), num_states)
+            sites_df.to_csv(
+                f'{out}/{name}_consensus_pockets.csv', index=False, float_format='%.3g')
+            members_df.to_csv(f'{out}/{name}_consensus_pocket_members.csv', index=False)
+            ensemble.print_sites(sites_df)
+
+        if render == 'deferred':
+            figures.write_render_spec(
+                f'{out}/{name}_all_states_render.json',
+                {
+                    'kind': 'all_states',
+                    'name': name,
+                    'num_states': num_states,
+                    'ss': os.path.abspath(ss) if ss else None,
+                    'alignligand': os.path.abspath(alignligand) if alignligand else None,
+                    'chain': chain,
+                    'dpi': dpi,
+                    'zoom': zoom,
+                    'multistate_pocket_cmap': multistate_pocket_cmap,
+                    'multistate_pocket_nt_color': multistate_pocket_nt_color,
+                },
             )
-            yes = yes
-            util.update_last_processed_state(state_tracker_filename, state)
-            # pc_all_states = pd.concat([pc_all_states, pc_df])
-            # multistate_pocket_cmap[state]=pocket_cmap
-                
-
-        # Generates csv output containing pocket characteristics for all states.
-        pc_files = glob.glob(f"{out}/*/*_out_pocket_characteristics.csv")
-        pc_files = util.natsorted(pc_files)
-
-        # Check if any files match
-        if not pc_files:
-            raise FileNotFoundError(f"No files matching '*_out_pocket_characteristics.csv' found in {out}")
-        # Read and concatenate all matching CSV files into a single DataFrame
-        pc_all_states = pd.concat((pd.read_csv(file) for file in pc_files), ignore_index=True)
-        pc_all_states.to_csv(
-            f'{out}/{name}_all_states_pocket_characteristics.csv',
-            index=False, float_format='%.2g')
-        
-        pocket_cmap_files = glob.glob(f"{out}/*/*_maps.pkl")
-        multistate_pocket_cmap = {}
-        multistate_pocket_nt_color = {}
-        # Loop through all files and load the dictionaries
-        for file_path in pocket_cmap_files:
-            with open(file_path, 'rb') as file:
-                # Load the JSON data (assumed to be a dictionary)
-                data = pickle.load(file)
-                # Merge the current dictionary into the combined dictionary
-                multistate_pocket_cmap.update(data[0])
-                multistate_pocket_nt_color.update(data[1])
-        # Sort the combined dictionary by keys (ascending order)
-        multistate_pocket_cmap = dict(sorted(multistate_pocket_cmap.items()))
-        
+            return
+
+        if render == 'none':
+            return
+
         if ss:
             # Generates a 2D for pockets in all states.
             print(f'Making all states 2D figure...')
@@ -561,9 +999,41 @@ def main(
             zoom
         )
 
+
+def cli():
+    """Command line entry point.
+    `fpocketR batch <manifest>` runs a batch of structures,
+    `fpocketR ligands <source>...` builds the ligand property store,
+    `fpocketR render <path>...` renders figures from deferred render specs,
+    `fpocketR benchmark` times reference workloads against a baseline,
+    `fpocketR synthetic <motif>` generates large structures for scale testing,
+    all other arguments run the pipeline for a single structure.
+    """
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from fpocketR import batch
+        batch.main(**vars(batch.parseArgs(sys.argv[2:])))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'ligands':
+        ligands.main(**vars(ligands.parseArgs(sys.argv[2:])))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'render':
+        from fpocketR import render
+        render.main(**vars(render.parseArgs(sys.argv[2:])))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        from fpocketR import benchmark
+        benchmark.main(**vars(benchmark.parseArgs(sys.argv[2:])))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'synthetic':
+        from fpocketR import synthetic
+        synthetic.main(**vars(synthetic.parseArgs(sys.argv[2:])))
+    else:
+        main(**vars(parseArgs()))
+        memory.print_peak(memory.get_max_memory())
+
+    # Summarizes the stage timings of the run (or batch).
+    if profiling.is_enabled():
+        profiling.print_summary(os.environ[profiling.PROFILE_ENV])
+
     # Close pymol session.
     cmd.quit()
 
 
 if __name__ == "__main__":
-    main(**vars(parseArgs()))
+    cli()
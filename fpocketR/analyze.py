@@ -8,29 +8,22 @@
 # Version 1.3.0
 #
 # -----------------------------------------------------------------------------
-import os
 import math
-from re import findall, sub
 from prody import *
 import numpy as np
+from scipy.spatial import cKDTree
 import pandas as pd
-import requests
 from pymol import cmd
-from rdkit import Chem
-from rdkit.Chem import QED
-import trimesh
-from fpocketR import util
-from prody.utilities import openFile
+from fpocketR import util, surface, ligands, profiling, structures, outputs, memory
 
 
 def analyze_pockets(
-    pdb : str,
+    context : structures.StructureContext,
     pqr_out : str,
     pdb_out : str,
     analysis : str,
     name : str,
     info_txt : str,
-    pockets_out : list[str],
     pdb_code : str,
     chain : str,
     state,
@@ -44,20 +37,108 @@ def analyze_pockets(
     p : float,
     qualityfilter : float,
     knownnt : list[int],
+    saveobj : bool = False,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
     ) -> tuple[pd.DataFrame, prody.AtomGroup]:
 
-    # Parses pdb files and returns prody structure objects.
-    ligand_rna_structure = parsePDB(pdb)
-    out_rna_structure = parsePDB(pdb_out)
-    pocket_structure = parsePQR(pqr_out)
+    # Parses pdb files and returns prody structure objects. The input
+    # structure is parsed once per run and shared through its context.
+    ligand_rna_structure = structures.get_context(context).structure
 
+    # Create real_sphere.pdb ouput be combinding the pqr_out and pdb_out.
+    # pdb_out is parsed once, for the a-spheres and the output structure.
+    spheres, out = get_real_sphere(pqr_out, pdb_out, analysis, name)
+    out_rna_structure = outputs.get_out_atoms(out, name)
+    pocket_structure = outputs.get_sphere_atoms(spheres)
+
+    return analyze_structures(
+        ligand_rna_structure,
+        out_rna_structure,
+        pocket_structure,
+        analysis,
+        name,
+        info_txt,
+        pdb_code,
+        chain,
+        state,
+        ligandchain,
+        ligand,
+        m,
+        M,
+        i,
+        D,
+        A,
+        p,
+        qualityfilter,
+        knownnt,
+        saveobj,
+        ligandstore,
+        fetchligands,
+    )
+
+
+def analyze_structures(
+    ligand_rna_structure : prody.AtomGroup,
+    out_rna_structure : prody.AtomGroup,
+    pocket_structure : prody.AtomGroup,
+    analysis : str,
+    name : str,
+    info_txt : str,
+    pdb_code : str,
+    chain : str,
+    state,
+    ligandchain : str,
+    ligand : str,
+    m : float,
+    M : float,
+    i : int,
+    D : float,
+    A : int,
+    p : float,
+    qualityfilter : float,
+    knownnt : list[int],
+    saveobj : bool = False,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
+    ) -> tuple[pd.DataFrame, prody.AtomGroup]:
+    """Calculates pocket characteristics from parsed structures. Nothing is
+    written to {analysis} unless {saveobj} is set.
+
+    Args:
+        ligand_rna_structure (object): ProDy structure of the RNA-ligand complex.
+        out_rna_structure (object): ProDy structure parsed from fpocket *_out.pdb.
+        pocket_structure (object): ProDy atom group of a-spheres (with radii)
+                                   parsed from the fpocket *_pockets.pqr file.
+        analysis (str): Path directory contianing fpocket outputs for analysis.
+        name (str): Output file name prefix.
+        info_txt (str): Path to fpocket *_info.txt file.
+        pdb_code (str): 4 digit identifier for the PDB structure.
+        chain (str): Chain identifier for desired RNA chain.
+        state (int): Structural state to analyze.
+        ligandchain (str): Chain identifier for desired ligand (default=chain).
+        ligand (str): Ligand residue name (usually a 3-letter code).
+        m (float): Min. a-sphere radius in angstroms.
+        M (float): Max. a-sphere radius in angstroms.
+        i (int): Min. number of a-spheres per pocket.
+        D (float): a-sphere clustering distance in angstroms.
+        A (int): # of electroneg. atoms to define a polar a-sphere.
+        p (float): Max. ratio of apolar a-spheres in a pocket.
+        qualityfilter (float): Minimum fpocket score filter for pockets.
+        knownnt (list[int]): Residue IDs of nts in known pocket.
+        saveobj (bool): Export pocket surface .obj files using PyMOL.
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (bool): Download ligands missing from the ligand store from the PDBe.
+
+    Returns:
+        DataFrame: Characteristics and properities for each pocket.
+        object: Copy of {out_rna_structure} ({out_rna_structure} itself in
+                low-memory mode, see memory.is_low_memory).
+    """
     # Sets ligand chain to first pdb chain by default.
     if ligandchain is None:
         ligandchain = chain[0]
 
-    # Create real_sphere.pdb ouput be combinding the pqr_out and pdb_out.
-    get_real_sphere(pqr_out, pdb_out, analysis, name)
-
     # Creates a dataframe with pocket characteristics from fpocket info.txt
     pc_df = get_characteristics(
         info_txt,
@@ -72,23 +153,28 @@ def analyze_pockets(
         state,
     )
 
-    rna_coords = out_rna_structure.copy()
+    # Low-memory runs use views of the output structure instead of copies.
+    low_memory = memory.is_low_memory()
+    rna_coords = out_rna_structure if low_memory else out_rna_structure.copy()
 
     # If pockets are detected calculate features and add to pc_df.
-    if out_rna_structure.select('resname STP'):
+    stp_selection = out_rna_structure.select('resname STP')
+    if stp_selection:
 
         # Get atomgroup for rna and add pocket characteristics.
-        stp_coords = out_rna_structure.select('resname STP').copy()
+        stp_coords = stp_selection if low_memory else stp_selection.copy()
 
         add_basic_characteristics(
+            out_rna_structure,
             stp_coords,
-            pockets_out,
+            pocket_structure,
             qualityfilter,
             pc_df,
             chain,
             analysis,
             name,
             knownnt,
+            saveobj,
         )
         
         # Get atomgroup for ligand and add ligand characteristics.
@@ -101,16 +187,18 @@ def analyze_pockets(
                 ligand_rna_structure,
                 ligand,
                 ligandchain,
-                analysis,
                 name,
+                ligandstore,
+                fetchligands,
             )
             if ligand_coords:
                 add_ligand_characteristics(
-                    analysis,
                     stp_coords,
                     ligand_coords,
                     ligand,
                     pc_df,
+                    ligandstore,
+                    fetchligands,
                 )
 
     return pc_df, rna_coords
@@ -130,99 +218,49 @@ def reformat_pqr(filename : str):
     Returns:
         str: Path to reformated PQR file. <filename>_prody.pqr
     """
-    pqr = openFile(filename, 'rt')
-    lines = pqr.readlines()
-    pqr.close()
-    reformat=[]
-    atom = False
-
-    for line in lines:
-        startswith = line[0:6].strip()
-
-        if startswith == 'ATOM' or startswith == 'HETATM':
-            atom = True
-            fields = line.split()
-            if fields[5].find('.') != -1:
-            # coords too early as no chid
-                fields.insert(4, '')
-            if len(fields) != 11:
-                try:
-                    fields = fields[:6] + [line[30:38].strip(), line[38:46].strip(), line[46:54].strip()] + line[54:].split()
-                except:
-                    continue
-            
-            serial_str = fields[1]
-            atomname= fields[2]
-            resname = fields[3]
-            chid = fields[5]
-            alt = ' '
-            coordinates_x = fields[6]
-            coordinates_y = fields[7]
-            coordinates_z = fields[8]
-            charges = fields[9]
-            radii = fields[10]
-
-            new_line = (f'{startswith} {serial_str} {atomname} {resname} '
-                        f'{chid} {alt} {coordinates_x} {coordinates_y} '
-                        f'{coordinates_z} {charges} {radii}')
-        else:
-            new_line = line
-
-        reformat.append(new_line)
-    if atom is True:
-        prody_pqr = f'{filename[:-4]}_prody.pqr'
-        with open(prody_pqr, 'w') as f:
-            for new_line in reformat:
-                f.write(f"{new_line}\n")
-        return prody_pqr
-    else: 
+    spheres = outputs.read_pqr(filename)
+    if not len(spheres['radii']):
         return None
+
+    prody_pqr = f'{filename[:-4]}_prody.pqr'
+    with open(prody_pqr, 'w') as f:
+        f.writelines([
+            f'ATOM {serial} O STP {pocket}   {x:.3f} {y:.3f} {z:.3f} 0.00 {radius:.2f}\n'
+            for serial, pocket, (x, y, z), radius in zip(
+                range(1, len(spheres['radii']) + 1), spheres['pockets'].tolist(),
+                spheres['coords'].tolist(), spheres['radii'].tolist())
+        ])
+    return prody_pqr
     
     
+@profiling.profiled('merge')
 def get_real_sphere(pqr_file, pdb_file, analysis, name):
     """Encodes fpocket pocket a-sphere radii into a single .pdb output file.
     a-sphere radii incoded into the B factor column of the output .pdb file.
+    Each input is read once and the output is replaced, not appended to.
     Args:
         pqr_file (string): Path to fpocket *out.pqr file
                            containing a-spheres radii.
         pdb_file (string): Path to fpocket *out.pdb file.
+
+    Returns:
+        dict[str, np.ndarray]: a-spheres (see outputs.read_spheres).
+        dict: Parsed *out.pdb file (see outputs.read_out_pdb).
     """
-    # Opens .pqr and .pdb inputs and .pdb output.
-    with open(pqr_file, 'r') as pqr_file, open(pdb_file, 'r') as pdb_file, \
-            open(f'{analysis}/{name}_out_real_sphere.pdb', 'a') as out:
-        pqr_line = pqr_file.readline()
-        pdb_lines = pdb_file.readlines()
-        # Iterates through Header lines in pqr file
-        while pqr_line.startswith("HEADER"):
-            pqr_line = pqr_file.readline()
-        # Iternates through each line of the pdb file.
-        for pdb_line in pdb_lines:
-            if pdb_line.startswith("HEADER") or pdb_line.startswith("ATOM"):
-                line_str = pdb_line[0:80]
-            elif pdb_line.startswith("HETATM") and 'APOL' not in pdb_line:
-                line_str = pdb_line[0:80]
-            elif pdb_line.startswith("HETATM") and \
-                    pdb_line[24:55] == pqr_line[24:55]:
-                line_str = pdb_line[0:60] + \
-                    pqr_line[65:71] + pdb_line[66:80]
-                # Advance to next line of pqr file.
-                pqr_line = pqr_file.readline()
-            else:
-                print(f"ERROR: pqr_to_pdb. \n"
-                      f"PDB input file: {pdb_file} \n"
-                      f"PQR input file: {pqr_file}")
-                break
-            # Write line to out_real_sphere.pdb file
-            out.write(line_str)
-            out.write('\n')
+    spheres, out = outputs.read_spheres(pqr_file, pdb_file)
+    outputs.write_real_sphere(
+        f'{analysis}/{name}_out_real_sphere.pdb', out, spheres['radii'])
+    return spheres, out
 
 
+@profiling.profiled('ligand')
 def get_ligand_coords(
     ligand_rna_structure : prody.AtomGroup,
     ligand : str,
     ligandchain : str,
-    analysis : str,
     name : str,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
 ) -> tuple[prody.AtomGroup, str]:
     """Gets coordinates and residue name for RNA-binding ligand.
 
@@ -230,8 +268,9 @@ def get_ligand_coords(
         ligand_rna_structure (object): Prody structure of RNA-ligand complex.
         ligand (str): Ligand residue name (usually a 3-letter code).
         ligandchain (str): Chain identifier for desired ligand.
-        analysis (str): Path directory contianing fpocket outputs for analysis.
         name (str): Name of input pdb file.
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (bool): Download ligands missing from the ligand store from the PDBe.
 
     Returns:
         object: ProDy atomgroup of all atoms in known RNA ligand.
@@ -265,24 +304,16 @@ def get_ligand_coords(
         if len(hetatm_resn) > 1:
             resnames_qeds: dict = {}
             for resname in hetatm_resn:
-                try:
-                    response = requests.get(
-                        f'https://www.ebi.ac.uk/pdbe/static/files/pdbechem_v2/{resname}_ideal.sdf')
-                    with open(f'{analysis}/{resname}_ideal.sdf', 'wb') as f:
-                        f.write(response.content)
-                    mol = Chem.MolFromMolFile(f'{analysis}/{resname}_ideal.sdf')
-                    qed = QED.default(mol)
-                    mw : float = Chem.rdMolDescriptors.CalcExactMolWt(mol)
-                    pat = Chem.MolFromSmarts("[#6]")
-                    num_of_carbon : int =len(mol.GetSubstructMatches(pat))
-                    if mw < 100.0 or num_of_carbon <= 3:
-                        qed = 0
-                        continue
-                        
-                except:
+                properties = ligands.get_ligand_properties(
+                    resname, ligandstore, fetchligands)
+                if properties is None:
                     print(f'Error: Not able to calculate QED score for {resname}.\n')
                     qed = 0
-                
+                elif properties['MW'] < 100.0 or properties['Carbon_count'] <= 3:
+                    continue
+                else:
+                    qed = properties['QED_score']
+
                 resnames_qeds[resname] = qed
                 
             # Get ligand with the highest qed score
@@ -326,6 +357,7 @@ def get_ligand_coords(
             return (None, None)
 
 
+@profiling.profiled('characteristics')
 def get_characteristics(
     info_txt : str,
     pdb_code :str,
@@ -366,51 +398,18 @@ def get_characteristics(
         'Ligand_NPR1', 'Ligand_NPR2', 'Ligand_shape'
     ]
 
-    pc_d = {col: [] for col in columns}
-
-    with open(info_txt, 'r') as f:
-
-        poc_count = 1
-
-        for row in f:
-            if 'Pocket' in row:
-                pc_d['Parameters'].append(f'-m {m} -M {M} -i {i} -D {D} '
-                                          f'-A {A} -p {p}')
-                pc_d['Name'].append(name)
-                pc_d['PDB'].append(pdb_code)
-                pc_d['State'].append(state)
-                pc_d['Pocket'].append(int(row.split(' ')[1].strip()))
-                pocket = int(row.split(' ')[1].strip())
-            if 'Score :' in row:
-                if 'Druggability' not in row:
-                    pc_d['Score'].append(float(row.split(':')[1].strip()))
-            if 'Druggability Score :' in row:
-                pc_d['Drug_score'].append(float(row.split(':')[1].strip()))
-            if 'Number of Alpha Spheres :' in row:
-                pc_d['a-sphere'].append(int(row.split(':')[1].strip()))
-            if 'Total SASA :' in row:
-                pc_d['SASA'].append(float(row.split(':')[1].strip()))
-            if 'Volume :' in row:
-                pc_d['Volume'].append(float(row.split(':')[1].strip()))
-            if 'Mean local hydrophobic density' in row:
-                pc_d['Hydrophobic_density'].append(
-                    float(row.split(':')[1].strip()))
-            if 'Apolar alpha sphere proportion' in row:
-                pc_d['Apolar_a-sphere_proportion'].append(
-                    float(row.split(':')[1].strip()))
-            if 'Hydrophobicity score' in row:
-                pc_d['Hydrophobicity_score'].append(
-                    float(row.split(':')[1].strip()))
-            if 'Polarity score:' in row:
-                pc_d['Polarity_score'].append(float(row.split(':')[1].strip()))
-            if 'Flexibility' in row and poc_count == pocket:
-                poc_count += 1
-
-    # Ensure all columns have the same length
-    max_len = max(len(v) for v in pc_d.values())
+    # Descriptors of every pocket, parsed in one pass.
+    info_df = outputs.read_info(info_txt)
+    num_pockets = len(info_df)
+
+    pc_d = {col: [None] * num_pockets for col in columns}
+    pc_d['Parameters'] = [f'-m {m} -M {M} -i {i} -D {D} -A {A} -p {p}'] * num_pockets
+    pc_d['Name'] = [name] * num_pockets
+    pc_d['PDB'] = [pdb_code] * num_pockets
+    pc_d['State'] = [state] * num_pockets
     for col in columns:
-        while len(pc_d[col]) < max_len:
-            pc_d[col].append(None)
+        if col in info_df:
+            pc_d[col] = info_df[col].tolist()
 
     pc_df = pd.DataFrame.from_dict(pc_d)
     pc_df['Filter'] = 'Fail'
@@ -420,109 +419,50 @@ def get_characteristics(
 
 
 def add_basic_characteristics(
+    rna_structure: prody.AtomGroup,
     stp_coords: prody.AtomGroup,
-    pockets_out: list[str],
+    pocket_structure: prody.AtomGroup,
     qualityfilter: float,
     pc_df: pd.DataFrame,
     chain: str,
     analysis: str,
     name: str,
     knownnt: list[int],
+    saveobj: bool = False,
 ) -> None:
     """Adds characteristics to the pocket characteristics DataFrame that do
         not require a ligand to calculate.
     PocketNT: nucleotides in contact with pocket,
-    Geometric Center: X,Y,Z coordinates of pocket center,
+    Pocket NPR: normalized PMI ratios of the a-sphere core volume,
     Filter: Pocket quality filter (Pass or Fail)
     
     Args:
+        rna_structure (object): ProDy structure parsed from fpocket *_out.pdb.
         stp_coords (object): ProDy atom group of a-sphere coordinates.
-        pockets_out list[str]: Valid paths to pockets/pocket*_atm.pdb files.
+        pocket_structure (object): ProDy atom group of a-spheres (with radii)
+                                   parsed from the fpocket *_pockets.pqr file.
         qualityfilter (float): Minimum fpocket score filter for pockets.
         pc_df (DataFrame): Characteristics and properities for each pocket.
         chain (str): Chain identifier for desired RNA chain (default='A').
         analysis (str): path directory contianing fpocket outputs for analysis.
         name (str): Name of input pdb file.
+        saveobj (bool): Export pocket surface .obj files using PyMOL.
     """
-    pocketNT = []
-    pocket_npr1 = []
-    pocket_npr2 = []
-
-    for i, _ in enumerate(stp_coords.iterResidues()):
-        
-        # Calculate pocketNT (nucleotides near each pocket).
-        x = pockets_out[i]
-        with open(x, 'r') as f:
-            tmp0 = f.read()
-            pc_dict = {'Pocket': [(int(x[1]))] for x in findall(
-                r'(\w+\s\w+\s*)(\d)(:)(\n)', tmp0)}
-
-            pc_dict.update({x[1].strip(): float(x[2]) for x in findall(
-                r'(\w+\s\w+\s*-\s*)(.+):\s*([\d.-]+)(\n)', tmp0)})
-
-        structure = parsePDB(x)
-
-        if ',' in chain:
-            chain = chain.replace(',', ' & ')
-        selection = structure.select(f'chain {chain}')
-        nt = selection.getResnums().tolist()
-        pocketNT.append(np.unique(nt).tolist())
-        
-        # Export surface obj files for each pocket.
-        cmd.load(f'{analysis}/{name}_out_real_sphere.pdb')
-        cmd.hide('everything')
-        cmd.remove(f'not resn STP or not resi {i+1}')
-        cmd.alter('resn STP', 'vdw = b - 1.65')
-        cmd.rebuild('all')
-        cmd.set('surface_quality', 1)
-        cmd.show('surface')
-        cmd.save(
-            f'{analysis}/pockets/pocket{i+1}_surf.obj',
-            f'pocket_{i+1}_surface'
-        )
-        cmd.reinitialize()
-
-        # Create mesh object for each pocket.
-        try:
-            mesh = trimesh.load(f'{analysis}/pockets/pocket{i+1}_surf.obj')
-        except Exception as e:
-            print(f"Error loading mesh for pocket {i+1}: {e}")
-            pocket_npr1.append(np.nan)
-            pocket_npr2.append(np.nan)
-            continue
-
-        # Calc inertia tensor for each pocket.
-        try:
-            inertia = mesh.moment_inertia
-            if inertia.ndim != 2:
-                raise ValueError("Inertia tensor is not 2-dimensional")
-        except Exception as e:
-            print(f"Error calculating inertia tensor for pocket {i+1}: {e}")
-            pocket_npr1.append(np.nan)
-            pocket_npr2.append(np.nan)
-            continue
-
-        # calculate eigen values and eigen vectors.
-        try:
-            eigvals, _ = np.linalg.eig(inertia)
-        except Exception as e:
-            print(f"Error calculating eigenvalues for pocket {i+1}: {e}")
-            pocket_npr1.append(np.nan)
-            pocket_npr2.append(np.nan)
-            continue
-
-        # sort eigen values > (I1, I2, I3)
-        eig_ord = np.argsort(eigvals)
-
-        # Calculate the normalize PMI ratios for each pocket.
-        sorted_eigvals = eigvals[eig_ord]
-        I1 = sorted_eigvals[0]
-        I2 = sorted_eigvals[1]
-        I3 = sorted_eigvals[2]
-        npr1 = I1 / I3
-        npr2 = I2 / I3
-        pocket_npr1.append(npr1)
-        pocket_npr2.append(npr2)
+    # Calculate pocketNT (nucleotides in contact with each pocket).
+    pocketNT = get_pocket_nt(rna_structure, stp_coords, chain)
+
+    # Export surface obj files for each pocket.
+    if saveobj:
+        save_pocket_surfaces(analysis, name, len(pocketNT))
+
+    # Calculate the normalize PMI ratios for all pockets from a-sphere cores.
+    pockets, pocket_npr = surface.calc_pocket_npr(
+        pocket_structure.getCoords(),
+        pocket_structure.getRadii(),
+        pocket_structure.getResnums(),
+    )
+    pocket_npr = pd.DataFrame(pocket_npr, index=pockets,
+                              columns=['Pocket_NPR1', 'Pocket_NPR2'])
 
     # Check if lengths match
     if len(pocketNT) != len(pc_df.index):
@@ -530,8 +470,8 @@ def add_basic_characteristics(
 
     # Add pocketNT and pocket npr data to pc dataframe.
     pc_df['PocketNT'] = pocketNT
-    pc_df['Pocket_NPR1'] = pocket_npr1
-    pc_df['Pocket_NPR2'] = pocket_npr2
+    pc_df['Pocket_NPR1'] = pc_df['Pocket'].map(pocket_npr['Pocket_NPR1'])
+    pc_df['Pocket_NPR2'] = pc_df['Pocket'].map(pocket_npr['Pocket_NPR2'])
     pc_df['Pocket_shape'] = 'Balanced'
     pc_df.loc[pc_df.eval('Pocket_NPR1 - Pocket_NPR2 + 0.5 < 0'), 'Pocket_shape'] = 'Rod-like'
     pc_df.loc[pc_df.eval('- Pocket_NPR1 - Pocket_NPR2 + 1.5 < 0'), 'Pocket_shape'] = 'Sphere-like'
@@ -548,12 +488,197 @@ def add_basic_characteristics(
         )
 
 
+@profiling.profiled('pocket_nt')
+def get_pocket_nt(
+    rna_structure : prody.AtomGroup,
+    stp_coords : prody.AtomGroup,
+    chain : str,
+) -> list[list[int]]:
+    """Finds the nucleotides in contact with every pocket in one pass.
+    Each a-sphere is a Voronoi vertex touching exactly four heavy atoms
+    (fpocket ignores hydrogens), so the contact atoms of all pockets are
+    found with a single 4-nearest-neighbour query on a KD-tree of RNA atoms.
+    This reproduces the atoms listed in fpocket's pockets/pocket*_atm.pdb.
+
+    Args:
+        rna_structure (object): ProDy structure parsed from fpocket *_out.pdb.
+        stp_coords (object): ProDy atom group of a-sphere coordinates.
+        chain (str): Chain identifier(s) for RNA chain (e.g. 'A' or 'A,B').
+
+    Returns:
+        list[list[int]]: Sorted residue numbers in contact with each pocket,
+                         ordered by pocket number.
+    """
+    atoms = rna_structure.select('not resname STP and not hydrogen')
+    tree = cKDTree(atoms.getCoords())
+    _, contacts = tree.query(stp_coords.getCoords(), k=4)
+
+    pocket_ids = np.repeat(stp_coords.getResnums(), contacts.shape[1])
+    contacts = contacts.ravel()
+
+    # Keeps contacts with atoms in the selected RNA chain(s).
+    in_chain = np.isin(atoms.getChids()[contacts], chain.split(','))
+    pairs = np.unique(np.column_stack((
+        pocket_ids[in_chain],
+        atoms.getResnums()[contacts[in_chain]],
+    )), axis=0)
+
+    pockets = np.unique(stp_coords.getResnums())
+    splits = np.searchsorted(pairs[:, 0], pockets)[1:]
+
+    return [nts.tolist() for nts in np.split(pairs[:, 1], splits)]
+
+
+def get_pocket_centroids(rna_coords : prody.AtomGroup) -> dict[int, list[float]]:
+    """Calculates the centroid of the a-sphere centers of every pocket.
+
+    Args:
+        rna_coords (object): ProDy structure with a-spheres (resname STP),
+                             e.g. parsed from *_out_real_sphere.pdb.
+
+    Returns:
+        dict[int, list[float]]: x, y, z centroid of each pocket.
+    """
+    stp = rna_coords.select('resname STP')
+    if stp is None:
+        return {}
+    pockets, index = np.unique(stp.getResnums(), return_inverse=True)
+    counts = np.bincount(index)
+    centroids = np.column_stack([
+        np.bincount(index, weights=axis) / counts for axis in stp.getCoords().T])
+    return {int(pocket): centroid.tolist() for pocket, centroid in zip(pockets, centroids)}
+
+
+def calc_overlap_scores(
+    sphere_coords : np.ndarray,
+    pocket_ids : np.ndarray,
+    ligands_coords : list[np.ndarray],
+    cutoff : float = 3.0,
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """Scores the overlap between every pocket and one or more ligands using
+    KD-trees instead of per-pocket ProDy selections.
+    Pocket overlap:  Ratio of a-spheres within {cutoff} of the ligand.
+    Ligand overlap:  Ratio of ligand atoms within {cutoff} of the a-spheres.
+    Center criteria: Distance from the geometric center of the pocket to the
+                     closest ligand atom.
+
+    Args:
+        sphere_coords (np.ndarray): n x 3 a-sphere centers.
+        pocket_ids (np.ndarray): n pocket numbers (STP residue numbers).
+        ligands_coords (list[np.ndarray]): m x 3 atom coordinates of each ligand.
+        cutoff (float): Contact distance in angstroms (default=3.0).
+
+    Returns:
+        np.ndarray: Sorted unique pocket numbers.
+        dict[str, np.ndarray]: Pocket_overlap, Ligand_overlap and
+            Center_criteria arrays (number of ligands x number of pockets).
+    """
+    pockets, pocket_idx, sphere_counts = np.unique(
+        pocket_ids, return_inverse=True, return_counts=True)
+    num_pockets = len(pockets)
+    centers = np.stack([
+        np.bincount(pocket_idx, weights=sphere_coords[:, dim],
+                    minlength=num_pockets)
+        for dim in range(3)
+    ], axis=1) / sphere_counts[:, None]
+    sphere_tree = cKDTree(sphere_coords)
+
+    scores = {
+        'Pocket_overlap': np.zeros((len(ligands_coords), num_pockets)),
+        'Ligand_overlap': np.zeros((len(ligands_coords), num_pockets)),
+        'Center_criteria': np.zeros((len(ligands_coords), num_pockets)),
+    }
+    for lig, ligand_coords in enumerate(ligands_coords):
+        ligand_tree = cKDTree(ligand_coords)
+
+        # a-spheres with a ligand atom within the cutoff.
+        sphere_dist, _ = ligand_tree.query(sphere_coords, k=1)
+        overlap_spheres = np.bincount(
+            pocket_idx, weights=sphere_dist <= cutoff, minlength=num_pockets)
+        scores['Pocket_overlap'][lig] = overlap_spheres / sphere_counts
+
+        # Ligand atoms with an a-sphere of each pocket within the cutoff.
+        pairs = ligand_tree.sparse_distance_matrix(
+            sphere_tree, cutoff, output_type='ndarray')
+        atom_pocket = np.unique(np.column_stack(
+            (pairs['i'], pocket_idx[pairs['j']])), axis=0)
+        overlap_atoms = np.bincount(
+            atom_pocket[:, 1].astype(int), minlength=num_pockets)
+        scores['Ligand_overlap'][lig] = overlap_atoms / len(ligand_coords)
+
+        # Minimum distance between pocket centers and ligand atoms.
+        scores['Center_criteria'][lig], _ = ligand_tree.query(centers, k=1)
+
+    return pockets, scores
+
+
+def score_ligands(
+    stp_coords : prody.AtomGroup,
+    ligands : dict[str, prody.AtomGroup],
+) -> pd.DataFrame:
+    """Scores every pocket against several candidate ligands at once.
+
+    Args:
+        stp_coords (object): ProDy atom group of a-sphere coordinates.
+        ligands (dict[str, object]): ProDy atom groups keyed by ligand ID.
+
+    Returns:
+        DataFrame: Ligand_ID, Pocket, Pocket_overlap, Ligand_overlap,
+                   Center_criteria and Type (Known or Novel) for every
+                   ligand and pocket pair.
+    """
+    pockets, scores = calc_overlap_scores(
+        stp_coords.getCoords(),
+        stp_coords.getResnums(),
+        [ligand.getCoords() for ligand in ligands.values()],
+    )
+    score_df = pd.DataFrame({
+        'Ligand_ID': np.repeat(list(ligands), len(pockets)),
+        'Pocket': np.tile(pockets, len(ligands)),
+        **{column: values.ravel() for column, values in scores.items()},
+    })
+    score_df['Type'] = 'Novel'
+    score_df.loc[
+        (score_df['Ligand_overlap'] >= 0.33) &
+        (score_df['Pocket_overlap'] >= 0.33) &
+        (score_df['Center_criteria'] <= 4), 'Type'
+    ] = 'Known'
+
+    return score_df
+
+
+@profiling.profiled('surfaces')
+def save_pocket_surfaces(analysis : str, name : str, num_pockets : int) -> None:
+    """Exports a PyMOL surface .obj file for each pocket.
+
+    Args:
+        analysis (str): path directory contianing fpocket outputs for analysis.
+        name (str): Name of input pdb file.
+        num_pockets (int): Number of pockets.
+    """
+    for i in range(num_pockets):
+        cmd.load(f'{analysis}/{name}_out_real_sphere.pdb')
+        cmd.hide('everything')
+        cmd.remove(f'not resn STP or not resi {i+1}')
+        cmd.alter('resn STP', 'vdw = b - 1.65')
+        cmd.rebuild('all')
+        cmd.set('surface_quality', 1)
+        cmd.show('surface')
+        cmd.save(
+            f'{analysis}/pockets/pocket{i+1}_surf.obj',
+            f'pocket_{i+1}_surface'
+        )
+        cmd.reinitialize()
+
+
+@profiling.profiled('ligand')
 def add_ligand_characteristics(
-    analysis : str,
     stp_coords : prody.AtomGroup,
     ligand_coords : prody.AtomGroup,
     ligand : str,
     pc_df : pd.DataFrame,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
 ) -> None:
     """Adds characteristics to the pocket characteristics DataFrame that
        require the presence of a ligand to calculate.
@@ -564,80 +689,35 @@ def add_ligand_characteristics(
           pocket overlap, ligand overlap, and center criteria.
 
     Args:
-        analysis (str): path directory contianing fpocket outputs for analysis.
         stp_coords (object): ProDy atom group of a-sphere coordinates.
         ligand_coords (object): ProDy atom group of ligand coordinates.
         ligand (str): Ligand residue name (usually a 3-letter code).
         pc_df (DataFrame): Characteristics and properities for each pocket.
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (bool): Download ligands missing from the ligand store from the PDBe.
     """
 
-    pocket_overlap = []
-    ligand_overlap = []
-    center_criteria = []
-
     # Calculate the normalize PMI ratios for the ligand.
-    ligand_npr1, ligand_npr2 = util.calc_npr(ligand_coords)
+    ligand_npr1, ligand_npr2 = util.calc_npr_batch([ligand_coords])[0]
 
-    #Calculate ligand QED score.
-    if not os.path.isfile(f'{analysis}/{ligand}_ideal.sdf'):
-        try:
-            response = requests.get(
-                f'https://www.ebi.ac.uk/pdbe/static/files/pdbechem_v2/{ligand}_ideal.sdf')
-            with open(f'{analysis}/{ligand}_ideal.sdf', 'wb') as f:
-                f.write(response.content)
-        except:
-            print(f'Error: Not able download ligand ideal structure for {ligand}.\n')
-            qed = np.nan
-    try:
-        mol = Chem.MolFromMolFile(f'{analysis}/{ligand}_ideal.sdf')
-        qed = QED.default(mol)
-    except:
+    # Look up ligand QED score.
+    properties = ligands.get_ligand_properties(ligand, ligandstore, fetchligands)
+    if properties is None:
         print(f'Error: Not able calculate qed score for ligand {ligand}.\n')
         qed = np.nan
+    else:
+        qed = properties['QED_score']
 
-    # Iterates through each pocket (residue).
-    for _, residue in enumerate(stp_coords.iterResidues()):
-        pocket = residue.getCoords()
-
-        # Calculate ratio of a-spheres in each pocket that is near the ligand.
-        pocket_overlap_sele = residue.select(
-            f'within 3 of ligand', ligand=ligand_coords)
-        if pocket_overlap_sele is None:
-            pocket_overlap.append(0)
-        else:
-            # Calculates total number of a-spheres in pocket.
-            _, pocket_stp_count = np.unique(
-                residue.getResnums(), return_counts=True)
-
-            # Calculates number of overlapped a-spheres in pocket.
-            _, pocket_overlap_stp_count = np.unique(
-                pocket_overlap_sele.getResnums(), return_counts=True)
-
-            pocket_overlap.append(float(
-                pocket_overlap_stp_count / pocket_stp_count))
-
-        # Calculate ratio of a-spheres in each pocket that is near the ligand.
-        ligand_overlap_sele = ligand_coords.select(
-            f'within 3 of pocket', pocket=residue)
-        if ligand_overlap_sele is None:
-            ligand_overlap.append(0)
-        else:
-            # Calculates total number of atoms in ligand.
-            ligand_atom_count = ligand_coords.numAtoms()
-
-            # Calculates number of overlapped atoms in ligand.
-            ligand_overlap_atom_count = ligand_overlap_sele.numAtoms()
+    # Scores overlap between all pockets and the ligand in one pass.
+    _, scores = calc_overlap_scores(
+        stp_coords.getCoords(),
+        stp_coords.getResnums(),
+        [ligand_coords.getCoords()],
+    )
+    pocket_overlap = scores['Pocket_overlap'][0]
+    ligand_overlap = scores['Ligand_overlap'][0]
+    center_criteria = scores['Center_criteria'][0]
 
-            ligand_overlap.append(
-                ligand_overlap_atom_count / ligand_atom_count)
-        
-        # Calculate minimum distance between pocket center and ligand atoms.
-        pocket_center = calcCenter(pocket)
-        center_distance_l = calcDistance(pocket_center, ligand_coords)
-        center_distance = min(center_distance_l)
-        center_criteria.append(center_distance)
-        
-        
     pc_df['Ligand_ID'] = ligand
     # Add Ligand overlap and Center criteria to pc dataframe.
     pc_df['Pocket_overlap'] = pocket_overlap
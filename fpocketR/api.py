@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# In-memory Python API for finding and characterizing RNA pockets
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import os
+import tempfile
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from prody import AtomGroup
+from fpocketR import (
+    analyze, cache, figures, ligands, outputs, pocket, profiling, structures,
+    util, workspace)
+
+
+@dataclass
+class FpocketParameters:
+    """fpocket pocket detection parameters (fpocketR defaults for RNA)."""
+    m : float = 3.0     # Min. a-sphere radius in angstroms.
+    M : float = 5.7     # Max. a-sphere radius in angstroms.
+    i : int = 42        # Min. number of a-spheres per pocket.
+    D : float = 1.65    # a-sphere clustering distance in angstroms.
+    A : int = 3         # # of electroneg. atoms to define a polar a-sphere.
+    p : float = 0.0     # Max. ratio of apolar a-spheres in a pocket.
+
+
+@dataclass
+class PocketResult:
+    """Pockets found in one state of an RNA structure.
+
+    Attributes:
+        name (str): Output file name prefix (includes the state).
+        chain (str): Chain identifier(s) of the analyzed RNA.
+        state (int): Structural state that was analyzed (None for the first).
+        params (FpocketParameters): fpocket parameters.
+        pockets (DataFrame): Pocket characteristics (one row per pocket,
+                             same columns as *_pocket_characteristics.csv).
+        structure (object): ProDy structure of the cleaned RNA and the
+                            a-spheres (resname STP, radii in the beta column).
+        sphere_coords (np.ndarray): n x 3 a-sphere centers.
+        sphere_radii (np.ndarray): n a-sphere radii.
+        sphere_pockets (np.ndarray): n pocket numbers of the a-spheres.
+        pocket_nt (dict[int, list[int]]): Residue numbers in contact with
+                                          each pocket.
+        pocket_cmap (dict[int, tuple]): Color of each passing pocket.
+        pocket_nt_color (list[dict]): Nucleotides and color of each passing
+                                      pocket (for 2D figures).
+    """
+    name : str
+    chain : str
+    state : int
+    params : FpocketParameters
+    pockets : pd.DataFrame
+    structure : AtomGroup
+    sphere_coords : np.ndarray
+    sphere_radii : np.ndarray
+    sphere_pockets : np.ndarray
+    pocket_nt : dict[int, list[int]] = field(default_factory=dict)
+    pocket_cmap : dict[int, tuple] = field(default_factory=dict)
+    pocket_nt_color : list[dict] = field(default_factory=list)
+
+    def write(
+        self,
+        out : str,
+        render : str = 'none',
+        dpi : int = 300,
+        zoom : float = 5.0,
+    ) -> str:
+        """Writes the pocket characteristics (.csv) and the RNA structure with
+        a-spheres (*_out_real_sphere.pdb) to {out}/{name}_out.
+
+        Args:
+            out (str): Path to the output parent directory.
+            render (str): Render the 3D figure now ('inline'), write a render
+                          spec for `fpocketR render` ('deferred'), or skip
+                          figures ('none').
+            dpi (int): Figure resolution in dpi.
+            zoom (float): Zoom buffer distance (Å) for 3D figures.
+
+        Returns:
+            str: Path to the output directory.
+        """
+        directory = os.path.join(out, f'{self.name}_out')
+        os.makedirs(directory, exist_ok=True)
+
+        pocket.write_pdb(
+            os.path.join(directory, f'{self.name}_out_real_sphere.pdb'),
+            self.structure)
+        self.pockets.to_csv(
+            os.path.join(directory, f'{self.name}_out_pocket_characteristics.csv'),
+            index=False, float_format='%.2g')
+
+        if render == 'inline':
+            figures.make_3D_figure(
+                None, self.state, directory, self.name, dpi, self.chain, zoom,
+                self.pocket_cmap, None)
+        elif render == 'deferred':
+            scores = self.pockets.loc[self.pockets['Filter'] == 'Pass', 'Score']
+            figures.write_render_spec(
+                os.path.join(directory, f'{self.name}_render.json'),
+                {
+                    'kind': 'state',
+                    'name': self.name,
+                    'state': self.state,
+                    'ss': None,
+                    'alignligand': None,
+                    'chain': self.chain,
+                    'dpi': dpi,
+                    'zoom': zoom,
+                    'connectpocket': False,
+                    'score': float(scores.max()) if len(scores) else None,
+                    'seq_cmap': None,
+                    'pocket_cmap': self.pocket_cmap,
+                    'pocket_nt_color': self.pocket_nt_color,
+                },
+            )
+
+        return directory
+
+
+def find_pockets(
+    structure,
+    coords : np.ndarray = None,
+    chain : str = None,
+    state : int = None,
+    params = None,
+    ligand : str = None,
+    ligandchain : str = None,
+    knownnt : list[int] = None,
+    qualityfilter : float = 0.0,
+    name : str = None,
+    cachedir : str = None,
+    refresh : bool = False,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+    tmpdir : str = workspace.DEFAULT_TMPDIR,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
+) -> PocketResult:
+    """Finds and characterizes pockets in an RNA structure without writing
+    output files. fpocket itself only reads files, so the cleaned RNA is
+    written to a temporary workspace that is removed before returning.
+
+    Args:
+        structure (object): ProDy structure (AtomGroup) or path to a .pdb or
+                           .cif file (optionally gzip-compressed).
+        coords (np.ndarray): n x 3 (or states x n x 3) coordinates replacing
+                             those of {structure} (e.g. simulation frames).
+        chain (str): Chain identifier(s) for RNA (Default: first RNA chain).
+        state (int): Structural state to analyze (Default: first state).
+        params (FpocketParameters): fpocket parameters (or a dict of them).
+        ligand (str): Ligand residue name used to identify known pockets
+                      (None: no ligand).
+        ligandchain (str): Chain identifier for the ligand (Default: chain).
+        knownnt (list[int]): Residue IDs of nts in known pocket.
+        qualityfilter (float): Minimum fpocket score filter for pockets.
+        name (str): Name of the structure (Default: structure title).
+        cachedir (str): Path to the cache directory (None disables caching).
+        refresh (bool): Reruns fpocket and replaces cached outputs.
+        cachesize (float): Maximum cache size in MB.
+        tmpdir (str): Directory for the temporary workspace.
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (bool): Download ligands missing from the ligand store from the PDBe.
+
+    Returns:
+        PocketResult: Pocket table, a-spheres, pocket nucleotides and colors.
+    """
+    if isinstance(structure, str):
+        structure = structures.parse_structure(structure, altloc='all')
+    if name is None:
+        name = structure.getTitle()
+    structure = structure.copy()
+
+    if coords is not None:
+        structure.delCoordset(list(range(structure.numCoordsets())))
+        structure.setCoords(np.asarray(coords, dtype=float))
+    if state:
+        structure.setACSIndex(state - 1)
+
+    if params is None:
+        params = FpocketParameters()
+    elif isinstance(params, dict):
+        params = FpocketParameters(**params)
+
+    if chain is None:
+        chain = util.get_first_rna_chain(structure)
+    else:
+        util.is_rna_chain(structure, chain)
+
+    prefix = f'{name}_state{state}' if state else name
+    with profiling.tagged(name, state), \
+            workspace.workspace(tempfile.gettempdir(), name, tmpdir) as workdir:
+        pdb_clean = os.path.join(workdir, f'{name}_clean.pdb')
+        with profiling.stage('clean'):
+            rna = pocket.clean_structure(structure)
+            pocket.write_pdb(pdb_clean, rna)
+        source_dir = pocket.get_fpocket_outputs(
+            pdb_clean, name, chain, state,
+            params.m, params.M, params.i, params.D, params.A, params.p,
+            cachedir, refresh, cachesize)
+
+        stem = os.path.join(source_dir, f'{name}_clean')
+        out_rna_structure = outputs.get_out_atoms(
+            outputs.read_out_pdb(f'{stem}_out.pdb'), name)
+        pocket_structure = outputs.get_sphere_atoms(
+            outputs.read_pqr(f'{stem}_pockets.pqr'))
+        pc_df, rna_coords = analyze.analyze_structures(
+            structure,
+            out_rna_structure,
+            pocket_structure,
+            workdir,
+            prefix,
+            f'{stem}_info.txt',
+            name[0:4],
+            chain,
+            state,
+            ligandchain,
+            ligand if ligand else 'none',
+            params.m,
+            params.M,
+            params.i,
+            params.D,
+            params.A,
+            params.p,
+            qualityfilter,
+            knownnt,
+            False,
+            ligandstore,
+            fetchligands,
+        )
+        profiling.set_tags(Pockets=len(pc_df))
+
+    # a-sphere radii are stored in the beta column, as in *_real_sphere.pdb.
+    if pocket_structure is not None:
+        sphere_coords = pocket_structure.getCoords()
+        sphere_radii = pocket_structure.getRadii()
+        sphere_pockets = pocket_structure.getResnums()
+        stp = np.flatnonzero(rna_coords.getResnames() == 'STP')
+        betas = rna_coords.getBetas()
+        betas[stp] = sphere_radii
+        rna_coords.setBetas(betas)
+    else:
+        sphere_coords = np.zeros((0, 3))
+        sphere_radii = np.zeros(0)
+        sphere_pockets = np.zeros(0, dtype=int)
+
+    pocket_nt = {}
+    pocket_cmap, pocket_nt_color = {}, []
+    if len(pc_df) and pc_df['PocketNT'].notna().all():
+        pocket_nt = dict(zip(pc_df['Pocket'].astype(int), pc_df['PocketNT']))
+        _, pocket_cmap, pocket_nt_color = figures.get_colorNT(
+            pc_df,
+            len(rna_coords.select("name O2'")),
+            util.get_offset(rna, chain, None),
+            rna_coords,
+            False,
+            chain,
+        )
+
+    return PocketResult(
+        name=prefix,
+        chain=chain,
+        state=state,
+        params=params,
+        pockets=pc_df,
+        structure=rna_coords,
+        sphere_coords=sphere_coords,
+        sphere_radii=sphere_radii,
+        sphere_pockets=sphere_pockets,
+        pocket_nt=pocket_nt,
+        pocket_cmap=pocket_cmap,
+        pocket_nt_color=pocket_nt_color,
+    )
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for running fpocketR on a batch of structures
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import argparse
+import csv
+import os
+import shlex
+import time
+import pandas as pd
+from concurrent.futures import as_completed
+from fpocketR import parallel, profiling, util
+
+# Options whose value is a path that must survive running in a scratch dir.
+PATH_OPTIONS = ('pdb', 'ss', 'traj', 'out', 'alignligand', 'tmpdir',
+                'ligandstore', 'cachedir', 'profile')
+
+# Path options that may not exist yet (created by the run).
+OUTPUT_OPTIONS = ('out', 'tmpdir', 'ligandstore', 'cachedir', 'profile')
+
+
+def read_manifest(manifest : str) -> list[list[str]]:
+    """Reads a batch manifest and converts each entry to fpocketR arguments.
+    Two manifest formats are supported:
+        - Tab separated table with a header of fpocketR option names
+          (e.g. pdb, ss, chain, state, ligand, out, m, M, i, D, yes).
+        - Text file with fpocketR command-line arguments (one job per line),
+          as used by demo/batch_submission_bash/fpocketR_batch_file.txt.
+    Empty lines and lines starting with '#' are ignored.
+
+    Args:
+        manifest (str): Path to the batch manifest.
+
+    Returns:
+        list[list[str]]: fpocketR command-line arguments for each entry.
+    """
+    util.is_accessible(manifest, 'manifest')
+    with open(manifest, 'r') as f:
+        lines = [line.rstrip('\n') for line in f
+                 if line.strip() and not line.startswith('#')]
+
+    if not lines:
+        raise ValueError(f'The manifest does not contain any entries: {manifest}')
+
+    if lines[0].lstrip().startswith('-'):
+        return [shlex.split(line) for line in lines]
+
+    from fpocketR.__main__ import get_parser
+    actions = [action for action in get_parser()._actions
+               if action.option_strings]
+    option_strings = {
+        action.dest: action.option_strings[-1] for action in actions
+    }
+    flags = [action.dest for action in actions if action.nargs == 0]
+
+    entries = []
+    for row in csv.DictReader(lines, delimiter='\t'):
+        argv = []
+        for column, value in row.items():
+            value = (value or '').strip()
+            if column not in option_strings:
+                raise KeyError(f'Unknown manifest column: {column}')
+            if not value:
+                continue
+            if column in flags:
+                if value.lower() in ('1', 'true', 'y', 'yes'):
+                    argv.append(option_strings[column])
+            else:
+                argv.extend([option_strings[column], value])
+        entries.append(argv)
+
+    return entries
+
+
+def run_entry(index : int, argv : list[str], cwd : str) -> dict:
+    """Runs fpocketR for one manifest entry inside a scratch directory.
+    Failures are recorded instead of raised so one bad structure does not
+    stop the batch.
+
+    Args:
+        index (int): Row number of the entry in the manifest.
+        argv (list[str]): fpocketR command-line arguments.
+        cwd (str): Directory that relative paths in the manifest refer to.
+
+    Returns:
+        dict: Per-structure status, wall time and failure reason.
+    """
+    from fpocketR.__main__ import get_parser, main
+
+    start = time.perf_counter()
+    record = {'Row': index, 'PDB': None, 'Name': None, 'Out': None,
+              'Status': 'Failed', 'Wall_time': None, 'Error': None}
+    try:
+        args = vars(get_parser().parse_args(argv))
+        record['PDB'] = args['pdb']
+        record['Name'] = args['name']
+
+        # Resolves relative paths before leaving the manifest directory.
+        if args['out'] is None:
+            args['out'] = util.get_default_out(args['pdb'], args['state'])
+        for option in PATH_OPTIONS:
+            path = args[option]
+            if path and (option in OUTPUT_OPTIONS or os.path.isfile(path)):
+                args[option] = os.path.abspath(path)
+        record['Out'] = args['out']
+
+        # Downloaded structures are kept out of the manifest directory.
+        with parallel.scratch_directory(cwd, f'batch{index}'):
+            main(**args)
+        record['Status'] = 'Success'
+
+    except (Exception, SystemExit) as e:
+        record['Error'] = f'{type(e).__name__}: {e}'
+        print(f'ERROR: Manifest row {index} failed.\n{record["Error"]}\n')
+
+    record['Wall_time'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_batch(
+    manifest : str,
+    jobs : int,
+    yes : bool,
+    report : str,
+) -> pd.DataFrame:
+    """Runs fpocketR for every entry in a batch manifest using a pool of
+    long-lived workers, so imports are paid once per worker, not per entry.
+
+    Args:
+        manifest (str): Path to the batch manifest.
+        jobs (int): Number of worker processes.
+        yes (bool): Overwrite output files and directories for all entries.
+        report (str): Path to the tab separated run report.
+
+    Returns:
+        DataFrame: Run report with per-structure status, wall time and error.
+    """
+    entries = read_manifest(manifest)
+    if yes:
+        entries = [argv + ['--yes'] for argv in entries]
+
+    cwd = os.getcwd()
+    print(f'Running {len(entries)} manifest entries using {jobs} jobs.\n')
+
+    if jobs > 1:
+        records = []
+        with parallel.get_pool(jobs) as pool:
+            futures = [pool.submit(run_entry, index, argv, cwd)
+                       for index, argv in enumerate(entries, start=1)]
+            for future in as_completed(futures):
+                records.append(future.result())
+    else:
+        records = [run_entry(index, argv, cwd)
+                   for index, argv in enumerate(entries, start=1)]
+
+    report_df = pd.DataFrame.from_records(records).sort_values('Row')
+    report_df.to_csv(report, sep='\t', index=False)
+
+    success = (report_df['Status'] == 'Success').sum()
+    print(f'\n{success}/{len(report_df)} manifest entries finished successfully.\n'
+          f'Run report: {report}')
+
+    return report_df
+
+
+# -----------------------------------------------------------------------------
+def parseArgs(argv : list[str] = None):
+    prs = argparse.ArgumentParser(prog='fpocketR batch')
+
+    prs.add_argument(
+        'manifest',
+        type=str,
+        help='Path to a tab separated manifest with a header of fpocketR '
+        'option names, or a text file of fpocketR arguments (one job per line).',
+    )
+    prs.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of worker processes (1).',
+    )
+    prs.add_argument(
+        '-y',
+        '--yes',
+        required=False,
+        action='store_true',
+        help='Answers yes to user prompts for overwriting files for all entries (False).',
+    )
+    prs.add_argument(
+        '-r',
+        '--report',
+        type=str,
+        required=False,
+        default='fpocketR_batch_report.tsv',
+        help='Path to the batch run report (fpocketR_batch_report.tsv).',
+    )
+
+    prs.add_argument(
+        '--profile',
+        type=str,
+        required=False,
+        default=profiling.DEFAULT_PROFILE,
+        help='Appends the wall time, CPU time and memory use of every '
+        'stage to a JSON lines report (Default: $FPOCKETR_PROFILE or None).',
+    )
+
+    args = prs.parse_args(argv)
+    return args
+
+
+def main(
+    manifest : str, jobs : int, yes : bool, report : str, profile : str = None
+):
+    """Runs fpocketR for all entries in a batch manifest."""
+    if profile:
+        profiling.enable(profile)
+    run_batch(manifest, jobs, yes, report)
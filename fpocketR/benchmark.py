@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for benchmarking fpocketR on reference workloads
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import metadata
+import numpy as np
+import pandas as pd
+from fpocketR import profiling, structures, synthetic
+
+# Repository root; reference workloads are given relative to it.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNAKEMAKE_DIR = os.path.join('demo', 'batch_submission_snakemake')
+
+# Reference workloads: run mode and fpocketR arguments (paths relative to
+# REPO_ROOT). The batch workload is built from SNAKEMAKE_DIR.
+WORKLOADS = {
+    '8f4o': {
+        'mode': 'single',
+        'args': ['-pdb', 'fpocketR/data/8f4o.pdb', '-l', 'no', '-al', 'False'],
+    },
+    'TPP_apo_holo': {
+        'mode': 'single',
+        'args': ['-pdb', 'fpocketR/data/8f4o.pdb', '-al', 'fpocketR/data/2gdi.pdb',
+                 '-l', 'no'],
+    },
+    'preQ1_multistate': {
+        'mode': 'multistate',
+        'args': ['-pdb', 'fpocketR/data/2l1v.pdb', '-ss', 'fpocketR/data/2l1v.nsd',
+                 '-s', '0'],
+    },
+    '2l1v_multistate': {
+        'mode': 'multistate',
+        'args': ['-pdb', 'demo/batch_submission_bash/2l1v.pdb',
+                 '-ss', 'demo/batch_submission_bash/2l1v.nsd', '-s', '0'],
+    },
+    'snakemake_batch': {
+        'mode': 'batch',
+        'args': [],
+    },
+}
+
+# Slowdowns are only flagged for stages slower than this in the baseline (s),
+# since shorter stages are dominated by timing noise.
+MIN_TIME = 0.1
+
+# Scaling benchmarks grow a synthetic structure by tiling a motif into one
+# chain (nucleotides), by replicating chains (chains) or by perturbing it
+# into an ensemble (states). Sizes are numbers of copies or states.
+SCALING_AXES = ('nucleotides', 'chains', 'states')
+DEFAULT_SIZES = {
+    'nucleotides': [1, 2, 4, 8],
+    'chains': [1, 2, 4, 8],
+    'states': [1, 4, 16, 64],
+}
+DEFAULT_MOTIF = os.path.join('fpocketR', 'data', '8f4o.pdb')
+
+
+def get_environment() -> dict:
+    """Describes the software and hardware a benchmark ran on.
+
+    Returns:
+        dict: Versions of fpocketR and its main dependencies, Python,
+              platform and CPU count.
+    """
+    from fpocketR import pocket
+
+    versions = {}
+    for package in ('fpocketR', 'prody', 'numpy', 'pandas', 'scipy', 'rdkit', 'pymol'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        fpocket = pocket.get_fpocket_path()
+    except Exception:
+        fpocket = None
+
+    return {
+        'versions': versions,
+        'fpocket': fpocket,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def read_snakemake_ligands(config : str) -> dict[str, str]:
+    """Reads the ligand of every sample from the snakemake demo config.
+
+    Args:
+        config (str): Path to demo/batch_submission_snakemake/config/config.yaml.
+
+    Returns:
+        dict[str, str]: Ligand residue name of every PDB code.
+    """
+    with open(config, 'r') as f:
+        text = f.read()
+    return dict(re.findall(r'^\s+(\w{4}):\s*\n\s+ligand:\s*(\w+)', text, re.M))
+
+
+def write_batch_manifest(manifest : str, out : str, dpi : int) -> int:
+    """Writes a batch manifest for the structures of the snakemake demo.
+
+    Args:
+        manifest (str): Path to the manifest to write.
+        out (str): Output parent directory for the batch.
+        dpi (int): Figure resolution in dpi.
+
+    Returns:
+        int: Number of manifest entries.
+    """
+    demo = os.path.join(REPO_ROOT, SNAKEMAKE_DIR)
+    sample_ligands = read_snakemake_ligands(
+        os.path.join(demo, 'config', 'config.yaml'))
+    pdbs = sorted(pdb for pdb in glob.glob(os.path.join(demo, '*.pdb'))
+                  if not pdb.endswith('_clean.pdb'))
+
+    with open(manifest, 'w') as f:
+        for pdb in pdbs:
+            code = structures.get_name(pdb)
+            ligand = sample_ligands.get(code, 'no')
+            f.write(f'-pdb {pdb} -l {ligand} -o {os.path.join(out, code)} '
+                    f'-dpi {dpi}\n')
+
+    return len(pdbs)
+
+
+def get_workload_command(
+    name : str, workdir : str, dpi : int, jobs : int
+) -> list[str]:
+    """Builds the fpocketR command for a reference workload.
+
+    Args:
+        name (str): Workload name (see WORKLOADS).
+        workdir (str): Directory in which the workload runs.
+        dpi (int): Figure resolution in dpi.
+        jobs (int): Number of worker processes (multistate and batch).
+
+    Returns:
+        list[str]: Command-line arguments, or None if the workload's input
+                   files are not available (e.g. an installed package).
+    """
+    workload = WORKLOADS[name]
+    command = [sys.executable, '-m', 'fpocketR']
+
+    if workload['mode'] == 'batch':
+        manifest = os.path.join(workdir, 'manifest.txt')
+        if not os.path.isdir(os.path.join(REPO_ROOT, SNAKEMAKE_DIR)):
+            return None
+        write_batch_manifest(manifest, os.path.join(workdir, 'out'), dpi)
+        return command + [
+            'batch', manifest, '-j', str(jobs), '-y',
+            '-r', os.path.join(workdir, 'batch_report.tsv')]
+
+    args = []
+    for arg in workload['args']:
+        path = os.path.join(REPO_ROOT, arg)
+        if arg.endswith(('.pdb', '.nsd')):
+            if not os.path.isfile(path):
+                return None
+            arg = path
+        args.append(arg)
+
+    args += ['-o', os.path.join(workdir, 'out'), '-dpi', str(dpi),
+             '-y']
+    if workload['mode'] == 'multistate':
+        args += ['-j', str(jobs)]
+    return command + args
+
+
+def run_workload(
+    name : str, dpi : int = 50, jobs : int = 1, keep : str = None
+) -> dict:
+    """Runs a reference workload once as a separate fpocketR process with a
+    cold cache and profiling enabled.
+
+    Args:
+        name (str): Workload name (see WORKLOADS).
+        dpi (int): Figure resolution in dpi.
+        jobs (int): Number of worker processes (multistate and batch).
+        keep (str): Directory in which to keep the run (None removes it).
+
+    Returns:
+        dict: Total wall time (s) and summed wall time of every stage (s),
+              or None if the workload's input files are not available.
+    """
+    workdir = tempfile.mkdtemp(prefix=f'fpocketR_benchmark_{name}_', dir=keep)
+    command = get_workload_command(name, workdir, dpi, jobs)
+    if command is None:
+        print(f'WARNING: Input files for the {name} workload were not found. Skipping.')
+        shutil.rmtree(workdir, ignore_errors=True)
+        return None
+
+    result = run_command(command, workdir, name)
+    if keep is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def run_command(command : list[str], workdir : str, name : str) -> dict:
+    """Runs an fpocketR command in {workdir} with an empty cache and
+    profiling enabled. The output is saved to {workdir}/fpocketR.log.
+
+    Args:
+        command (list[str]): fpocketR command.
+        workdir (str): Directory in which the command runs.
+        name (str): Name of the run (for error messages).
+
+    Returns:
+        dict: Total wall time (s), summed wall time of every stage (s),
+              peak RSS (MB) and the number of pockets found.
+    """
+    # Runs this copy of fpocketR with an empty cache and profiling enabled.
+    report = os.path.join(workdir, 'profile.jsonl')
+    env = {
+        **os.environ,
+        profiling.PROFILE_ENV: report,
+        'FPOCKETR_CACHE_DIR': os.path.join(workdir, 'cache'),
+        'PYTHONPATH': os.pathsep.join(
+            filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])),
+    }
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        command, cwd=workdir, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+
+    with open(os.path.join(workdir, 'fpocketR.log'), 'w') as f:
+        f.write(process.stdout)
+        f.write(process.stderr)
+    if process.returncode != 0:
+        raise RuntimeError(
+            f'The {name} run failed (see {workdir}/fpocketR.log):\n'
+            f'{process.stderr[-2000:]}')
+
+    stages, rss, pockets = {}, None, None
+    if os.path.isfile(report):
+        profile_df = profiling.read_profile(report)
+        stages = profile_df.groupby('Stage')['Wall'].sum().round(4).to_dict()
+        rss = float(profile_df[['RSS', 'Child_RSS']].max().max())
+        # Pockets of every structure and state (input runs once per state).
+        states = profile_df[profile_df['Stage'] == 'input']
+        pockets = int(states['Pockets'].fillna(0).sum())
+
+    return {'Wall': round(wall, 4), 'Stages': stages, 'RSS': rss,
+            'Pockets': pockets}
+
+
+def run_benchmarks(
+    names : list[str] = None,
+    repeat : int = 3,
+    dpi : int = 50,
+    jobs : int = 1,
+    keep : str = None,
+) -> dict:
+    """Runs reference workloads {repeat} times and keeps the median times.
+
+    Args:
+        names (list[str]): Workload names (None runs all WORKLOADS).
+        repeat (int): Number of runs of every workload.
+        dpi (int): Figure resolution in dpi.
+        jobs (int): Number of worker processes (multistate and batch).
+        keep (str): Directory in which to keep the runs (None removes them).
+
+    Returns:
+        dict: Benchmark results with the environment, options and the
+              median total and per-stage wall times of every workload.
+    """
+    names = names if names else list(WORKLOADS)
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        raise KeyError(f'Unknown workloads: {", ".join(unknown)}. '
+                       f'Choose from: {", ".join(WORKLOADS)}')
+
+    workloads = {}
+    for name in names:
+        runs = []
+        for run in range(1, repeat + 1):
+            print(f'Benchmarking {name} ({run}/{repeat})...')
+            result = run_workload(name, dpi, jobs, keep)
+            if result is None:
+                break
+            runs.append(result)
+        if not runs:
+            continue
+
+        stages = sorted({stage for run in runs for stage in run['Stages']})
+        workloads[name] = {
+            'mode': WORKLOADS[name]['mode'],
+            'wall': round(float(np.median([run['Wall'] for run in runs])), 4),
+            'walls': [run['Wall'] for run in runs],
+            'stages': {
+                stage: round(float(np.median(
+                    [run['Stages'].get(stage, 0.0) for run in runs])), 4)
+                for stage in stages
+            },
+        }
+
+    return {
+        'environment': get_environment(),
+        'options': {'repeat': repeat, 'dpi': dpi, 'jobs': jobs},
+        'workloads': workloads,
+    }
+
+
+def write_benchmarks(path : str, benchmarks : dict) -> None:
+    """Writes benchmark results (e.g. a baseline) to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump(benchmarks, f, indent=2)
+
+
+def read_benchmarks(path : str) -> dict:
+    """Reads benchmark results (e.g. a baseline) from a JSON file."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare_benchmarks(
+    current : dict, baseline : dict, threshold : float = 1.25
+) -> pd.DataFrame:
+    """Compares benchmark results to a baseline.
+
+    Args:
+        current (dict): Benchmark results (see run_benchmarks).
+        baseline (dict): Baseline benchmark results.
+        threshold (float): Slowdown (current / baseline wall time) above
+                           which a workload or stage is flagged 'Slower'.
+
+    Returns:
+        DataFrame: Baseline and current wall times, slowdown and status
+                   ('Slower', 'Faster', 'OK' or 'New') of every workload
+                   (Stage 'total') and stage.
+    """
+    records = []
+    for name, result in current['workloads'].items():
+        base = baseline['workloads'].get(name, {})
+        rows = [('total', base.get('wall'), result['wall'])]
+        rows += [(stage, base.get('stages', {}).get(stage), wall)
+                 for stage, wall in result['stages'].items()]
+
+        for stage, base_wall, wall in rows:
+            if base_wall is None:
+                slowdown, status = None, 'New'
+            else:
+                slowdown = wall / base_wall if base_wall else None
+                if stage != 'total' and base_wall < MIN_TIME:
+                    status = 'OK'
+                elif slowdown is not None and slowdown > threshold:
+                    status = 'Slower'
+                elif slowdown is not None and slowdown < 1 / threshold:
+                    status = 'Faster'
+                else:
+                    status = 'OK'
+            records.append({
+                'Workload': name,
+                'Stage': stage,
+                'Baseline': base_wall,
+                'Current': wall,
+                'Slowdown': round(slowdown, 3) if slowdown is not None else None,
+                'Status': status,
+            })
+
+    return pd.DataFrame.from_records(
+        records,
+        columns=['Workload', 'Stage', 'Baseline', 'Current', 'Slowdown', 'Status'])
+
+
+def run_scaling(
+    axis : str,
+    sizes : list[int] = None,
+    motif : str = None,
+    repeat : int = 1,
+    dpi : int = 50,
+    jobs : int = 1,
+    keep : str = None,
+) -> pd.DataFrame:
+    """Runs the pipeline on synthetic structures of increasing size.
+
+    Args:
+        axis (str): How the structure grows (see SCALING_AXES).
+        sizes (list[int]): Numbers of motif copies (nucleotides, chains) or
+                           states (Default: DEFAULT_SIZES).
+        motif (str): Path to the motif .pdb file (Default: 8f4o).
+        repeat (int): Number of runs of every size; the median is kept.
+        dpi (int): Figure resolution in dpi.
+        jobs (int): Number of worker processes (states).
+        keep (str): Directory in which to keep the runs (None removes them).
+
+    Returns:
+        DataFrame: Size, pockets, wall time (s), peak RSS (MB) and wall time
+                   of every stage (s) of every synthetic structure.
+    """
+    if axis not in SCALING_AXES:
+        raise ValueError(f'Unknown scaling axis: {axis}. '
+                         f'Choose from: {", ".join(SCALING_AXES)}')
+    sizes = sizes if sizes else DEFAULT_SIZES[axis]
+    motif = motif if motif else os.path.join(REPO_ROOT, DEFAULT_MOTIF)
+    prefix = structures.get_name(motif)
+
+    records = []
+    for size in sizes:
+        runs = []
+        for run in range(1, repeat + 1):
+            print(f'Scaling {axis}: size {size} ({run}/{repeat})...')
+            workdir = tempfile.mkdtemp(
+                prefix=f'fpocketR_scaling_{axis}{size}_', dir=keep)
+            pdb = os.path.join(workdir, f'{prefix}_{axis}{size}.pdb')
+            shape = synthetic.make_structure(
+                motif,
+                pdb,
+                copies=size if axis != 'states' else 1,
+                chains=axis == 'chains',
+                states=size if axis == 'states' else 1,
+            )
+
+            command = [
+                sys.executable, '-m', 'fpocketR', '-pdb', pdb, '-l', 'no',
+                '-al', 'False', '-o', os.path.join(workdir, 'out'),
+                '-dpi', str(dpi), '-y']
+            if axis == 'chains':
+                command += ['-c', ','.join(synthetic.CHAIN_IDS[:shape['Chains']])]
+            if axis == 'states':
+                command += ['-s', '0', '-j', str(jobs)]
+
+            runs.append(run_command(command, workdir, f'{axis}{size}'))
+            if keep is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        stages = sorted({stage for run in runs for stage in run['Stages']})
+        records.append({
+            'Axis': axis,
+            'Size': size,
+            **shape,
+            'Pockets': runs[0]['Pockets'],
+            'Wall': round(float(np.median([run['Wall'] for run in runs])), 4),
+            'RSS': max(run['RSS'] or 0.0 for run in runs),
+            **{stage: round(float(np.median(
+                [run['Stages'].get(stage, 0.0) for run in runs])), 4)
+               for stage in stages},
+        })
+
+    return pd.DataFrame.from_records(records)
+
+
+def get_scaling_exponents(scaling_df : pd.DataFrame) -> pd.DataFrame:
+    """Estimates how the wall time, memory and stage times grow with the
+    size of the structure, as the exponent b of y ~ x^b (log-log slope):
+    1 is linear, 2 is quadratic growth.
+
+    Args:
+        scaling_df (DataFrame): Scaling benchmark results (see run_scaling).
+
+    Returns:
+        DataFrame: Exponents of every measure against nucleotides (or
+                   states) and against the number of pockets.
+    """
+    size = 'States' if scaling_df['Axis'].iloc[0] == 'states' else 'Nucleotides'
+    measures = ['Wall', 'RSS'] + [
+        stage for stage in profiling.STAGES if stage in scaling_df.columns]
+
+    def get_exponent(x : pd.Series, y : pd.Series) -> float:
+        valid = (x > 0) & (y > 0)
+        if valid.sum() < 2 or x[valid].nunique() < 2:
+            return None
+        return round(float(np.polyfit(np.log(x[valid]), np.log(y[valid]), 1)[0]), 2)
+
+    return pd.DataFrame.from_records([
+        {
+            'Measure': measure,
+            f'vs_{size}': get_exponent(scaling_df[size], scaling_df[measure]),
+            'vs_Pockets': get_exponent(scaling_df['Pockets'], scaling_df[measure]),
+        }
+        for measure in measures
+    ])
+
+
+# -----------------------------------------------------------------------------
+def parseArgs(argv : list[str] = None):
+    prs = argparse.ArgumentParser(prog='fpocketR benchmark')
+
+    prs.add_argument(
+        '-w',
+        '--workloads',
+        type=str,
+        nargs='+',
+        required=False,
+        default=None,
+        choices=list(WORKLOADS),
+        help='Reference workloads to run (all).',
+    )
+    prs.add_argument(
+        '-n',
+        '--repeat',
+        type=int,
+        required=False,
+        default=3,
+        help='Number of runs of every workload; the median is kept (3).',
+    )
+    prs.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of worker processes for multistate and batch workloads (1).',
+    )
+    prs.add_argument(
+        '-dpi',
+        '--dpi',
+        type=int,
+        required=False,
+        default=50,
+        help='Figure resolution in dpi (50).',
+    )
+    prs.add_argument(
+        '-b',
+        '--baseline',
+        type=str,
+        required=False,
+        default=None,
+        help='Baseline benchmark results (.json) to compare against (None).',
+    )
+    prs.add_argument(
+        '-s',
+        '--save',
+        type=str,
+        required=False,
+        default=None,
+        help='Path to save the benchmark results (.json), e.g. as a new baseline (None).',
+    )
+    prs.add_argument(
+        '-t',
+        '--threshold',
+        type=float,
+        required=False,
+        default=1.25,
+        help='Slowdown against the baseline that is reported as a regression (1.25).',
+    )
+    prs.add_argument(
+        '-k',
+        '--keep',
+        type=str,
+        required=False,
+        default=None,
+        help='Directory in which to keep the outputs and logs of every run (None).',
+    )
+    prs.add_argument(
+        '--scaling',
+        type=str,
+        required=False,
+        default=None,
+        choices=SCALING_AXES,
+        help='Runs a scaling benchmark on synthetic structures that grow in '
+        'nucleotides, chains or states instead of the reference workloads (None).',
+    )
+    prs.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        required=False,
+        default=None,
+        help='Numbers of motif copies or states of the scaling benchmark '
+        '(nucleotides/chains: 1 2 4 8, states: 1 4 16 64).',
+    )
+    prs.add_argument(
+        '--motif',
+        type=str,
+        required=False,
+        default=None,
+        help='Path to the .pdb file tiled into synthetic structures (fpocketR/data/8f4o.pdb).',
+    )
+
+    args = prs.parse_args(argv)
+    return args
+
+
+def main(
+    workloads : list[str] = None,
+    repeat : int = 3,
+    jobs : int = 1,
+    dpi : int = 50,
+    baseline : str = None,
+    save : str = None,
+    threshold : float = 1.25,
+    keep : str = None,
+    scaling : str = None,
+    sizes : list[int] = None,
+    motif : str = None,
+):
+    """Benchmarks fpocketR on reference workloads and reports the slowdown
+    against a baseline. Exits with status 1 if a workload is slower than
+    the baseline by more than {threshold}.
+
+    With {scaling}, runs the pipeline on synthetic structures of increasing
+    size instead and reports how time and memory grow.
+    """
+    if keep:
+        os.makedirs(keep, exist_ok=True)
+
+    if scaling:
+        scaling_df = run_scaling(scaling, sizes, motif, repeat, dpi, jobs, keep)
+        exponents_df = get_scaling_exponents(scaling_df)
+        if save:
+            write_benchmarks(save, {
+                'environment': get_environment(),
+                'options': {'repeat': repeat, 'dpi': dpi, 'jobs': jobs},
+                'scaling': scaling_df.to_dict(orient='records'),
+                'exponents': exponents_df.to_dict(orient='records'),
+            })
+            print(f'\nScaling results: {save}')
+        print(f'\n{scaling_df.to_string(index=False)}\n\n'
+              f'Growth exponents (y ~ x^b):\n{exponents_df.to_string(index=False)}\n')
+        return scaling_df
+
+    benchmarks = run_benchmarks(workloads, repeat, dpi, jobs, keep)
+    if save:
+        write_benchmarks(save, benchmarks)
+        print(f'\nBenchmark results: {save}')
+
+    summary = pd.DataFrame.from_records(
+        [{'Workload': name, 'Mode': result['mode'], 'Wall': result['wall']}
+         for name, result in benchmarks['workloads'].items()])
+    print(f'\n{summary.to_string(index=False)}\n')
+
+    if not baseline:
+        return benchmarks
+
+    baseline_benchmarks = read_benchmarks(baseline)
+    if baseline_benchmarks['options'] != benchmarks['options']:
+        print('WARNING: The baseline ran with other options: '
+              f"{baseline_benchmarks['options']}\n")
+    report_df = compare_benchmarks(benchmarks, baseline_benchmarks, threshold)
+    print(f'Slowdown against {baseline}:\n{report_df.to_string(index=False)}\n')
+
+    slower = report_df[(report_df['Stage'] == 'total') & (report_df['Status'] == 'Slower')]
+    if len(slower):
+        print(f'ERROR: {len(slower)} workloads are more than {threshold}x slower '
+              f'than the baseline: {", ".join(slower["Workload"])}')
+        sys.exit(1)
+
+    return benchmarks
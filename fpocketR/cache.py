@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for caching fpocket outputs and pocket characteristics
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import os
+import shutil
+import hashlib
+import tempfile
+import functools
+from importlib import metadata
+import pandas as pd
+
+# Cache location and size limit (MB), overridable with environment variables.
+DEFAULT_CACHE_DIR = os.environ.get(
+    'FPOCKETR_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'fpocketR'),
+)
+DEFAULT_CACHE_SIZE = float(os.environ.get('FPOCKETR_CACHE_SIZE', 2048))
+
+# Name of the fpocket output directory and pocket table in a cache entry.
+FPOCKET_ENTRY = 'fpocket_out'
+CHARACTERISTICS_ENTRY = 'pocket_characteristics.pkl'
+
+# Version of the cached results. Bump it when cleaning or analysis changes
+# (e.g. new columns, NPR, PocketNT or scoring) so old entries are not reused.
+CACHE_VERSION = 2
+
+
+def hash_file(path : str) -> str:
+    """Calculates the sha256 hash of a file's contents.
+
+    Args:
+        path (str): Path to file.
+
+    Returns:
+        str: Hexadecimal sha256 digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_fpocket_version(fpocket_path : str) -> str:
+    """Identifies the fpocket binary by the hash of its contents, so
+    upgrading fpocket invalidates all cached outputs.
+
+    Args:
+        fpocket_path (str): Path to the fpocket executable.
+
+    Returns:
+        str: Hexadecimal sha256 digest of the fpocket executable.
+    """
+    return hash_file(os.path.realpath(fpocket_path))
+
+
+@functools.lru_cache(maxsize=None)
+def get_package_version() -> str:
+    """Gets the installed fpocketR version (None if not installed), so
+    upgrading fpocketR invalidates all cached results.
+
+    Returns:
+        str: fpocketR version.
+    """
+    try:
+        return metadata.version('fpocketR')
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def get_key(*fields) -> str:
+    """Combines cache key fields into a single sha256 digest.
+
+    Returns:
+        str: Hexadecimal sha256 digest.
+    """
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+def get_fpocket_key(
+    pdb_clean : str,
+    fpocket_path : str,
+    chain : str,
+    state : int,
+    m : float,
+    M : float,
+    i : int,
+    D : float,
+    A : int,
+    p : float,
+) -> str:
+    """Gets the cache key of an fpocket run. fpocket names its outputs
+    after the input file, so the filename is part of the key, and the
+    fpocketR version is part of the key of every cached result.
+
+    Args:
+        pdb_clean (str): Path to the cleaned .pdb file.
+        fpocket_path (str): Path to the fpocket executable.
+        chain (str): Chain identifier for desired RNA chain.
+        state (int): Structural state to analyze.
+        m (float): Min. a-sphere radius in angstroms.
+        M (float): Max. a-sphere radius in angstroms.
+        i (int): Min. number of a-spheres per pocket.
+        D (float): a-sphere clustering distance in angstroms.
+        A (int): # of electroneg. atoms to define a polar a-sphere.
+        p (float): Max. ratio of apolar a-spheres in a pocket.
+
+    Returns:
+        str: Cache key.
+    """
+    return get_key(
+        'fpocket',
+        CACHE_VERSION,
+        get_package_version(),
+        hash_file(pdb_clean),
+        os.path.basename(pdb_clean),
+        get_fpocket_version(fpocket_path),
+        chain, state, m, M, i, D, A, p,
+    )
+
+
+def get_characteristics_key(
+    pdb : str,
+    pdb_out : str,
+    pqr_out : str,
+    info_txt : str,
+    name : str,
+    chain : str,
+    ligand : str,
+    ligandchain : str,
+    qualityfilter : float,
+    knownnt : list[int],
+    parameters : tuple,
+    ligandstore : tuple = None,
+) -> str:
+    """Gets the cache key of a pocket characteristics table from the
+    fpocket outputs it was calculated from and the analysis options.
+
+    Args:
+        pdb (str): Path to input .pdb file (contains the ligand).
+        pdb_out (str): Path to fpocket *_out.pdb file.
+        pqr_out (str): Path to fpocket *_pockets.pqr file.
+        info_txt (str): Path to fpocket *_info.txt file.
+        name (str): Output file name prefix.
+        chain (str): Chain identifier for desired RNA chain.
+        ligand (str): Ligand residue name (usually a 3-letter code).
+        ligandchain (str): Chain identifier for desired ligand.
+        qualityfilter (float): Minimum fpocket score filter for pockets.
+        knownnt (list[int]): Residue IDs of nts in known pocket.
+        parameters (tuple): fpocket parameters (m, M, i, D, A, p, state).
+        ligandstore (tuple): Ligand store version and download setting, so
+                             results are recalculated when the store changes.
+
+    Returns:
+        str: Cache key.
+    """
+    return get_key(
+        'characteristics',
+        CACHE_VERSION,
+        get_package_version(),
+        hash_file(pdb),
+        os.path.basename(pdb),
+        hash_file(pdb_out),
+        hash_file(pqr_out),
+        hash_file(info_txt),
+        name, chain, ligand, ligandchain, qualityfilter, knownnt, parameters,
+        ligandstore,
+    )
+
+
+def get_entry(cachedir : str, key : str, filename : str) -> str:
+    """Gets the path to a cached file or directory and marks the entry as
+    recently used.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        key (str): Cache key.
+        filename (str): File or directory name within the cache entry.
+
+    Returns:
+        str: Path to the cached file or directory (None if not cached).
+    """
+    entry = os.path.join(cachedir, key)
+    path = os.path.join(entry, filename)
+    if not os.path.exists(path):
+        return None
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+    return path
+
+
+def store_entry(
+    cachedir : str, key : str, filename : str, source : str, cachesize : float
+    ) -> None:
+    """Copies a file or directory into the cache. Entries are written to a
+    temporary directory and renamed into place, so concurrent runs never
+    read a partial entry. Least recently used entries are then evicted until
+    the cache fits within {cachesize} MB.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        key (str): Cache key.
+        filename (str): File or directory name within the cache entry.
+        source (str): Path to the file or directory to cache.
+        cachesize (float): Maximum cache size in MB.
+    """
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f'.{key}_', dir=cachedir)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(tmp, filename))
+        else:
+            shutil.copy2(source, os.path.join(tmp, filename))
+
+        entry = os.path.join(cachedir, key)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another run stored the same entry first.
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        evict(cachedir, cachesize)
+
+    except OSError as e:
+        print(f'WARNING: Unable to write to the fpocketR cache ({cachedir}).\n{e}\n')
+
+
+def get_size(path : str) -> int:
+    """Calculates the total size of the files in a directory.
+
+    Args:
+        path (str): Path to directory.
+
+    Returns:
+        int: Size in bytes.
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return size
+
+
+def evict(cachedir : str, cachesize : float) -> None:
+    """Removes least recently used cache entries until the cache fits
+    within {cachesize} MB.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        cachesize (float): Maximum cache size in MB.
+    """
+    entries = []
+    for key in os.listdir(cachedir):
+        entry = os.path.join(cachedir, key)
+        if key.startswith('.') or not os.path.isdir(entry):
+            continue
+        try:
+            entries.append((os.path.getmtime(entry), get_size(entry), entry))
+        except OSError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= cachesize * 1024 ** 2:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def fetch_fpocket(cachedir : str, key : str, dest_dir : str) -> bool:
+    """Copies cached fpocket outputs to {dest_dir}.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        key (str): fpocket cache key.
+        dest_dir (str): Path to the fpocket output directory to create.
+
+    Returns:
+        bool: True if the fpocket outputs were cached.
+    """
+    cached = get_entry(cachedir, key, FPOCKET_ENTRY)
+    if cached is None:
+        return False
+
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    shutil.copytree(cached, dest_dir)
+    return True
+
+
+def store_fpocket(
+    cachedir : str, key : str, source_dir : str, cachesize : float
+    ) -> None:
+    """Stores fpocket outputs in the cache.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        key (str): fpocket cache key.
+        source_dir (str): Path to the fpocket output directory.
+        cachesize (float): Maximum cache size in MB.
+    """
+    store_entry(cachedir, key, FPOCKET_ENTRY, source_dir, cachesize)
+
+
+def load_characteristics(cachedir : str, key : str) -> pd.DataFrame:
+    """Loads a cached pocket characteristics table.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        key (str): Pocket characteristics cache key.
+
+    Returns:
+        DataFrame: Pocket characteristics (None if not cached).
+    """
+    cached = get_entry(cachedir, key, CHARACTERISTICS_ENTRY)
+    if cached is None:
+        return None
+    try:
+        return pd.read_pickle(cached)
+    except Exception:
+        return None
+
+
+def store_characteristics(
+    cachedir : str, key : str, pc_df : pd.DataFrame, cachesize : float
+    ) -> None:
+    """Stores a pocket characteristics table in the cache.
+
+    Args:
+        cachedir (str): Path to the cache directory.
+        key (str): Pocket characteristics cache key.
+        pc_df (DataFrame): Pocket characteristics.
+        cachesize (float): Maximum cache size in MB.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        table = os.path.join(tmp, CHARACTERISTICS_ENTRY)
+        pc_df.to_pickle(table)
+        store_entry(cachedir, key, CHARACTERISTICS_ENTRY, table, cachesize)
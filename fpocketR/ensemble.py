@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for grouping the pockets of an ensemble into consensus pockets
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+# Minimum PocketNT Jaccard similarity of two pockets of the same site.
+DEFAULT_JACCARD = 0.3
+
+# Maximum distance (angstroms) between the centroids of two pockets of the
+# same site.
+DEFAULT_DISTANCE = 8.0
+
+# Number of nearest pocket centroids each pocket is compared with.
+DEFAULT_NEIGHBORS = 32
+
+# Fraction of the pockets of a site a nucleotide must line to be part of the
+# consensus pocket.
+CONSENSUS_FRACTION = 0.5
+
+# Pocket characteristics summarized for every site (mean and variance).
+SITE_CHARACTERISTICS = ('Score', 'Drug_score', 'Volume', 'Pocket_NPR1', 'Pocket_NPR2')
+
+
+def get_incidence(pocket_nts : list[list[int]]) -> tuple[csr_matrix, np.ndarray]:
+    """Builds a sparse pocket x nucleotide incidence matrix.
+
+    Args:
+        pocket_nts (list[list[int]]): Residue IDs lining each pocket.
+
+    Returns:
+        csr_matrix: 1 where a nucleotide lines a pocket.
+        np.ndarray: Residue ID of each column.
+    """
+    lengths = [len(nts) for nts in pocket_nts]
+    rows = np.repeat(np.arange(len(pocket_nts)), lengths)
+    nts = np.concatenate([np.asarray(nts, dtype=int) for nts in pocket_nts] or [np.zeros(0, int)])
+    residues, columns = np.unique(nts, return_inverse=True)
+    incidence = csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(pocket_nts), len(residues)))
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+    return incidence, residues
+
+
+def get_jaccard(
+    incidence : csr_matrix, first : np.ndarray, second : np.ndarray
+) -> np.ndarray:
+    """Calculates the Jaccard similarity of the nucleotides of pairs of
+    pockets.
+
+    Args:
+        incidence (csr_matrix): Pocket x nucleotide incidence matrix.
+        first (np.ndarray): Row of the first pocket of each pair.
+        second (np.ndarray): Row of the second pocket of each pair.
+
+    Returns:
+        np.ndarray: Jaccard similarity of each pair.
+    """
+    sizes = np.asarray(incidence.sum(axis=1)).ravel()
+    shared = np.asarray(incidence[first].multiply(incidence[second]).sum(axis=1)).ravel()
+    union = sizes[first] + sizes[second] - shared
+    return np.divide(shared, union, out=np.zeros(len(shared)), where=union > 0)
+
+
+def get_candidate_pairs(
+    centroids : np.ndarray,
+    incidence : csr_matrix,
+    distance : float = DEFAULT_DISTANCE,
+    neighbors : int = DEFAULT_NEIGHBORS,
+) -> np.ndarray:
+    """Finds the pairs of pockets that may belong to the same site: each
+    pocket and its {neighbors} nearest centroids within {distance}, found with
+    a KD-tree. Pockets without a centroid are paired with every pocket they
+    share a nucleotide with.
+
+    Args:
+        centroids (np.ndarray): n x 3 pocket centroids (NaN if unknown).
+        incidence (csr_matrix): Pocket x nucleotide incidence matrix.
+        distance (float): Maximum centroid distance in angstroms.
+        neighbors (int): Number of nearest centroids per pocket.
+
+    Returns:
+        np.ndarray: m x 2 unique pairs of rows (first < second).
+    """
+    known = np.flatnonzero(~np.isnan(centroids).any(axis=1))
+    pairs = [np.zeros((0, 2), dtype=int)]
+
+    if len(known) > 1:
+        k = min(neighbors + 1, len(known))
+        _, nearest = cKDTree(centroids[known]).query(
+            centroids[known], k=k, distance_upper_bound=distance)
+        first = np.repeat(known, k)
+        nearest = nearest.ravel()
+        found = nearest < len(known)
+        pairs.append(np.column_stack((first[found], known[nearest[found]])))
+
+    unknown = np.flatnonzero(np.isnan(centroids).any(axis=1))
+    if len(unknown):
+        shared = (incidence[unknown] @ incidence.T).tocoo()
+        pairs.append(np.column_stack((unknown[shared.row], shared.col)))
+
+    pairs = np.concatenate(pairs)
+    pairs = np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def cluster_pockets(
+    pocket_nts : list[list[int]],
+    centroids : np.ndarray,
+    jaccard : float = DEFAULT_JACCARD,
+    distance : float = DEFAULT_DISTANCE,
+    neighbors : int = DEFAULT_NEIGHBORS,
+) -> np.ndarray:
+    """Groups pockets into sites. Two pockets are linked when their centroids
+    are close and their nucleotides overlap (Jaccard similarity), and each
+    site is a connected group of linked pockets.
+
+    Args:
+        pocket_nts (list[list[int]]): Residue IDs lining each pocket.
+        centroids (np.ndarray): n x 3 pocket centroids (NaN if unknown).
+        jaccard (float): Minimum Jaccard similarity of linked pockets.
+        distance (float): Maximum centroid distance (Å) of linked pockets.
+        neighbors (int): Number of nearest centroids compared with each pocket.
+
+    Returns:
+        np.ndarray: Site label of each pocket.
+    """
+    incidence, _ = get_incidence(pocket_nts)
+    pairs = get_candidate_pairs(centroids, incidence, distance, neighbors)
+    linked = pairs[get_jaccard(incidence, pairs[:, 0], pairs[:, 1]) >= jaccard]
+    graph = csr_matrix(
+        (np.ones(len(linked)), (linked[:, 0], linked[:, 1])),
+        shape=(len(pocket_nts), len(pocket_nts)))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def get_consensus(
+    incidence : csr_matrix,
+    residues : np.ndarray,
+    labels : np.ndarray,
+    fraction : float = CONSENSUS_FRACTION,
+) -> tuple[list[list[int]], np.ndarray]:
+    """Finds the consensus nucleotides of every site and the pocket most
+    similar to them (Jaccard similarity; ties go to the first pocket).
+
+    Args:
+        incidence (csr_matrix): Pocket x nucleotide incidence matrix.
+        residues (np.ndarray): Residue ID of each column of {incidence}.
+        labels (np.ndarray): Site label of each pocket.
+        fraction (float): Fraction of the pockets of a site a nucleotide
+                          must line.
+
+    Returns:
+        list[list[int]]: Consensus residue IDs of each site.
+        np.ndarray: Row of the representative pocket of each site.
+    """
+    num_sites = labels.max() + 1
+    membership = csr_matrix(
+        (np.ones(len(labels)), (labels, np.arange(len(labels)))),
+        shape=(num_sites, len(labels)))
+    sizes = np.bincount(labels, minlength=num_sites)
+    counts = (membership @ incidence).toarray()
+    consensus = counts >= fraction * sizes[:, None]
+
+    # Sites whose pockets share no majority nucleotide keep the most common ones.
+    empty = ~consensus.any(axis=1) & (counts.shape[1] > 0)
+    consensus[empty] = counts[empty] == counts[empty].max(axis=1, keepdims=True)
+
+    shared = np.asarray(incidence.multiply(csr_matrix(consensus)[labels]).sum(axis=1)).ravel()
+    union = np.asarray(incidence.sum(axis=1)).ravel() + consensus.sum(axis=1)[labels] - shared
+    similarity = np.divide(shared, union, out=np.zeros(len(shared)), where=union > 0)
+
+    order = np.lexsort((np.arange(len(labels)), -similarity, labels))
+    representatives = order[np.searchsorted(labels[order], np.arange(num_sites))]
+    return [residues[row].tolist() for row in consensus], representatives
+
+
+def find_sites(
+    pc_df : pd.DataFrame,
+    centroids_df : pd.DataFrame,
+    num_states : int,
+    jaccard : float = DEFAULT_JACCARD,
+    distance : float = DEFAULT_DISTANCE,
+    neighbors : int = DEFAULT_NEIGHBORS,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Groups the pockets (that pass the quality filter) of all states of an
+    ensemble into consensus pockets (sites) that persist across states.
+
+    Args:
+        pc_df (DataFrame): Pocket characteristics of all states (PocketNT as
+                           lists of residue IDs).
+        centroids_df (DataFrame): State, Pocket and centroid (X, Y, Z) of
+                                  each pocket.
+        num_states (int): Number of states in the ensemble.
+        jaccard (float): Minimum PocketNT Jaccard similarity of linked pockets.
+        distance (float): Maximum centroid distance (Å) of linked pockets.
+        neighbors (int): Number of nearest centroids compared with each pocket.
+
+    Returns:
+        DataFrame: State, Pocket and Site of every pocket.
+        DataFrame: One row per site, ordered by occupancy (fraction of states
+                   with a pocket in the site): number of pockets and states,
+                   mean and variance of the pocket characteristics, centroid,
+                   consensus nucleotides and the representative state.
+    """
+    pockets = pc_df[pc_df['Filter'] == 'Pass'].merge(
+        centroids_df, on=['State', 'Pocket'], how='left').reset_index(drop=True)
+    if pockets.empty:
+        return (pd.DataFrame(columns=['State', 'Pocket', 'Site']),
+                pd.DataFrame(columns=['Site', 'Pockets', 'States', 'Occupancy']))
+
+    pocket_nts = [nts if isinstance(nts, list) else [] for nts in pockets['PocketNT']]
+    centroids = pockets[['X', 'Y', 'Z']].to_numpy(dtype=float)
+    labels = cluster_pockets(pocket_nts, centroids, jaccard, distance, neighbors)
+
+    incidence, residues = get_incidence(pocket_nts)
+    consensus, representatives = get_consensus(incidence, residues, labels)
+
+    pockets['Label'] = labels
+    grouped = pockets.groupby('Label')
+    sites_df = pd.DataFrame({
+        'Pockets': grouped.size(),
+        'States': grouped['State'].nunique(),
+    })
+    sites_df['Occupancy'] = sites_df['States'] / num_states
+    for column in SITE_CHARACTERISTICS:
+        sites_df[f'{column}_mean'] = grouped[column].mean()
+        sites_df[f'{column}_var'] = grouped[column].var(ddof=0)
+    for column in ('X', 'Y', 'Z'):
+        sites_df[column] = grouped[column].mean()
+    sites_df['PocketNT'] = consensus
+    sites_df['Representative_state'] = pockets['State'].to_numpy()[representatives]
+    sites_df['Representative_pocket'] = pockets['Pocket'].to_numpy()[representatives]
+
+    # Numbers sites from the most to the least persistent.
+    sites_df = sites_df.sort_values(
+        ['Occupancy', 'Score_mean'], ascending=False, kind='stable')
+    site_ids = pd.Series(np.arange(1, len(sites_df) + 1), index=sites_df.index)
+    sites_df.insert(0, 'Site', site_ids)
+
+    members_df = pockets[['State', 'Pocket']].assign(
+        Site=site_ids.loc[labels].to_numpy())
+    return members_df, sites_df.reset_index(drop=True)
+
+
+def print_sites(sites_df : pd.DataFrame, top : int = 10):
+    """Prints the most persistent consensus pockets.
+
+    Args:
+        sites_df (DataFrame): Consensus pockets (see find_sites).
+        top (int): Number of consensus pockets to print.
+    """
+    columns = ['Site', 'Pockets', 'Occupancy', 'Score_mean', 'Volume_mean',
+               'Representative_state', 'PocketNT']
+    print(f'Found {len(sites_df)} consensus pockets:\n'
+          f'{sites_df[columns].head(top).round(2).to_string(index=False)}\n')
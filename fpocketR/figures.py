@@ -9,7 +9,7 @@
 #
 # -----------------------------------------------------------------------------
 import os
-import pickle
+import json
 import ast
 from glob import glob
 from pylab import *
@@ -18,10 +18,14 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 import rnavigate as rnav
-from fpocketR import make3D
+from fpocketR import make3D, profiling
 from pymol import cmd
 from matplotlib.colors import LinearSegmentedColormap
 
+# Figure rendering modes: render now, write a render spec, or skip figures.
+RENDER_MODES = ('inline', 'deferred', 'none')
+RENDER_SPEC_VERSION = 1
+
 
 def make_figures(
         pdb : str,
@@ -37,7 +41,8 @@ def make_figures(
         offset : int,
         connectpocket : bool,
         alignligand : str,
-    ) -> dict:
+        render : str = 'inline',
+    ) -> tuple[dict, list[dict]]:
 
     # Get the rna sequnece length from the .pdb file.    
     pdb_seq_len = len(rna_coords.select("name O2'"))
@@ -90,13 +95,33 @@ def make_figures(
     # Get color maps to color 2D and 3D figures
     seq_cmap, pocket_cmap, pocket_nt_color = get_colorNT(
         pc_df, rna_seq_len, offset, rna_coords, ss, chain)
-    
-    if state:
-        state_pocket_cmap = {int(state): pocket_cmap}
-        state_pocket_nt_color = {int(state): pocket_nt_color}
-        # Save pocket_cmap to .pkl file for multistate figure generation
-        with open(f'{analysis}/{name}_maps.pkl', "wb") as file:
-            pickle.dump([state_pocket_cmap, state_pocket_nt_color], file)
+
+
+    # Leaves ray tracing and plotting to `fpocketR render`.
+    if render == 'deferred':
+        pocket_scores = pc_df.loc[pc_df['Filter'] == 'Pass', 'Score']
+        write_render_spec(
+            f'{analysis}/{name}_render.json',
+            {
+                'kind': 'state',
+                'name': name,
+                'state': int(state) if state else state,
+                'ss': os.path.abspath(ss) if ss else None,
+                'alignligand': os.path.abspath(alignligand) if alignligand else None,
+                'chain': chain,
+                'dpi': dpi,
+                'zoom': zoom,
+                'connectpocket': connectpocket,
+                'score': float(pocket_scores.max()) if len(pocket_scores) else None,
+                'seq_cmap': seq_cmap,
+                'pocket_cmap': pocket_cmap,
+                'pocket_nt_color': pocket_nt_color,
+            },
+        )
+        return pocket_cmap, pocket_nt_color
+
+    if render == 'none':
+        return pocket_cmap, pocket_nt_color
 
     # Get 2D figures based on secondary structure in .ss file.
     if ss:
@@ -107,9 +132,56 @@ def make_figures(
     make_3D_figure(pdb, state, analysis, name, dpi,
                   chain, zoom, pocket_cmap, alignligand)
     
-    return pocket_cmap
+    return pocket_cmap, pocket_nt_color
 
 # -----------------------------------------------------------------------------
+def write_render_spec(spec_path : str, spec : dict) -> str:
+    """Writes the colors, pocket maps and view settings needed to render
+    figures later (see `fpocketR render`). Paths to the figure inputs in the
+    output directory are resolved relative to the spec when it is rendered.
+
+    Args:
+        spec_path (str): Path to the render spec (.json).
+        spec (dict): Render settings.
+
+    Returns:
+        str: Path to the render spec.
+    """
+    with open(spec_path, 'w') as f:
+        json.dump({'version': RENDER_SPEC_VERSION, **spec}, f, indent=1)
+    return spec_path
+
+
+def read_render_spec(spec_path : str) -> dict:
+    """Reads a render spec and restores its integer dictionary keys.
+
+    Args:
+        spec_path (str): Path to the render spec (.json).
+
+    Returns:
+        dict: Render settings.
+    """
+    with open(spec_path, 'r') as f:
+        spec = json.load(f)
+
+    if spec.get('version') != RENDER_SPEC_VERSION:
+        raise ValueError(f'Unsupported render spec version: {spec_path}')
+
+    if spec.get('pocket_cmap') is not None:
+        spec['pocket_cmap'] = {
+            int(pocket): color for pocket, color in spec['pocket_cmap'].items()}
+    if spec.get('multistate_pocket_cmap') is not None:
+        spec['multistate_pocket_cmap'] = {
+            int(state): {int(pocket): color for pocket, color in cmap.items()}
+            for state, cmap in spec['multistate_pocket_cmap'].items()}
+    if spec.get('multistate_pocket_nt_color') is not None:
+        spec['multistate_pocket_nt_color'] = {
+            int(state): nt_color
+            for state, nt_color in spec['multistate_pocket_nt_color'].items()}
+
+    return spec
+
+
 def print_pockets(pc_df : pd.DataFrame):
     pc_passing = pc_df[pc_df['Filter'] == 'Pass'].copy()
     if 1 in pc_passing["Pocket"].to_list():
@@ -268,6 +340,7 @@ def get_colorNT(
     return seq_cmap, pocket_cmap, pocket_nt_color
 
 
+@profiling.profiled('2D_figure')
 def make_2D_figure(
         ss : str,
         seq_cmap : list[tuple],
@@ -343,6 +416,7 @@ def make_2D_figure(
     plt.close()
 
 
+@profiling.profiled('3D_figure')
 def make_3D_figure(
         pdb : str,
         state : int,
@@ -379,6 +453,7 @@ def make_3D_figure(
     make3D.save_3D_figure(analysis, name, dpi, chain, zoom)
 
 
+@profiling.profiled('3D_figure')
 def get_all_states_3D_figure(
         num_states : int,
         out : list[str],
@@ -441,6 +516,7 @@ def count_rna_residues(multistate_pocket_nt_color, rna_length):
     return residue_counts
     
     
+@profiling.profiled('2D_figure')
 def get_all_states_2D_figure(
     name : str,
     out : str,
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for storing ligand chemistry (QED, MW, carbon count, NPR)
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import argparse
+import functools
+import glob
+import gzip
+import os
+import re
+import tempfile
+import numpy as np
+import pandas as pd
+import requests
+from rdkit import Chem, RDLogger
+from rdkit.Chem import QED, rdMolDescriptors
+from fpocketR import cache
+
+# Ligand property store, overridable with an environment variable.
+DEFAULT_LIGAND_STORE = os.environ.get(
+    'FPOCKETR_LIGAND_STORE',
+    os.path.join(cache.DEFAULT_CACHE_DIR, 'ligands.tsv'),
+)
+
+# Ideal ligand structures from the PDBe Chemical Component Dictionary.
+PDBE_SDF_URL = 'https://www.ebi.ac.uk/pdbe/static/files/pdbechem_v2/{ligand}_ideal.sdf'
+
+COLUMNS = ['Ligand_ID', 'QED_score', 'MW', 'Carbon_count', 'NPR1', 'NPR2']
+
+BOND_TYPES = {
+    'SING': Chem.BondType.SINGLE,
+    'DOUB': Chem.BondType.DOUBLE,
+    'TRIP': Chem.BondType.TRIPLE,
+    'AROM': Chem.BondType.AROMATIC,
+}
+
+# Ligands that could not be found during this session (not retried).
+MISSING = set()
+
+
+def calc_ligand_properties(mol : Chem.Mol) -> dict:
+    """Calculates ligand properties from an ideal ligand structure.
+
+    Args:
+        mol (object): RDKit molecule (hydrogens implicit) with a 3D conformer.
+
+    Returns:
+        dict: QED score, exact MW, number of carbon atoms and
+              normalized PMI ratios (NPR1, NPR2) of the ideal conformer.
+    """
+    carbon = Chem.MolFromSmarts('[#6]')
+    properties = {
+        'QED_score': QED.default(mol),
+        'MW': rdMolDescriptors.CalcExactMolWt(mol),
+        'Carbon_count': len(mol.GetSubstructMatches(carbon)),
+        'NPR1': np.nan,
+        'NPR2': np.nan,
+    }
+    if mol.GetNumConformers() and mol.GetConformer().Is3D():
+        properties['NPR1'] = rdMolDescriptors.CalcNPR1(mol)
+        properties['NPR2'] = rdMolDescriptors.CalcNPR2(mol)
+
+    return properties
+
+
+def read_sdf_dir(path : str):
+    """Reads ideal ligand structures from a directory of .sdf files named
+    {ligand}.sdf or {ligand}_ideal.sdf (e.g. PDBe downloads).
+
+    Args:
+        path (str): Path to a directory of .sdf files (searched recursively).
+
+    Yields:
+        str: Ligand residue name.
+        object: RDKit molecule.
+    """
+    for sdf in sorted(glob.glob(os.path.join(path, '**', '*.sdf'), recursive=True)):
+        ligand = re.sub('_ideal$', '', os.path.basename(sdf)[:-4]).upper()
+        yield ligand, Chem.MolFromMolFile(sdf)
+
+
+def split_cif_line(line : str) -> list[str]:
+    """Splits a CIF data line into values, removing quotes.
+
+    Args:
+        line (str): CIF data line.
+
+    Returns:
+        list[str]: Values.
+    """
+    return [
+        single or double or bare for single, double, bare in re.findall(
+            r"'(.*?)'(?=\s|$)|\"(.*?)\"(?=\s|$)|(\S+)", line)
+    ]
+
+
+def read_ccd_blocks(path : str):
+    """Reads the atom and bond tables of every component in a Chemical
+    Component Dictionary file (components.cif or components.cif.gz).
+
+    Args:
+        path (str): Path to the Chemical Component Dictionary.
+
+    Yields:
+        str: Ligand residue name.
+        dict[str, dict[str, list[str]]]: Columns of the _chem_comp_atom and
+            _chem_comp_bond tables.
+    """
+    open_file = gzip.open if path.endswith('.gz') else open
+    ligand, tables = None, {}
+    category, columns, values = None, [], []
+
+    def close_loop():
+        if category and columns:
+            table = tables.setdefault(category, {})
+            for idx, column in enumerate(columns):
+                table[column] = values[idx::len(columns)]
+
+    with open_file(path, 'rt') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('data_'):
+                close_loop()
+                if ligand:
+                    yield ligand, tables
+                ligand, tables = line[5:].upper(), {}
+                category, columns, values = None, [], []
+            elif line.startswith('loop_') or line.startswith('#'):
+                close_loop()
+                category, columns, values = None, [], []
+            elif line.startswith('_chem_comp_atom.') or line.startswith('_chem_comp_bond.'):
+                item, _, value = line.partition(' ')
+                item_category, column = item[1:].split('.', 1)
+                if value.strip():
+                    # Single row tables are written as key-value pairs.
+                    tables.setdefault(item_category, {})[column] = split_cif_line(value)
+                else:
+                    category = item_category
+                    columns.append(column)
+            elif line.startswith('_'):
+                close_loop()
+                category, columns, values = None, [], []
+            elif category and line and not line.startswith(';'):
+                values.extend(split_cif_line(line))
+        close_loop()
+        if ligand:
+            yield ligand, tables
+
+
+def read_ccd(path : str):
+    """Reads ideal ligand structures from a Chemical Component Dictionary.
+
+    Args:
+        path (str): Path to components.cif or components.cif.gz.
+
+    Yields:
+        str: Ligand residue name.
+        object: RDKit molecule (None if it cannot be built).
+    """
+    for ligand, tables in read_ccd_blocks(path):
+        atoms = tables.get('chem_comp_atom', {})
+        bonds = tables.get('chem_comp_bond', {})
+        try:
+            mol = Chem.RWMol()
+            index = {}
+            for atom_id, symbol, charge in zip(
+                    atoms['atom_id'], atoms['type_symbol'], atoms['charge']):
+                atom = Chem.Atom(symbol.capitalize())
+                if charge not in ('?', '.'):
+                    atom.SetFormalCharge(int(charge))
+                index[atom_id] = mol.AddAtom(atom)
+
+            for atom1, atom2, order in zip(
+                    bonds.get('atom_id_1', []), bonds.get('atom_id_2', []),
+                    bonds.get('value_order', [])):
+                mol.AddBond(index[atom1], index[atom2], BOND_TYPES[order.upper()])
+
+            # Uses model coordinates if ideal coordinates are missing.
+            conformer = Chem.Conformer(mol.GetNumAtoms())
+            for prefix in ('pdbx_model_Cartn_{}_ideal', 'model_Cartn_{}'):
+                xyz = [atoms.get(prefix.format(dim)) for dim in 'xyz']
+                if all(xyz) and '?' not in xyz[0]:
+                    for idx, position in enumerate(zip(*xyz)):
+                        conformer.SetAtomPosition(idx, [float(v) for v in position])
+                    conformer.Set3D(True)
+                    mol.AddConformer(conformer)
+                    break
+
+            mol = mol.GetMol()
+            Chem.SanitizeMol(mol)
+            yield ligand, Chem.RemoveHs(mol)
+
+        except Exception:
+            yield ligand, None
+
+
+def fetch_ligand(ligand : str) -> Chem.Mol:
+    """Downloads the ideal structure of a ligand from the PDBe.
+
+    Args:
+        ligand (str): Ligand residue name (usually a 3-letter code).
+
+    Returns:
+        object: RDKit molecule (None if it cannot be downloaded).
+    """
+    try:
+        response = requests.get(PDBE_SDF_URL.format(ligand=ligand), timeout=30)
+        if response.status_code != 200:
+            return None
+        return Chem.MolFromMolBlock(response.text)
+    except Exception:
+        return None
+
+
+def get_store_version(store : str) -> float:
+    """Gets the last modification time of a ligand store.
+
+    Args:
+        store (str): Path to the ligand store.
+
+    Returns:
+        float: Modification time (None if the store does not exist).
+    """
+    try:
+        return os.path.getmtime(store)
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=8)
+def read_store(store : str, version : float) -> dict[str, dict]:
+    """Reads a ligand store into memory (once per store version).
+
+    Args:
+        store (str): Path to the ligand store.
+        version (float): Store modification time.
+
+    Returns:
+        dict[str, dict]: Ligand properties keyed by ligand residue name.
+    """
+    if version is None:
+        return {}
+    store_df = pd.read_csv(store, sep='\t', keep_default_na=False,
+                           na_values=[''], dtype={'Ligand_ID': str})
+    return store_df.set_index('Ligand_ID').to_dict('index')
+
+
+def load_store(store : str) -> dict[str, dict]:
+    """Gets the current contents of a ligand store.
+
+    Args:
+        store (str): Path to the ligand store.
+
+    Returns:
+        dict[str, dict]: Ligand properties keyed by ligand residue name.
+    """
+    return read_store(store, get_store_version(store))
+
+
+def write_store(store : str, records : list[dict]) -> pd.DataFrame:
+    """Adds ligand properties to a ligand store, replacing entries for the
+    same ligands. The store is rewritten atomically.
+
+    Args:
+        store (str): Path to the ligand store.
+        records (list[dict]): Ligand properties with a Ligand_ID key.
+
+    Returns:
+        DataFrame: Contents of the ligand store.
+    """
+    current = load_store(store)
+    current.update({record['Ligand_ID']: record for record in records})
+    store_df = pd.DataFrame(
+        [{**properties, 'Ligand_ID': ligand}
+         for ligand, properties in current.items()],
+        columns=COLUMNS,
+    ).sort_values('Ligand_ID')
+
+    directory = os.path.dirname(os.path.abspath(store))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.ligands_', suffix='.tsv', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        store_df.to_csv(f, sep='\t', index=False)
+    os.replace(tmp, store)
+
+    return store_df
+
+
+def get_ligand_properties(
+    ligand : str, store : str = DEFAULT_LIGAND_STORE, fetch : bool = False
+    ) -> dict:
+    """Looks up ligand properties in the ligand store. Ligands missing from
+    the store are only downloaded from the PDBe (once, and added to the
+    store) if {fetch} is set.
+
+    Args:
+        ligand (str): Ligand residue name (usually a 3-letter code).
+        store (str): Path to the ligand store.
+        fetch (bool): Download ligands missing from the store (default=False).
+
+    Returns:
+        dict: QED_score, MW, Carbon_count, NPR1 and NPR2
+              (None if the ligand is unavailable).
+    """
+    properties = load_store(store).get(ligand)
+    if properties is not None or not fetch or ligand in MISSING:
+        return properties
+
+    mol = fetch_ligand(ligand)
+    if mol is None:
+        MISSING.add(ligand)
+        return None
+
+    properties = calc_ligand_properties(mol)
+    try:
+        write_store(store, [{'Ligand_ID': ligand, **properties}])
+    except OSError as e:
+        print(f'WARNING: Unable to add {ligand} to the ligand store ({store}).\n{e}\n')
+
+    return properties
+
+
+def build_store(sources : list[str], store : str) -> pd.DataFrame:
+    """Populates a ligand store from Chemical Component Dictionary files
+    and/or directories of ideal ligand .sdf files.
+
+    Args:
+        sources (list[str]): Paths to components.cif(.gz) files or
+                             directories of .sdf files.
+        store (str): Path to the ligand store.
+
+    Returns:
+        DataFrame: Contents of the ligand store.
+    """
+    RDLogger.DisableLog('rdApp.*')
+    records = {}
+    for source in sources:
+        if os.path.isdir(source):
+            mols = read_sdf_dir(source)
+        elif os.path.isfile(source):
+            mols = read_ccd(source)
+        else:
+            raise FileNotFoundError(f'Ligand source does not exist: {source}')
+
+        for ligand, mol in mols:
+            if mol is None or ligand in records:
+                continue
+            try:
+                records[ligand] = {'Ligand_ID': ligand,
+                                   **calc_ligand_properties(mol)}
+            except Exception:
+                continue
+    RDLogger.EnableLog('rdApp.*')
+
+    store_df = write_store(store, list(records.values()))
+    print(f'Added {len(records)} ligands to {store} '
+          f'({len(store_df)} ligands in total).')
+
+    return store_df
+
+
+# -----------------------------------------------------------------------------
+def parseArgs(argv : list[str] = None):
+    prs = argparse.ArgumentParser(prog='fpocketR ligands')
+
+    prs.add_argument(
+        'sources',
+        type=str,
+        nargs='+',
+        help='Chemical Component Dictionary files (components.cif or '
+        'components.cif.gz) and/or directories of ideal ligand .sdf files.',
+    )
+    prs.add_argument(
+        '-o',
+        '--store',
+        type=str,
+        required=False,
+        default=DEFAULT_LIGAND_STORE,
+        help='Path to the ligand store (Default: $FPOCKETR_LIGAND_STORE or '
+        '"~/.cache/fpocketR/ligands.tsv").',
+    )
+
+    args = prs.parse_args(argv)
+    return args
+
+
+def main(sources : list[str], store : str):
+    """Builds a ligand store for offline QED and MW lookups."""
+    build_store(sources, store)
@@ -8,9 +8,9 @@
 # Version 1.3.0
 #
 # -----------------------------------------------------
-import os
 from pymol import util
 from pymol import cmd
+from fpocketR import structures
 
 
 def load_pdb(pdb: str) -> None:
@@ -29,7 +29,7 @@ def alignligand(mobile: str, target: str, target_state: int = 0) -> None:
         mobile (str): Path mobile .pdb file.
         target (str): Path to target .pdb file.
     """
-    target_object = os.path.splitext(os.path.basename(target))[0]
+    target_object = structures.get_name(target)
     objects_list = cmd.get_object_list()
     loaded = target_object in objects_list
     if not loaded:
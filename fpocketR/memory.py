@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for bounding and reporting the memory use of fpocketR runs
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import ctypes
+import ctypes.util
+import gc
+import os
+from fpocketR import profiling
+
+# Memory budget in MB of a run (None: unbounded). Setting a budget also
+# enables low-memory analysis. Shared with worker processes through the
+# environment.
+MEMORY_ENV = 'FPOCKETR_MAX_MEMORY'
+DEFAULT_MAX_MEMORY = float(os.environ[MEMORY_ENV]) if os.environ.get(MEMORY_ENV) else None
+
+
+def configure(max_memory : float = None) -> None:
+    """Sets the memory budget of this process and of worker processes
+    started afterwards.
+
+    Args:
+        max_memory (float): Memory budget in MB (None or 0: unbounded).
+    """
+    if max_memory:
+        os.environ[MEMORY_ENV] = str(max_memory)
+    else:
+        os.environ.pop(MEMORY_ENV, None)
+
+
+def get_max_memory() -> float:
+    """Gets the memory budget in MB (None: unbounded)."""
+    max_memory = os.environ.get(MEMORY_ENV)
+    return float(max_memory) if max_memory else None
+
+
+def is_low_memory() -> bool:
+    """Checks if stages should trade speed for memory: structures are used
+    through views instead of copies and released after each state."""
+    return get_max_memory() is not None
+
+
+def get_peak_rss() -> float:
+    """Gets the peak RSS in MB of this process plus its largest finished
+    child process (e.g. fpocket), the memory one job needs at most."""
+    return sum(profiling.get_rss())
+
+
+def get_current_rss() -> float:
+    """Gets the current RSS in MB of this process (e.g. the parent of the
+    workers, holding the imported libraries and the parsed structure).
+    Falls back to the peak RSS where /proc is not available."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return profiling.get_rss()[0]
+
+
+def get_job_limit(
+    jobs : int, peak : float, max_memory : float = None, used : float = None
+) -> int:
+    """Gets the number of jobs that fit in the memory budget left after the
+    memory this process already uses.
+
+    Args:
+        jobs (int): Maximum number of jobs.
+        peak (float): Largest peak RSS of a job in MB (None if unknown).
+        max_memory (float): Memory budget in MB (Default: get_max_memory()).
+        used (float): Memory used outside the jobs in MB
+                      (Default: get_current_rss()).
+
+    Returns:
+        int: Number of jobs to run at once (one until a peak is known).
+    """
+    if max_memory is None:
+        max_memory = get_max_memory()
+    if max_memory is None:
+        return jobs
+    if not peak:
+        return 1
+    if used is None:
+        used = get_current_rss()
+    return max(1, min(jobs, int((max_memory - used) // peak)))
+
+
+def release() -> None:
+    """Frees unreferenced structures and returns freed heap memory to the
+    operating system (glibc only), so the RSS of long-lived workers drops
+    between states."""
+    gc.collect()
+    libc = ctypes.util.find_library('c')
+    try:
+        ctypes.CDLL(libc).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+def print_peak(max_memory : float = None) -> None:
+    """Prints the peak RSS of this process and of its largest finished child
+    (worker or fpocket) process.
+
+    Args:
+        max_memory (float): Memory budget in MB to compare with.
+    """
+    rss, child_rss = profiling.get_rss()
+    budget = f' (budget: {max_memory:g} MB)' if max_memory else ''
+    print(f'Peak memory: {rss:.0f} MB RSS in this process, {child_rss:.0f} MB '
+          f'in the largest worker or fpocket process{budget}.')
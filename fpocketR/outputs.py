@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for parsing fpocket output files
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from prody import AtomGroup
+from prody.utilities.misctools import getMasses
+from fpocketR import structures
+
+# Pocket descriptors of fpocket *_info.txt files: fpocket label (before the
+# colon) -> (column name, type).
+INFO_DESCRIPTORS = {
+    'Score': ('Score', float),
+    'Druggability Score': ('Drug_score', float),
+    'Number of Alpha Spheres': ('a-sphere', int),
+    'Total SASA': ('SASA', float),
+    'Polar SASA': ('Polar_SASA', float),
+    'Apolar SASA': ('Apolar_SASA', float),
+    'Volume': ('Volume', float),
+    'Mean local hydrophobic density': ('Hydrophobic_density', float),
+    'Mean alpha sphere radius': ('Mean_a-sphere_radius', float),
+    'Mean alp. sph. solvent access': ('Mean_a-sphere_solvent_access', float),
+    'Apolar alpha sphere proportion': ('Apolar_a-sphere_proportion', float),
+    'Hydrophobicity score': ('Hydrophobicity_score', float),
+    'Volume score': ('Volume_score', float),
+    'Polarity score': ('Polarity_score', float),
+    'Charge score': ('Charge_score', float),
+    'Proportion of polar atoms': ('Polar_atom_proportion', float),
+    'Alpha sphere density': ('a-sphere_density', float),
+    'Cent. of mass - Alpha Sphere max dist': ('Center_a-sphere_max_distance', float),
+    'Flexibility': ('Flexibility', float),
+}
+
+# Records of fpocket *_out.pdb files kept in *_out_real_sphere.pdb.
+OUT_RECORDS = ('HEADER', 'ATOM', 'HETATM')
+
+
+def read_info(info_txt : str) -> pd.DataFrame:
+    """Reads the pocket descriptors of an fpocket *_info.txt file in one
+    pass. Each line is split once at its colon and looked up in
+    INFO_DESCRIPTORS.
+
+    Args:
+        info_txt (str): Path to the fpocket *_info.txt file.
+
+    Returns:
+        DataFrame: One row per pocket (in file order) with the Pocket number
+                   and a typed column per descriptor (NaN if missing).
+    """
+    columns = {column : [] for column, _ in INFO_DESCRIPTORS.values()}
+    pockets = []
+    with open(info_txt, 'r') as f:
+        for line in f:
+            label, _, value = line.partition(':')
+            label = label.strip()
+            if label.startswith('Pocket '):
+                pockets.append(int(label.split()[1]))
+                for values in columns.values():
+                    values.append(np.nan)
+            elif pockets and label in INFO_DESCRIPTORS:
+                columns[INFO_DESCRIPTORS[label][0]][-1] = float(value)
+
+    info_df = pd.DataFrame({'Pocket': pockets, **columns})
+    return info_df.astype({
+        column : dtype for column, dtype in INFO_DESCRIPTORS.values()
+        if dtype is float or info_df[column].notna().all()
+    })
+
+
+def read_pqr(pqr_out : str) -> dict[str, np.ndarray]:
+    """Reads the a-spheres of an fpocket *_pockets.pqr file in one pass.
+    Coordinates are read from their fixed columns, since fpocket does not
+    always separate them with whitespace.
+
+    Args:
+        pqr_out (str): Path to the fpocket *_pockets.pqr file.
+
+    Returns:
+        dict[str, np.ndarray]: 'coords' (n x 3 a-sphere centers), 'radii'
+                               and 'pockets' (pocket number of each
+                               a-sphere).
+    """
+    with open(pqr_out, 'r') as f:
+        fields = [
+            (line[22:26], line[30:38], line[38:46], line[46:54], line[54:].split()[-1])
+            for line in f if line.startswith('ATOM')
+        ]
+    fields = np.array(fields, dtype=str).reshape(-1, 5)
+    return {
+        'coords': fields[:, 1:4].astype(float),
+        'radii': fields[:, 4].astype(float),
+        'pockets': fields[:, 0].astype(int),
+    }
+
+
+def read_out_pdb(pdb_out : str) -> dict:
+    """Reads an fpocket *_out.pdb file (the RNA and the a-sphere centers of
+    all pockets) in one pass. Atoms of alternate locations other than A are
+    skipped, as prody.parsePDB does.
+
+    Args:
+        pdb_out (str): Path to the fpocket *_out.pdb file.
+
+    Returns:
+        dict: 'lines' (HEADER, ATOM and HETATM records, 80 columns),
+              'atoms' (the fields of every atom, see get_out_atoms),
+              'spheres' (rows of the a-sphere records in 'lines'), and the
+              'coords', 'pockets' and 'polar' (POL, not APOL) flags of the
+              a-spheres.
+    """
+    with open(pdb_out, 'r') as f:
+        lines = [line[0:80].rstrip('\n') for line in f if line.startswith(OUT_RECORDS)]
+    rows = np.array([
+        row for row, line in enumerate(lines)
+        if line.startswith(('ATOM', 'HETATM')) and line[16:17] in ('', ' ', 'A')
+    ], dtype=int)
+    fields = np.array([
+        (lines[row][0:6], lines[row][12:16], lines[row][16:17], lines[row][17:21],
+         lines[row][21:22], lines[row][22:26], lines[row][26:27],
+         lines[row][30:38], lines[row][38:46], lines[row][46:54],
+         lines[row][54:60], lines[row][60:66], lines[row][76:78])
+        for row in rows
+    ], dtype=str).reshape(-1, 13)
+    fields = np.char.strip(fields)
+    atoms = {
+        'hetatm': fields[:, 0] == 'HETATM',
+        'names': fields[:, 1],
+        'altlocs': np.where(fields[:, 2] == '', ' ', fields[:, 2]),
+        'resnames': fields[:, 3],
+        'chids': fields[:, 4],
+        'resnums': np.array([structures.read_resnum(field) for field in fields[:, 5]], dtype=int),
+        'icodes': fields[:, 6],
+        'coords': fields[:, 7:10].astype(float),
+        'occupancies': np.where(fields[:, 10] == '', '0', fields[:, 10]).astype(float),
+        'betas': np.where(fields[:, 11] == '', '0', fields[:, 11]).astype(float),
+        'elements': fields[:, 12],
+    }
+    sphere_atoms = atoms['hetatm'] & (atoms['resnames'] == 'STP')
+    return {
+        'lines': lines,
+        'atoms': atoms,
+        'spheres': rows[sphere_atoms],
+        'coords': atoms['coords'][sphere_atoms],
+        'pockets': atoms['resnums'][sphere_atoms],
+        'polar': atoms['names'][sphere_atoms] == 'POL',
+    }
+
+
+def get_out_atoms(out : dict, title : str = None) -> AtomGroup:
+    """Builds a ProDy atom group of a parsed fpocket *_out.pdb file (the
+    RNA and the a-sphere centers), without parsing the file again.
+
+    Args:
+        out (dict): Parsed *_out.pdb file (see read_out_pdb).
+        title (str): Title of the atom group.
+
+    Returns:
+        object: ProDy atom group.
+    """
+    atoms = out['atoms']
+    out_atoms = AtomGroup(title)
+    out_atoms.setCoords(atoms['coords'])
+    out_atoms.setNames(atoms['names'])
+    out_atoms.setAltlocs(atoms['altlocs'])
+    out_atoms.setResnames(atoms['resnames'])
+    out_atoms.setChids(atoms['chids'])
+    out_atoms.setResnums(atoms['resnums'])
+    out_atoms.setIcodes(atoms['icodes'])
+    out_atoms.setOccupancies(atoms['occupancies'])
+    out_atoms.setBetas(atoms['betas'])
+    out_atoms.setElements(atoms['elements'])
+    out_atoms.setMasses(getMasses(atoms['elements']))
+    out_atoms.setFlags('hetatm', atoms['hetatm'])
+    return out_atoms
+
+
+def read_spheres(pqr_out : str, pdb_out : str) -> tuple[dict[str, np.ndarray], dict]:
+    """Reads the a-spheres of an fpocket run from its *_pockets.pqr (radii)
+    and *_out.pdb (polarity) files, which list them in the same order.
+
+    Args:
+        pqr_out (str): Path to the fpocket *_pockets.pqr file.
+        pdb_out (str): Path to the fpocket *_out.pdb file.
+
+    Returns:
+        dict[str, np.ndarray]: 'coords', 'radii', 'pockets' and 'polar' of
+                               every a-sphere.
+        dict: Parsed *_out.pdb file (see read_out_pdb).
+    """
+    spheres = read_pqr(pqr_out)
+    out = read_out_pdb(pdb_out)
+    if len(out['coords']) != len(spheres['coords']) \
+            or not np.allclose(out['coords'], spheres['coords'], atol=1e-3):
+        print(f'ERROR: The a-spheres of {pdb_out} do not match {pqr_out}.')
+        raise ValueError(f'The a-spheres of {pdb_out} do not match {pqr_out}.')
+    spheres['polar'] = out['polar']
+    return spheres, out
+
+
+def get_sphere_atoms(spheres : dict[str, np.ndarray]) -> AtomGroup:
+    """Builds a ProDy atom group of a-spheres (resname STP, with radii), as
+    parsed from an fpocket *_pockets.pqr file.
+
+    Args:
+        spheres (dict[str, np.ndarray]): a-spheres (see read_pqr).
+
+    Returns:
+        object: ProDy atom group (None if there are no a-spheres).
+    """
+    num_spheres = len(spheres['radii'])
+    if not num_spheres:
+        return None
+    atoms = AtomGroup('a-spheres')
+    atoms.setCoords(spheres['coords'])
+    atoms.setRadii(spheres['radii'])
+    atoms.setResnums(spheres['pockets'])
+    atoms.setResnames(['STP'] * num_spheres)
+    if 'polar' in spheres:
+        atoms.setNames(np.where(spheres['polar'], 'POL', 'APOL'))
+    else:
+        atoms.setNames(['STP'] * num_spheres)
+    return atoms
+
+
+def write_real_sphere(filename : str, out : dict, radii : np.ndarray) -> None:
+    """Writes an fpocket *_out.pdb file with the a-sphere radii in the
+    B-factor column (replacing {filename}).
+
+    Args:
+        filename (str): Path to the output *_out_real_sphere.pdb file.
+        out (dict): Parsed *_out.pdb file (see read_out_pdb).
+        radii (np.ndarray): Radius of every a-sphere of {out}.
+    """
+    lines = list(out['lines'])
+    for row, radius in zip(out['spheres'].tolist(), radii.tolist()):
+        line = lines[row]
+        lines[row] = f'{line[0:60]}{radius:6.2f}{line[66:80]}'
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n' if lines else '')
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for running fpocketR pipelines in parallel worker processes
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from fpocketR import memory
+
+
+def get_pool(jobs : int) -> ProcessPoolExecutor:
+    """Creates a process pool for running pipelines in parallel.
+    Workers are spawned (not forked) so every worker imports its own
+    PyMOL instance instead of sharing the parent's session.
+
+    Args:
+        jobs (int): Number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: Process pool with {jobs} spawned workers.
+    """
+    return ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+@contextmanager
+def scratch_directory(cwd : str, prefix : str):
+    """Changes into a new scratch directory inside {cwd} and removes it
+    (and everything written to it) on exit.
+
+    Args:
+        cwd (str): Directory in which to create the scratch directory.
+        prefix (str): Scratch directory name prefix.
+
+    Yields:
+        str: Path to the scratch directory.
+    """
+    scratch = tempfile.mkdtemp(prefix=f'.{prefix}_', dir=cwd)
+    try:
+        os.chdir(scratch)
+        yield scratch
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_state(pipeline_kwargs : dict) -> tuple[int, float]:
+    """Runs the pocket finding pipeline for a single state in a worker.
+    Each pipeline run works in its own workspace, so states never collide.
+
+    Args:
+        pipeline_kwargs (dict): Keyword arguments for the pipeline.
+                                Paths must be absolute.
+
+    Returns:
+        int: Structural state that was analyzed.
+        float: Peak RSS in MB of the worker and its largest fpocket process.
+    """
+    from fpocketR.__main__ import pipeline
+
+    pipeline(**pipeline_kwargs)
+    if memory.is_low_memory():
+        memory.release()
+    return pipeline_kwargs['state'], memory.get_peak_rss()
+
+
+def run_states(
+    pipeline_kwargs : dict,
+    states : list[int],
+    jobs : int,
+    max_memory : float = None,
+) -> None:
+    """Runs the pocket finding pipeline for multiple states in parallel.
+    Each state records its own progress in the run manifest, so states can
+    finish in any order and an interrupted run resumes safely.
+
+    With a memory budget, one state runs until the peak RSS of a worker is
+    known, and then as many states run at once as fit in the budget left
+    after the RSS of this process (at most {jobs}). Workers are only started
+    when a state is submitted.
+
+    Args:
+        pipeline_kwargs (dict): Keyword arguments for the pipeline
+                                (excluding state). Paths must be absolute.
+        states (list[int]): Structural states to analyze.
+        jobs (int): Number of worker processes.
+        max_memory (float): Memory budget in MB (None: {jobs} states at once).
+    """
+    pending = sorted(states)
+    running = set()
+    finished = 0
+    peak = None
+    limit = memory.get_job_limit(jobs, peak, max_memory)
+    with get_pool(jobs) as pool:
+        while pending or running:
+            while pending and len(running) < limit:
+                running.add(pool.submit(
+                    run_state, {**pipeline_kwargs, 'state': pending.pop(0)}))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                state, rss = future.result()
+                finished += 1
+                print(f'Finished state {state} '
+                      f'({finished}/{len(states)} states).')
+                peak = max(peak or 0, rss)
+                if max_memory and rss > max_memory:
+                    print(f'WARNING: State {state} used {rss:.0f} MB, more '
+                          f'than the {max_memory:g} MB budget.')
+
+            if max_memory:
+                new_limit = memory.get_job_limit(jobs, peak, max_memory)
+                if new_limit != limit:
+                    print(f'Running {new_limit} states at once (peak '
+                          f'{peak:.0f} MB per worker, budget {max_memory:g} MB).')
+                limit = new_limit
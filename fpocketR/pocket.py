@@ -10,11 +10,13 @@
 # -----------------------------------------------------------------------------
 
 import os
-import sys
-import subprocess
-import shutil
-import time
-from pymol import cmd
+import numpy as np
+from prody import AtomGroup
+from scipy.spatial import cKDTree
+from fpocketR import cache, profiling, runner, structures
+
+# Maximum O3'-P distance (angstroms) of a phosphodiester bond.
+LINK_DISTANCE = 2.0
 
 
 def find_pockets(
@@ -30,11 +32,19 @@ def find_pockets(
     out : str,
     name : str,
     yes : bool,
-    ) -> str:
+    workdir : str,
+    pdb_clean : str = None,
+    cachedir : str = None,
+    refresh : bool = False,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+    single_model : bool = False,
+    ) -> tuple[str, str, str, bool]:
     """Pocket finding pipeline:
         - cleans pdb file to generate rna-only file
-        - runs pocket prediction using fpocket
+        - runs pocket prediction using fpocket (or reuses cached outputs)
         - manages fpocket output files
+    All files are written to the workspace {workdir}; the input .pdb file
+    is never modified.
 
     Args:
         pdb (str): Path to input .pdb file.
@@ -46,51 +56,278 @@ def find_pockets(
         D (float): a-sphere clustering distance in angstroms (default=1.65).
         out (str): name of fpocket output parent directory name.
         yes (boolean): Overwrite output files and directories with same name.
+        workdir (str): Path to the workspace for this run.
+        pdb_clean (str): Path to an already cleaned .pdb file shared between
+                         states ({pdb} is then the matching cleaned copy of
+                         the input). Cleans {pdb} into {workdir} if None.
+        cachedir (str): Path to the cache directory (None disables caching).
+        refresh (boolean): Reruns fpocket and replaces cached outputs.
+        cachesize (float): Maximum cache size in MB.
+        single_model (boolean): {pdb_clean} holds only {state} (e.g. a
+                                trajectory frame), so fpocket reads its only
+                                model and {state} only names the outputs.
 
     Returns:
-        str: path to output directory contianing fpocket outputs for analysis
+        str: path to workspace directory contianing fpocket outputs for analysis
+        str: path to final output directory in {out}
+        str: path to the cleaned copy of the input .pdb file
+        bool: Overwrite output files and directories with same name.
     """
 
-    # Path to clean (ligand-free) pdb file
-    pdb_clean = f'{name}_clean.pdb'
+    # Path to clean (ligand-free) pdb file in the workspace.
+    workspace_clean = os.path.join(workdir, f'{name}_clean.pdb')
 
-    # Makes pdb_clean if it is not already a file
-    if not os.path.isfile(pdb_clean):
-        clean_pdb(pdb, pdb_clean)
+    if pdb_clean is None:
+        pdb_copy = os.path.join(
+            workdir, f'{structures.get_name(pdb)}.pdb')
+        clean_pdb(pdb, workspace_clean, pdb_copy)
+        pdb = pdb_copy
+    else:
+        # fpocket writes its outputs next to its input, so the shared clean
+        # file is linked into the workspace.
+        os.symlink(os.path.abspath(pdb_clean), workspace_clean)
+    pdb_clean = workspace_clean
 
-    # Runs fpocket on cleaned pdb file.
-    run_fpocket(pdb_clean, name, chain, state, m, M, i, D, A, p)
+    # Runs fpocket on cleaned pdb file (or reuses cached outputs).
+    get_fpocket_outputs(
+        pdb_clean, name, chain, None if single_model else state,
+        m, M, i, D, A, p, cachedir, refresh, cachesize)
 
-    # Files fpocket outputs into directories and manages overwriting.
-    analysis, yes = file_fpocket(pdb_clean, state, out, yes)
-    return analysis.strip('/'), yes
+    # Names fpocket outputs and manages overwriting.
+    analysis, dest_dir, yes = file_fpocket(pdb_clean, state, out, yes)
+    return analysis, dest_dir, pdb, yes
 
 # -----------------------------------------------------------------------------
 
 
-def clean_pdb(pdb : str, pdb_clean : str) -> None:
-    """Cleans a .pdb file input and saves output as a .pdb file.
+def get_polymer_atoms(structure : AtomGroup) -> np.ndarray:
+    """Finds polymer atoms in a structure. Residues from ATOM records are
+    polymer residues, and HETATM residues (e.g. modified nucleotides) are
+    polymer residues if they are linked to another residue by a
+    phosphodiester bond. Free ligands, waters and ions are not polymer.
+
+    Args:
+        structure (object): ProDy atom group of the input structure.
+
+    Returns:
+        np.ndarray: Boolean mask of polymer atoms.
+    """
+    names = structure.getNames()
+    resindices = structure.getResindices()
+    num_residues = resindices.max() + 1
+    coords = structure.getCoords()
+
+    # Residues linked through O3'-P bonds (first coordinate set).
+    linked = np.zeros(num_residues, dtype=bool)
+    o3 = np.flatnonzero(names == "O3'")
+    phosphorus = np.flatnonzero(names == 'P')
+    if len(o3) and len(phosphorus):
+        pairs = cKDTree(coords[o3]).sparse_distance_matrix(
+            cKDTree(coords[phosphorus]), LINK_DISTANCE, output_type='ndarray')
+        res_o3 = resindices[o3[pairs['i']]]
+        res_p = resindices[phosphorus[pairs['j']]]
+        bonded = res_o3 != res_p
+        linked[res_o3[bonded]] = True
+        linked[res_p[bonded]] = True
+
+    hetero = np.bincount(
+        resindices, weights=structure.getFlags('hetatm'),
+        minlength=num_residues) > 0
+    polymer = (~hetero | linked)[resindices]
+
+    return polymer & ~structure.getFlags('water') & ~structure.getFlags('ion')
+
+
+def write_pdb(filename : str, atoms : AtomGroup) -> None:
+    """Writes every coordinate set of an atom group to a .pdb file in one
+    streamed pass. The fixed columns of each atom are formatted once and
+    only the coordinates are formatted per state (MODEL). Residue numbers
+    above 9999 are written in hybrid-36 (as read by ProDy).
+
+    Args:
+        filename (str): Path to output .pdb file.
+        atoms (object): ProDy atom group or selection.
+    """
+    num_atoms = atoms.numAtoms()
+    hetatm = atoms.getFlags('hetatm')
+    if hetatm is None:
+        hetatm = np.zeros(num_atoms, dtype=bool)
+    records = np.where(hetatm, 'HETATM', 'ATOM')
+    chids = atoms.getChids()
+    if chids is None:
+        chids = [''] * num_atoms
+    wide = sorted({chid for chid in chids if len(chid) > 2})
+    if wide:
+        print(f'ERROR: Chain identifiers longer than 2 characters cannot be '
+              f'written to {filename}: {", ".join(wide)}.')
+        raise ValueError(
+            f'Chain identifiers longer than 2 characters cannot be written to '
+            f'a .pdb file: {", ".join(wide)}. Rename the chains (e.g. in PyMOL '
+            'or ChimeraX) and rerun.')
+    altlocs = atoms.getAltlocs()
+    if altlocs is None:
+        altlocs = [' '] * num_atoms
+    icodes = atoms.getIcodes()
+    if icodes is None:
+        icodes = [' '] * num_atoms
+    names = [name if len(name) >= 4 else f' {name}' for name in atoms.getNames()]
+    occupancies = atoms.getOccupancies()
+    if occupancies is None:
+        occupancies = np.zeros(num_atoms)
+    betas = atoms.getBetas()
+    if betas is None:
+        betas = np.zeros(num_atoms)
+    elements = atoms.getElements()
+    if elements is None:
+        elements = [''] * num_atoms
+    segments = atoms.getSegnames()
+    if segments is None:
+        segments = [''] * num_atoms
+    charges = atoms.getCharges()
+    if charges is None:
+        charges = np.zeros(num_atoms)
+    charges = [
+        f'{abs(int(charge))}{"-" if charge < 0 else "+"}' if int(charge) else ''
+        for charge in charges
+    ]
+
+    heads = [
+        f'{record:<6}{(serial % 100000):5d} {name:<4}{altloc:1}'
+        f'{resname:<3}{chid:>2}{structures.write_resnum(resnum)}{icode:1}   '
+        for serial, record, name, altloc, resname, chid, resnum, icode in zip(
+            range(1, num_atoms + 1), records, names, altlocs,
+            atoms.getResnames(), chids, atoms.getResnums().tolist(), icodes)
+    ]
+    tails = [
+        f'{occupancy:6.2f}{beta:6.2f}      {segment:>4}{element:>2}{charge:>2}\n'
+        for occupancy, beta, segment, element, charge in zip(
+            occupancies, betas, segments, elements, charges)
+    ]
+
+    coordsets = atoms.getCoordsets()
+    multi = len(coordsets) > 1
+    with open(filename, 'w') as f:
+        for model, coords in enumerate(coordsets, start=1):
+            if multi:
+                f.write(f'MODEL{model:9d}\n')
+            f.writelines([
+                f'{head}{x:8.3f}{y:8.3f}{z:8.3f}{tail}'
+                for head, (x, y, z), tail in zip(heads, coords.tolist(), tails)
+            ])
+            if multi:
+                f.write('ENDMDL\n')
+        f.write('END   \n')
+
+
+def clean_structure(structure : AtomGroup):
+    """Selects the RNA atoms of a structure for pocket finding.
+    Removes not polymer molecules (ligands) and proteins.
+    Preserves modified/heteroatom RNA residues, which are flagged as
+    ATOM records in {structure} (other heteroatoms stay HETATM).
+
+    Args:
+        structure (object): ProDy structure (hetatm flags are updated).
+                            Structures built without hetatm flags get them
+                            from residue names (not a standard nucleotide
+                            or amino acid), as in .pdb files.
+
+    Returns:
+        object: ProDy selection of the RNA atoms (all states).
+    """
+    if structure.getFlags('hetatm') is None:
+        structure.setFlags('hetatm', ~(
+            structure.getFlags('nucleic') | structure.getFlags('protein')))
+    polymer = get_polymer_atoms(structure)
+    structure.setFlags('hetatm', structure.getFlags('hetatm') & ~polymer)
+
+    # Removes protein residues (polymer residues with an alpha carbon).
+    resindices = structure.getResindices()
+    protein = (np.bincount(
+        resindices, weights=polymer & (structure.getNames() == 'CA'))
+        > 0)[resindices]
+    return structure[np.flatnonzero(polymer & ~protein)]
+
+
+@profiling.profiled('clean')
+def clean_pdb(pdb : str, pdb_clean : str, pdb_copy : str = None) -> None:
+    """Cleans a .pdb/.cif file input (optionally gzip-compressed) and saves
+       output as a .pdb file for fpocket.
        Removes not polymer molecules (ligands) and proteins.
        Preserves modified/heteroatom RNA residues.
+       All states (coordinate sets) are written in a single pass.
 
     Args:
-        pdb (str): path to input .pdb file.
+        pdb (str): path to input .pdb/.cif file.
         pdb_clean (str): path to output (cleaned) .pdb file.
+        pdb_copy (str): path to output copy of the input .pdb file with
+                        polymer residues saved as ATOM records (optional).
     """
-    cmd.load(pdb)
-    cmd.alter('polymer', 'type="ATOM"')
-    cmd.save(pdb, state='0')
-    time.sleep(1)
-    cmd.remove('not polymer')
-    cmd.remove('byres polymer & name CA')
-    cmd.save(pdb_clean, state='0')
-    time.sleep(1)
-    cmd.reinitialize()
+    structure = structures.parse_structure(pdb, altloc='all')
+    rna = clean_structure(structure)
+    if pdb_copy:
+        write_pdb(pdb_copy, structure)
+    write_pdb(pdb_clean, rna)
 
 
 # class MissingEnvironmentVariable(Exception):
 #     pass
 
+@profiling.profiled('fpocket')
+def get_fpocket_outputs(
+    pdb_clean : str,
+    name : str,
+    chain : str,
+    state : int,
+    m : float,
+    M : float,
+    i : int,
+    D : float,
+    A : int,
+    p : float,
+    cachedir : str = None,
+    refresh : bool = False,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+    ) -> str:
+    """Runs fpocket on a cleaned .pdb file, or copies the outputs of an
+    identical earlier run from the cache.
+
+    Args:
+        pdb_clean (str): Path to the cleaned .pdb file.
+        name (str): Output file name prefix.
+        chain (str): Chain identifier for desired RNA chain.
+        state (int): Structural state to analyze.
+        m (float): Min. a-sphere radius in angstroms.
+        M (float): Max. a-sphere radius in angstroms.
+        i (int): Min. number of a-spheres per pocket.
+        D (float): a-sphere clustering distance in angstroms.
+        A (int): # of electroneg. atoms to define a polar a-sphere.
+        p (float): Max. ratio of apolar a-spheres in a pocket.
+        cachedir (str): Path to the cache directory (None disables caching).
+        refresh (boolean): Reruns fpocket and replaces cached outputs.
+        cachesize (float): Maximum cache size in MB.
+
+    Returns:
+        str: Path to the fpocket output directory ({pdb_clean} stem + _out).
+    """
+    source_dir = f'{os.path.splitext(pdb_clean)[0]}_out'
+
+    # Reuses fpocket outputs from an identical earlier run.
+    if cachedir:
+        key = cache.get_fpocket_key(
+            pdb_clean, get_fpocket_path(), chain, state, m, M, i, D, A, p)
+        if not refresh and cache.fetch_fpocket(cachedir, key, source_dir):
+            print(f'Using cached fpocket outputs for {name}.\n')
+        else:
+            run_fpocket(pdb_clean, name, chain, state, m, M, i, D, A, p)
+            if os.path.isdir(source_dir):
+                cache.store_fpocket(cachedir, key, source_dir, cachesize)
+
+    else:
+        run_fpocket(pdb_clean, name, chain, state, m, M, i, D, A, p)
+
+    return source_dir
+
+
 def run_fpocket(
     pdb : str,
     name : str,
@@ -104,6 +341,8 @@ def run_fpocket(
     p : float,
     ) -> None:
     """Detects potential binding pockets in RNA structures using fpocket.
+    fpocket output is streamed to a log kept with its outputs
+    ({pdb stem}_fpocket.log), see runner.run_fpocket.
 
     Args:
         pdb (str): Path to input .pdb file.
@@ -117,69 +356,60 @@ def run_fpocket(
     # Prints announcement that fpocket is searching for pockets.
     name = os.path.basename(pdb)[0:-4]
     print(f'***** POCKET HUNTING {name} *****')
-    # Runs fpocket bash commands
-    # Try to find fpocket in the current conda/mamba/micromamba environment
-    env_prefix = os.environ.get('CONDA_PREFIX', os.environ.get('MAMBA_ROOT_PREFIX', sys.prefix))
-    fpocket_env_path = os.path.join(env_prefix, 'bin', 'fpocket')
-    if os.path.isfile(fpocket_env_path) and os.access(fpocket_env_path, os.X_OK):
-        fpocket_path = fpocket_env_path
-    else:
-        fpocket_path = shutil.which('fpocket')
-    if not fpocket_path:
-        raise FileNotFoundError('fpocket executable not found in current environment or PATH. Ensure fpocket is installed and available.')
-    cmd = [fpocket_path, '-f', pdb, '-k', chain, '-l', str(state), '-m', str(m), '-M', str(M), '-i', str(i), '-D', str(D), '-A', str(A), '-p', str(p), '-w', 'p']
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-    stdout, stderr = process.communicate()
-    print(stdout)
-    print(stderr)
-    if 'EnvironmentLocationNotFound' in stdout or 'EnvironmentLocationNotFound' in stderr:
-        raise OSError('Unable to run fpocket because the fpocketR environment does not exist.\nInstall the fpocketR environment.')
-
-
-def file_fpocket(pdb : str, state : int, out : str, yes : bool) -> tuple[str, bool]:
-    """Moves fpocket outputs into designated output directory.
-       Default directory name specifies the fpocket parameters used.
-       Manages overwriting files/directories if thet already exist.
+    runner.run_fpocket(pdb, chain, state, m, M, i, D, A, p)
+
+
+def get_fpocket_path() -> str:
+    """Finds the fpocket executable in the current conda/mamba/micromamba
+    environment or on the PATH (resolved once per process).
+
+    Returns:
+        str: Path to the fpocket executable.
+    """
+    return runner.get_fpocket_path()
+
+
+def file_fpocket(
+    pdb : str, state : int, out : str, yes : bool
+    ) -> tuple[str, str, bool]:
+    """Names fpocket outputs for analysis and gets their final output
+       directory. Default directory name specifies the fpocket parameters used.
+       Manages overwriting files/directories if thet already exist; existing
+       directories are replaced when the run finishes.
 
     Args:
-        pdb (str): Path to input .pdb file.
+        pdb (str): Path to cleaned .pdb file in the workspace.
         state (int): Structural state to analyze.
         out (str): name of fpocket output parent directory name.
         y (boolean): Overwrites output files and directories with same name.
 
     Returns:
-        str: path to output directory contianing fpocket outputs for analysis
+        str: path to workspace directory contianing fpocket outputs for analysis
+        str: path to final output directory in {out}
+        bool: Overwrite output files and directories with same name.
     """
-    # Moves fpocket output directories into a shared directory.
-    source_dir = f'{pdb.rsplit(".")[0]}_out'
-        
+    prefix = os.path.splitext(os.path.basename(pdb))[0]
+    source_dir = f'{os.path.splitext(pdb)[0]}_out'
+
     if not os.path.isdir(source_dir):
         raise FileNotFoundError(f'fpocket output directory does not exist: {source_dir}.')
 
     if state is None:
-        dest_dir = os.path.join(out, f'{pdb.rsplit(".")[0]}_out')
+        dest_name = f'{prefix}_out'
     else:
-        dest_dir = os.path.join(out, f'{pdb.rsplit(".")[0]}_state{state}_out')
-
-    if source_dir == dest_dir:
-        analysis = source_dir
-
-    elif not os.path.isdir(dest_dir):
-        analysis = shutil.move(source_dir, dest_dir)
+        dest_name = f'{prefix}_state{state}_out'
+    dest_dir = os.path.join(out, dest_name)
 
     # Prompts user to overwrite an existing file with same name.
-    elif os.path.isdir(dest_dir):
-        if not yes:
-            remove = input(
-                'A directory already exists with this name.\n'
-                f'{dest_dir}\n\n'
-                'Overwrite directory? [y/n]: '
-            )
-            print()
-        if yes or remove in ('y', 'Y', 'yes', 'Yes'):
+    if os.path.isdir(dest_dir) and not yes:
+        remove = input(
+            'A directory already exists with this name.\n'
+            f'{dest_dir}\n\n'
+            'Overwrite directory? [y/n]: '
+        )
+        print()
+        if remove in ('y', 'Y', 'yes', 'Yes'):
             yes = True
-            shutil.rmtree(dest_dir)
-            analysis = shutil.move(source_dir, dest_dir)
         else:
             print(
                 'Exiting program. \n'
@@ -188,21 +418,22 @@ def file_fpocket(pdb : str, state : int, out : str, yes : bool) -> tuple[str, bo
             )
             exit()
 
+    analysis = os.path.join(os.path.dirname(source_dir), dest_name)
+    if analysis != source_dir:
+        os.rename(source_dir, analysis)
+
     # Adds state identifier number to file names.
     if state is not None:
-        for file in os.listdir(dest_dir):
-            file = os.path.join(dest_dir, file)
-            if not os.path.isfile(file):
+        for file in os.listdir(analysis):
+            src = os.path.join(analysis, file)
+            if not os.path.isfile(src) or not file.startswith(prefix):
                 continue
 
-            head_tail = os.path.split(file)
-            filename_ext = head_tail[1].split(pdb[0:-4])
-            src = os.path.join(file)
             dst = os.path.join(
-                head_tail[0], f'{pdb[0:-4]}_state{state}{filename_ext[1]}')
+                analysis, f'{prefix}_state{state}{file[len(prefix):]}')
 
             # check if the file doesn't exist
             if not os.path.exists(dst):
                 os.rename(src, dst)
 
-    return analysis, yes
+    return analysis, dest_dir, yes
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for recording per-stage timing and memory use of pipeline runs
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+# Profile report (JSON lines) shared with worker processes through the
+# environment, so parallel states and batch entries append to one report.
+PROFILE_ENV = 'FPOCKETR_PROFILE'
+DEFAULT_PROFILE = os.environ.get(PROFILE_ENV)
+
+# Pipeline stages in the order they run.
+STAGES = (
+    'input',
+    'clean',
+    'fpocket',
+    'merge',
+    'characteristics',
+    'pocket_nt',
+    'surfaces',
+    'ligand',
+    '2D_figure',
+    '3D_figure',
+    'aggregation',
+)
+
+# Records of the stages profiled in this process (see get_records).
+RECORDS = []
+
+
+class Stacks(threading.local):
+    """Tags (structure, state, pockets) and buffered records of the
+    enclosing tagged() blocks, and the traced memory peaks of the enclosing
+    stages. Each thread (e.g. threads running fpocket) has its own stacks.
+    """
+    def __init__(self):
+        self.tags = []
+        self.peaks = []
+
+
+STACKS = Stacks()
+
+# ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def enable(path : str = None) -> None:
+    """Starts recording stage timings and memory use. Records are appended
+    to {path} as JSON lines and kept in memory (see get_records). Worker
+    processes started afterwards append to the same report.
+
+    Args:
+        path (str): Path to the profile report (None keeps records in memory).
+    """
+    if path:
+        os.environ[PROFILE_ENV] = os.path.abspath(path)
+    else:
+        os.environ[PROFILE_ENV] = ''
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable() -> None:
+    """Stops recording stage timings and memory use."""
+    os.environ.pop(PROFILE_ENV, None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled() -> bool:
+    """Checks if stage timings are being recorded in this process."""
+    return PROFILE_ENV in os.environ
+
+
+def get_records() -> list[dict]:
+    """Returns the stage records of this process since profiling started."""
+    return list(RECORDS)
+
+
+def get_rss() -> tuple[float, float]:
+    """Gets the peak resident set size of this process and of its largest
+    finished child process (e.g. fpocket).
+
+    Returns:
+        float: Peak RSS of this process in MB.
+        float: Peak RSS of the largest child process in MB.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own * RSS_UNIT / 2**20, child * RSS_UNIT / 2**20
+
+
+def write_record(record : dict) -> None:
+    """Adds a finished stage record to the in-memory records and appends it
+    to the profile report. Each record is written with a single append, so
+    concurrent workers never interleave lines.
+
+    Args:
+        record (dict): Stage record.
+    """
+    RECORDS.append(record)
+    path = os.environ.get(PROFILE_ENV)
+    if path:
+        line = (json.dumps(record, default=str) + '\n').encode()
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+@contextmanager
+def tagged(structure : str = None, state : int = None):
+    """Tags the stages run inside the block with a structure and state.
+    Records are held until the block ends, so the pocket count set with
+    set_tags() is added to stages that ran before it was known.
+
+    Args:
+        structure (str): Structure name.
+        state (int): Structural state.
+
+    Yields:
+        dict: Tags of the block.
+    """
+    if not is_enabled():
+        yield {}
+        return
+
+    tags = {'Structure': structure, 'State': state, 'Pockets': None}
+    records = []
+    STACKS.tags.append((tags, records))
+    try:
+        yield tags
+    finally:
+        STACKS.tags.pop()
+        for record in records:
+            for key, value in tags.items():
+                if record.get(key) is None:
+                    record[key] = value
+            write_record(record)
+
+
+def set_tags(**tags) -> None:
+    """Updates the tags of the innermost tagged() block
+    (e.g. set_tags(Pockets=5)).
+    """
+    if STACKS.tags:
+        STACKS.tags[-1][0].update(tags)
+
+
+@contextmanager
+def stage(name : str, **tags):
+    """Records the wall time, CPU time and memory use of a pipeline stage.
+    Does nothing unless profiling is enabled.
+
+    Memory use is reported as the peak RSS of the process (and of the
+    largest child process) when the stage ends, and as the peak memory
+    allocated by Python during the stage (tracemalloc).
+
+    Args:
+        name (str): Stage name (see STAGES).
+        **tags: Extra values for the record (e.g. Structure, State).
+
+    Yields:
+        dict: Stage record, which the stage may add values to.
+    """
+    if not is_enabled():
+        yield {}
+        return
+
+    # Workers inherit the report path but not the tracer.
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    record = {'Stage': name, 'Structure': None, 'State': None, 'Pockets': None}
+    if STACKS.tags:
+        record.update(STACKS.tags[-1][0])
+    record.update(tags)
+
+    # The enclosing stage keeps the highest peak seen before this stage.
+    if STACKS.peaks:
+        STACKS.peaks[-1] = max(STACKS.peaks[-1], tracemalloc.get_traced_memory()[1])
+    STACKS.peaks.append(0)
+    tracemalloc.reset_peak()
+
+    started = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record['Error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        traced = max(STACKS.peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if STACKS.peaks:
+            STACKS.peaks[-1] = max(STACKS.peaks[-1], traced)
+        rss, child_rss = get_rss()
+
+        record.update({
+            'Wall': round(wall, 4),
+            'CPU': round(cpu, 4),
+            'RSS': round(rss, 1),
+            'Child_RSS': round(child_rss, 1),
+            'Traced': round(traced / 2**20, 2),
+            'PID': os.getpid(),
+            'Started': round(started, 3),
+        })
+        if STACKS.tags:
+            STACKS.tags[-1][1].append(record)
+        else:
+            write_record(record)
+
+
+def profiled(name : str):
+    """Decorator that records every call of a function as a stage.
+
+    Args:
+        name (str): Stage name (see STAGES).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_profile(paths : list[str]) -> pd.DataFrame:
+    """Reads stage records from profile reports.
+
+    Args:
+        paths (list[str]): Paths to profile reports (JSON lines).
+
+    Returns:
+        DataFrame: One row per stage record.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    records = []
+    for path in paths:
+        with open(path, 'r') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return pd.DataFrame.from_records(records)
+
+
+def summarize(profile_df : pd.DataFrame) -> pd.DataFrame:
+    """Summarizes stage records per stage (e.g. across a batch).
+
+    Args:
+        profile_df (DataFrame): Stage records (see read_profile).
+
+    Returns:
+        DataFrame: Calls, total/mean/max wall time, total CPU time and
+                   peak memory of each stage, in pipeline order.
+    """
+    summary = profile_df.groupby('Stage').agg(
+        Calls=('Wall', 'size'),
+        Wall=('Wall', 'sum'),
+        Mean_wall=('Wall', 'mean'),
+        Max_wall=('Wall', 'max'),
+        CPU=('CPU', 'sum'),
+        RSS=('RSS', 'max'),
+        Child_RSS=('Child_RSS', 'max'),
+        Traced=('Traced', 'max'),
+    )
+    order = [s for s in STAGES if s in summary.index]
+    order += sorted(s for s in summary.index if s not in STAGES)
+    summary = summary.loc[order]
+    summary['Wall_share'] = summary['Wall'] / summary['Wall'].sum()
+    return summary.round(3).reset_index()
+
+
+def print_summary(path : str) -> None:
+    """Prints the per-stage summary of a profile report.
+
+    Args:
+        path (str): Path to the profile report.
+    """
+    if not path or not os.path.isfile(path):
+        return
+    summary = summarize(read_profile(path))
+    print(f'\nProfile report: {path}\n{summary.to_string(index=False)}\n')
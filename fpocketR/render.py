@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for rendering deferred 2D and 3D figures from render specs
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import argparse
+import glob
+import os
+import time
+import pandas as pd
+from concurrent.futures import as_completed
+from fpocketR import parallel, profiling
+
+# Render specs written by `fpocketR --render deferred`.
+RENDER_SPEC_PATTERN = '*_render.json'
+
+
+def find_render_specs(paths : list[str]) -> list[str]:
+    """Finds render specs in output directories (searched recursively).
+
+    Args:
+        paths (list[str]): Paths to render specs and/or output directories.
+
+    Returns:
+        list[str]: Absolute paths to render specs.
+    """
+    specs = []
+    for path in paths:
+        if os.path.isdir(path):
+            specs.extend(glob.glob(
+                os.path.join(path, '**', RENDER_SPEC_PATTERN), recursive=True))
+        elif os.path.isfile(path):
+            specs.append(path)
+        else:
+            raise FileNotFoundError(f'Render spec or directory does not exist: {path}')
+
+    return sorted({os.path.abspath(spec) for spec in specs})
+
+
+def select_render_specs(specs : list[str], top : int = None) -> list[str]:
+    """Selects the render specs of the {top} structures with the highest
+    scoring pocket. Multistate (all states) specs are always kept.
+
+    Args:
+        specs (list[str]): Paths to render specs.
+        top (int): Number of single state specs to keep (None keeps all).
+
+    Returns:
+        list[str]: Paths to render specs.
+    """
+    if top is None:
+        return specs
+
+    from fpocketR import figures
+    scored, kept = [], []
+    for spec_path in specs:
+        spec = figures.read_render_spec(spec_path)
+        if spec['kind'] == 'state':
+            score = spec.get('score')
+            scored.append((score if score is not None else float('-inf'), spec_path))
+        else:
+            kept.append(spec_path)
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return sorted(kept + [spec_path for _, spec_path in scored[:top]])
+
+
+def is_rendered(spec_path : str, dpi : int = None) -> bool:
+    """Checks if the 3D figure of a render spec already exists.
+
+    Args:
+        spec_path (str): Path to the render spec.
+        dpi (int): Figure resolution override (None uses the spec's dpi).
+
+    Returns:
+        bool: True if the figure exists.
+    """
+    from fpocketR import figures
+    spec = figures.read_render_spec(spec_path)
+    name = spec['name'] if spec['kind'] == 'state' else f"{spec['name']}_all_states"
+    dpi = dpi if dpi else spec['dpi']
+    return os.path.isfile(
+        os.path.join(os.path.dirname(spec_path), f'{name}_3D_{dpi}.png'))
+
+
+def render_spec(spec_path : str, dpi : int = None) -> dict:
+    """Renders the 2D and 3D figures described by a render spec into the
+    directory that contains the spec. Failures are recorded instead of
+    raised so one bad spec does not stop the others.
+
+    Args:
+        spec_path (str): Path to the render spec.
+        dpi (int): Figure resolution override (None uses the spec's dpi).
+
+    Returns:
+        dict: Per-spec status, wall time and failure reason.
+    """
+    from fpocketR import figures
+
+    record = {'Spec': spec_path, 'Status': 'Failed', 'Time': None, 'Error': None}
+    start = time.perf_counter()
+    try:
+        spec = figures.read_render_spec(spec_path)
+        directory = os.path.dirname(spec_path)
+        dpi = dpi if dpi else spec['dpi']
+        ss = spec['ss']
+        alignligand = spec['alignligand']
+
+        if ss and not os.path.isfile(ss):
+            print(f'WARNING: {ss} does not exist. Skipping 2D figures.\n')
+            ss = None
+        if alignligand and not os.path.isfile(alignligand):
+            print(f'WARNING: {alignligand} does not exist. Skipping alignment.\n')
+            alignligand = None
+
+        with profiling.tagged(spec['name'], spec.get('state')):
+            if spec['kind'] == 'state':
+                if ss:
+                    figures.make_2D_figure(
+                        ss, spec['seq_cmap'], spec['pocket_nt_color'],
+                        directory, spec['name'], spec['connectpocket'])
+                figures.make_3D_figure(
+                    None, spec['state'], directory, spec['name'], dpi,
+                    spec['chain'], spec['zoom'], spec['pocket_cmap'], alignligand)
+
+            elif spec['kind'] == 'all_states':
+                if ss:
+                    figures.get_all_states_2D_figure(
+                        spec['name'], directory, ss, spec['num_states'],
+                        spec['multistate_pocket_nt_color'])
+                figures.get_all_states_3D_figure(
+                    spec['num_states'], directory, spec['name'],
+                    spec['multistate_pocket_cmap'], alignligand, dpi,
+                    spec['chain'], spec['zoom'])
+
+            else:
+                raise ValueError(f"Unknown render spec kind: {spec['kind']}")
+
+        record['Status'] = 'Success'
+
+    except Exception as e:
+        record['Error'] = f'{type(e).__name__}: {e}'
+        print(f'ERROR: Unable to render {spec_path}\n{record["Error"]}\n')
+
+    record['Time'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def render_specs(
+    specs : list[str], jobs : int = 1, dpi : int = None
+    ) -> pd.DataFrame:
+    """Renders figures for many render specs using a pool of long-lived
+    workers, so PyMOL is imported once per worker, not per spec.
+
+    Args:
+        specs (list[str]): Paths to render specs.
+        jobs (int): Number of worker processes.
+        dpi (int): Figure resolution override (None uses each spec's dpi).
+
+    Returns:
+        DataFrame: Render report with per-spec status, wall time and error.
+    """
+    if jobs > 1:
+        records = []
+        with parallel.get_pool(jobs) as pool:
+            futures = [pool.submit(render_spec, spec, dpi) for spec in specs]
+            for future in as_completed(futures):
+                records.append(future.result())
+    else:
+        records = [render_spec(spec, dpi) for spec in specs]
+
+    return pd.DataFrame.from_records(
+        records, columns=['Spec', 'Status', 'Time', 'Error']).sort_values('Spec')
+
+
+# -----------------------------------------------------------------------------
+def parseArgs(argv : list[str] = None):
+    prs = argparse.ArgumentParser(prog='fpocketR render')
+
+    prs.add_argument(
+        'paths',
+        type=str,
+        nargs='+',
+        help='Render specs (*_render.json) and/or fpocketR output directories '
+        'to search for render specs.',
+    )
+    prs.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of worker processes (1).',
+    )
+    prs.add_argument(
+        '-t',
+        '--top',
+        type=int,
+        required=False,
+        default=None,
+        help='Only render the structures with the N highest pocket scores (None).',
+    )
+    prs.add_argument(
+        '-dpi',
+        '--dpi',
+        type=int,
+        required=False,
+        default=None,
+        help='Overrides the figure resolution in dpi (from each spec).',
+    )
+    prs.add_argument(
+        '-f',
+        '--force',
+        required=False,
+        action='store_true',
+        help='Renders specs whose 3D figure already exists (False).',
+    )
+    prs.add_argument(
+        '-r',
+        '--report',
+        type=str,
+        required=False,
+        default=None,
+        help='Path to a tab separated render report (None).',
+    )
+
+    prs.add_argument(
+        '--profile',
+        type=str,
+        required=False,
+        default=profiling.DEFAULT_PROFILE,
+        help='Appends the wall time, CPU time and memory use of every '
+        'stage to a JSON lines report (Default: $FPOCKETR_PROFILE or None).',
+    )
+
+    args = prs.parse_args(argv)
+    return args
+
+
+def main(
+    paths : list[str],
+    jobs : int = 1,
+    top : int = None,
+    dpi : int = None,
+    force : bool = False,
+    report : str = None,
+    profile : str = None,
+):
+    """Renders figures from render specs written by `--render deferred`."""
+    if profile:
+        profiling.enable(profile)
+    specs = select_render_specs(find_render_specs(paths), top)
+    if not force:
+        specs = [spec for spec in specs if not is_rendered(spec, dpi)]
+
+    print(f'Rendering {len(specs)} render specs using {jobs} jobs.\n')
+    report_df = render_specs(specs, jobs, dpi)
+    if report:
+        report_df.to_csv(report, sep='\t', index=False)
+
+    success = (report_df['Status'] == 'Success').sum()
+    print(f'\n{success}/{len(report_df)} render specs finished successfully.')
+
+    return report_df
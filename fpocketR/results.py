@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for storing multistate pocket characteristics and color maps
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# Pocket characteristics columns and their SQLite types.
+POCKET_COLUMNS = {
+    'Parameters': 'TEXT',
+    'Name': 'TEXT',
+    'PDB': 'TEXT',
+    'State': 'INTEGER',
+    'Type': 'TEXT',
+    'Filter': 'TEXT',
+    'Pocket': 'INTEGER',
+    'Score': 'REAL',
+    'Drug_score': 'REAL',
+    'a-sphere': 'INTEGER',
+    'SASA': 'REAL',
+    'Volume': 'REAL',
+    'Hydrophobic_density': 'REAL',
+    'Apolar_a-sphere_proportion': 'REAL',
+    'Hydrophobicity_score': 'REAL',
+    'Polarity_score': 'REAL',
+    'PocketNT': 'TEXT',
+    'Pocket_NPR1': 'REAL',
+    'Pocket_NPR2': 'REAL',
+    'Pocket_shape': 'TEXT',
+    'Ligand_ID': 'TEXT',
+    'Pocket_overlap': 'REAL',
+    'Ligand_overlap': 'REAL',
+    'Center_criteria': 'REAL',
+    'QED_score': 'REAL',
+    'Ligand_NPR1': 'REAL',
+    'Ligand_NPR2': 'REAL',
+    'Ligand_shape': 'TEXT',
+}
+
+# Per state run manifest columns and their SQLite types.
+STATE_COLUMNS = {
+    'State': 'INTEGER PRIMARY KEY',
+    'Status': 'TEXT',
+    'Parameters': 'TEXT',
+    'Output': 'TEXT',
+    'Checksums': 'TEXT',
+    'Started': 'REAL',
+    'Finished': 'REAL',
+    'Seconds': 'REAL',
+    'Error': 'TEXT',
+}
+
+# Seconds to wait for another process to finish writing.
+TIMEOUT = 600
+
+
+def get_results_path(out : str, name : str) -> str:
+    """Gets the path to the results database of a multistate run.
+
+    Args:
+        out (str): Path to the output parent directory.
+        name (str): Output file name prefix.
+
+    Returns:
+        str: Path to the results database.
+    """
+    return f'{out}/{name}_all_states.sqlite'
+
+
+def connect(results_db : str) -> sqlite3.Connection:
+    """Opens a results database, creating its tables if needed.
+
+    Args:
+        results_db (str): Path to the results database.
+
+    Returns:
+        Connection: SQLite connection (transactions are explicit).
+    """
+    con = sqlite3.connect(results_db, timeout=TIMEOUT, isolation_level=None)
+    columns = ', '.join(
+        f'"{column}" {sql_type}' for column, sql_type in POCKET_COLUMNS.items())
+    con.execute(f'CREATE TABLE IF NOT EXISTS pockets ({columns})')
+    con.execute('CREATE INDEX IF NOT EXISTS pockets_state ON pockets ("State")')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS maps ('
+        '"State" INTEGER PRIMARY KEY, "Pocket_cmap" TEXT, "Pocket_nt_color" TEXT)')
+    columns = ', '.join(
+        f'"{column}" {sql_type}' for column, sql_type in STATE_COLUMNS.items())
+    con.execute(f'CREATE TABLE IF NOT EXISTS states ({columns})')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS centroids ('
+        '"State" INTEGER, "Pocket" INTEGER, "X" REAL, "Y" REAL, "Z" REAL)')
+    con.execute('CREATE INDEX IF NOT EXISTS centroids_state ON centroids ("State")')
+    return con
+
+
+def to_sql_value(value, sql_type : str):
+    """Converts a pocket characteristic to a value SQLite can store.
+
+    Args:
+        value (object): Pocket characteristic.
+        sql_type (str): SQLite column type.
+
+    Returns:
+        object: None, int, float or str.
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return json.dumps([int(nt) for nt in value])
+    if value is None or pd.isna(value):
+        return None
+    if sql_type == 'INTEGER':
+        return int(value)
+    if sql_type == 'REAL':
+        return float(value)
+    return str(value)
+
+
+def get_checksums(output_dir : str) -> dict[str, str]:
+    """Calculates the sha256 hash of every file in an output directory.
+
+    Args:
+        output_dir (str): Path to the output directory.
+
+    Returns:
+        dict[str, str]: sha256 digests keyed by path relative to {output_dir}.
+    """
+    from fpocketR import cache
+    checksums = {}
+    for root, _, files in os.walk(output_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            checksums[os.path.relpath(path, output_dir)] = cache.hash_file(path)
+    return dict(sorted(checksums.items()))
+
+
+def verify_checksums(output_dir : str, checksums : dict[str, str]) -> bool:
+    """Checks that the files recorded for a finished state are unchanged.
+    Files added later (e.g. by `fpocketR render`) are ignored.
+
+    Args:
+        output_dir (str): Path to the output directory.
+        checksums (dict[str, str]): sha256 digests keyed by relative path.
+
+    Returns:
+        bool: True if every recorded file exists and is unchanged.
+    """
+    from fpocketR import cache
+    for file, checksum in checksums.items():
+        path = os.path.join(output_dir, file)
+        if not os.path.isfile(path) or cache.hash_file(path) != checksum:
+            return False
+    return True
+
+
+def write_state_status(
+    results_db : str,
+    state : int,
+    status : str,
+    parameters : str = None,
+    started : float = None,
+    error : str = None,
+) -> None:
+    """Records that a state is running or has failed in the run manifest.
+
+    Args:
+        results_db (str): Path to the results database.
+        state (int): Structural state.
+        status (str): 'running' or 'failed'.
+        parameters (str): Hash of the run parameters.
+        started (float): Start time (seconds since the epoch).
+        error (str): Failure reason.
+    """
+    finished = time.time() if status == 'failed' else None
+    con = connect(results_db)
+    try:
+        con.execute(
+            'INSERT OR REPLACE INTO states '
+            '("State", "Status", "Parameters", "Started", "Finished", "Seconds", "Error") '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (int(state), status, parameters, started, finished,
+             finished - started if finished and started else None, error),
+        )
+    finally:
+        con.close()
+
+
+@contextmanager
+def track_state(results_db : str, state : int, parameters : str = None):
+    """Marks a state as running in the run manifest and as failed (with the
+    error) if the block raises. Does nothing if {results_db} is None.
+
+    Args:
+        results_db (str): Path to the results database.
+        state (int): Structural state.
+        parameters (str): Hash of the run parameters.
+
+    Yields:
+        float: Start time (seconds since the epoch).
+    """
+    started = time.time()
+    if not results_db:
+        yield started
+        return
+
+    write_state_status(results_db, state, 'running', parameters, started)
+    try:
+        yield started
+    except BaseException as e:
+        write_state_status(results_db, state, 'failed', parameters, started,
+                           f'{type(e).__name__}: {e}')
+        raise
+
+
+def append_state(
+    results_db : str,
+    state : int,
+    pc_df : pd.DataFrame,
+    pocket_cmap : dict[int, tuple],
+    pocket_nt_color : list[dict],
+    parameters : str = None,
+    output_dir : str = None,
+    started : float = None,
+    centroids : dict[int, list[float]] = None,
+) -> None:
+    """Adds the pocket characteristics, color maps and pocket centroids of
+    one state to the results database and marks the state as done in the
+    run manifest, in a single transaction. Earlier results for the state
+    are replaced. Safe to call from parallel workers.
+
+    Args:
+        results_db (str): Path to the results database.
+        state (int): Structural state.
+        pc_df (DataFrame): Pocket characteristics of the state.
+        pocket_cmap (dict): Per pocket color map.
+        pocket_nt_color (list[dict]): Per pocket nucleotides and color.
+        parameters (str): Hash of the run parameters.
+        output_dir (str): Path to the finished output directory of the state.
+        started (float): Start time (seconds since the epoch).
+        centroids (dict[int, list[float]]): x, y, z centroid of each pocket.
+    """
+    rows = [
+        tuple(to_sql_value(row.get(column), sql_type)
+              for column, sql_type in POCKET_COLUMNS.items())
+        for row in pc_df.to_dict('records')
+    ]
+    columns = ', '.join(f'"{column}"' for column in POCKET_COLUMNS)
+    placeholders = ', '.join('?' * len(POCKET_COLUMNS))
+
+    con = connect(results_db)
+    try:
+        con.execute('BEGIN IMMEDIATE')
+        con.execute('DELETE FROM pockets WHERE "State" = ?', (int(state),))
+        con.executemany(
+            f'INSERT INTO pockets ({columns}) VALUES ({placeholders})', rows)
+        con.execute('DELETE FROM centroids WHERE "State" = ?', (int(state),))
+        con.executemany(
+            'INSERT INTO centroids VALUES (?, ?, ?, ?, ?)',
+            [(int(state), int(pocket), *map(float, centroid))
+             for pocket, centroid in (centroids or {}).items()])
+        con.execute(
+            'INSERT OR REPLACE INTO maps VALUES (?, ?, ?)',
+            (int(state),
+             json.dumps({int(pocket): list(color)
+                         for pocket, color in (pocket_cmap or {}).items()}),
+             json.dumps(pocket_nt_color or [])),
+        )
+        finished = time.time()
+        con.execute(
+            'INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (int(state), 'done', parameters,
+             os.path.relpath(output_dir, os.path.dirname(os.path.abspath(results_db)))
+             if output_dir else None,
+             json.dumps(get_checksums(output_dir)) if output_dir else None,
+             started, finished, finished - started if started else None, None),
+        )
+        con.execute('COMMIT')
+    except Exception:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+
+def get_state_filter(states : list[int] = None) -> tuple[str, list[int]]:
+    """Builds a WHERE clause that selects structural states.
+
+    Args:
+        states (list[int]): States to select (None selects all states).
+
+    Returns:
+        str: WHERE clause (empty if all states are selected).
+        list[int]: Query parameters.
+    """
+    if states is None:
+        return '', []
+    states = [int(state) for state in states]
+    return f'WHERE "State" IN ({", ".join("?" * len(states))})', states
+
+
+def read_pockets(results_db : str, states : list[int] = None) -> pd.DataFrame:
+    """Reads pocket characteristics from the results database, ordered by
+    state and pocket rank.
+
+    Args:
+        results_db (str): Path to the results database.
+        states (list[int]): States to read (default: all states).
+
+    Returns:
+        DataFrame: Pocket characteristics (PocketNT as lists of residue IDs).
+    """
+    where, params = get_state_filter(states)
+    columns = ', '.join(f'"{column}"' for column in POCKET_COLUMNS)
+    con = connect(results_db)
+    try:
+        pc_df = pd.read_sql_query(
+            f'SELECT {columns} FROM pockets {where} ORDER BY "State", rowid',
+            con, params=params)
+    finally:
+        con.close()
+
+    pc_df['PocketNT'] = [
+        json.loads(nts) if nts is not None else None for nts in pc_df['PocketNT']]
+    return pc_df
+
+
+def read_maps(
+    results_db : str, states : list[int] = None
+    ) -> tuple[dict[int, dict], dict[int, list]]:
+    """Reads per state pocket color maps from the results database.
+
+    Args:
+        results_db (str): Path to the results database.
+        states (list[int]): States to read (default: all states).
+
+    Returns:
+        dict[int, dict]: Per state, per pocket color map.
+        dict[int, list]: Per state, per pocket nucleotides and color.
+    """
+    where, params = get_state_filter(states)
+    con = connect(results_db)
+    try:
+        rows = con.execute(
+            f'SELECT "State", "Pocket_cmap", "Pocket_nt_color" FROM maps {where} '
+            'ORDER BY "State"', params).fetchall()
+    finally:
+        con.close()
+
+    multistate_pocket_cmap = {
+        state: {int(pocket): color for pocket, color in json.loads(cmap).items()}
+        for state, cmap, _ in rows
+    }
+    multistate_pocket_nt_color = {
+        state: json.loads(nt_color) for state, _, nt_color in rows
+    }
+    return multistate_pocket_cmap, multistate_pocket_nt_color
+
+
+def read_centroids(results_db : str, states : list[int] = None) -> pd.DataFrame:
+    """Reads pocket centroids from the results database.
+
+    Args:
+        results_db (str): Path to the results database.
+        states (list[int]): States to read (default: all states).
+
+    Returns:
+        DataFrame: State, Pocket and x, y, z centroid (X, Y, Z) of each pocket.
+    """
+    where, params = get_state_filter(states)
+    con = connect(results_db)
+    try:
+        return pd.read_sql_query(
+            f'SELECT "State", "Pocket", "X", "Y", "Z" FROM centroids {where} '
+            'ORDER BY "State", "Pocket"', con, params=params)
+    finally:
+        con.close()
+
+
+def read_states(results_db : str) -> pd.DataFrame:
+    """Reads the run manifest (status, parameters, output checksums and
+    timings of every state).
+
+    Args:
+        results_db (str): Path to the results database.
+
+    Returns:
+        DataFrame: Run manifest ordered by state.
+    """
+    con = connect(results_db)
+    try:
+        return pd.read_sql_query('SELECT * FROM states ORDER BY "State"', con)
+    finally:
+        con.close()
+
+
+def get_pending_states(
+    results_db : str, states : list[int], parameters : str = None
+    ) -> list[int]:
+    """Gets the states that still need to be analyzed: states that never
+    finished (missing, running when interrupted, or failed), states that
+    finished with different parameters, and states whose output files are
+    missing or changed.
+
+    Args:
+        results_db (str): Path to the results database.
+        states (list[int]): All structural states of the run.
+        parameters (str): Hash of the run parameters.
+
+    Returns:
+        list[int]: States to analyze.
+    """
+    if not os.path.isfile(results_db):
+        return list(states)
+
+    manifest = read_states(results_db).set_index('State')
+    parent = os.path.dirname(os.path.abspath(results_db))
+    pending = []
+    for state in states:
+        if state not in manifest.index:
+            pending.append(state)
+            continue
+        record = manifest.loc[state]
+        if record['Status'] != 'done' or record['Parameters'] != parameters:
+            pending.append(state)
+            continue
+        if record['Output'] is not None and not verify_checksums(
+                os.path.join(parent, record['Output']),
+                json.loads(record['Checksums'])):
+            pending.append(state)
+
+    return pending
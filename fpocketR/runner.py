@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for running fpocket subprocesses
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Seconds after which an fpocket run is killed (None: no limit). Shared with
+# worker processes through the environment.
+TIMEOUT_ENV = 'FPOCKETR_FPOCKET_TIMEOUT'
+DEFAULT_TIMEOUT = float(os.environ[TIMEOUT_ENV]) if os.environ.get(TIMEOUT_ENV) else None
+
+# Number of times an fpocket run that failed for a transient reason (killed
+# by a signal or unable to start) is retried.
+RETRIES_ENV = 'FPOCKETR_FPOCKET_RETRIES'
+DEFAULT_RETRIES = int(os.environ.get(RETRIES_ENV, 2))
+
+# Maximum number of fpocket processes run at once by this process.
+DEFAULT_SLOTS = int(os.environ.get('FPOCKETR_FPOCKET_SLOTS', os.cpu_count() or 1))
+SLOTS = threading.BoundedSemaphore(DEFAULT_SLOTS)
+
+# errno values of process creation failures that may succeed later.
+TRANSIENT_ERRNOS = (errno.EAGAIN, errno.ENOMEM)
+
+# Lines of the fpocket log shown when a run fails.
+LOG_TAIL = 20
+
+
+def configure(timeout : float = None, retries : int = None) -> None:
+    """Sets the fpocket timeout and retries of this process and of worker
+    processes started afterwards.
+
+    Args:
+        timeout (float): Seconds after which an fpocket run is killed
+                         (None or 0: no limit).
+        retries (int): Retries of transient fpocket failures (None: unchanged).
+    """
+    if timeout:
+        os.environ[TIMEOUT_ENV] = str(timeout)
+    else:
+        os.environ.pop(TIMEOUT_ENV, None)
+    if retries is not None:
+        os.environ[RETRIES_ENV] = str(retries)
+
+
+def get_timeout() -> float:
+    """Gets the fpocket timeout in seconds (None: no limit)."""
+    timeout = os.environ.get(TIMEOUT_ENV)
+    return float(timeout) if timeout else None
+
+
+def get_retries() -> int:
+    """Gets the number of retries of transient fpocket failures."""
+    return int(os.environ.get(RETRIES_ENV, DEFAULT_RETRIES))
+
+
+@lru_cache(maxsize=None)
+def get_fpocket_path() -> str:
+    """Finds and validates the fpocket executable in the current
+    conda/mamba/micromamba environment or on the PATH. The executable is
+    resolved once per process.
+
+    Returns:
+        str: Path to the fpocket executable.
+    """
+    env_prefix = os.environ.get('CONDA_PREFIX', os.environ.get('MAMBA_ROOT_PREFIX', sys.prefix))
+    fpocket_env_path = os.path.join(env_prefix, 'bin', 'fpocket')
+    if os.path.isfile(fpocket_env_path) and os.access(fpocket_env_path, os.X_OK):
+        fpocket_path = fpocket_env_path
+    else:
+        fpocket_path = shutil.which('fpocket')
+    if not fpocket_path:
+        raise FileNotFoundError('fpocket executable not found in current environment or PATH. Ensure fpocket is installed and available.')
+    if not os.access(fpocket_path, os.X_OK):
+        raise PermissionError(f'fpocket executable is not executable: {fpocket_path}.')
+    return fpocket_path
+
+
+def get_command(
+    pdb : str,
+    chain : str,
+    state : int,
+    m : float,
+    M : float,
+    i : int,
+    D : float,
+    A : int,
+    p : float,
+) -> list[str]:
+    """Builds the fpocket command for a cleaned .pdb file.
+
+    Args:
+        pdb (str): Path to the cleaned .pdb file.
+        chain (str): Chain identifier for desired RNA chain.
+        state (int): Structural state to analyze.
+        m (float): Min. a-sphere radius in angstroms.
+        M (float): Max. a-sphere radius in angstroms.
+        i (int): Min. number of a-spheres per pocket.
+        D (float): a-sphere clustering distance in angstroms.
+        A (int): # of electroneg. atoms to define a polar a-sphere.
+        p (float): Max. ratio of apolar a-spheres in a pocket.
+
+    Returns:
+        list[str]: fpocket command.
+    """
+    return [get_fpocket_path(), '-f', pdb, '-k', chain, '-l', str(state),
+            '-m', str(m), '-M', str(M), '-i', str(i), '-D', str(D),
+            '-A', str(A), '-p', str(p), '-w', 'p']
+
+
+def read_tail(log : str, lines : int = LOG_TAIL) -> str:
+    """Reads the last lines of an fpocket log."""
+    try:
+        with open(log, 'rt', errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+    except OSError:
+        return ''
+
+
+def run_command(
+    cmd : list[str],
+    log : str,
+    timeout : float = None,
+    retries : int = None,
+) -> None:
+    """Runs an fpocket command while streaming its stdout and stderr to a log
+    file. At most DEFAULT_SLOTS commands run at once per process. Runs that
+    are killed by a signal (e.g. by the out-of-memory killer) or that cannot
+    be started for lack of resources are retried with a growing delay.
+
+    Args:
+        cmd (list[str]): fpocket command.
+        log (str): Path to the log file (replaced).
+        timeout (float): Seconds after which fpocket is killed
+                         (Default: get_timeout()).
+        retries (int): Retries of transient failures (Default: get_retries()).
+
+    Raises:
+        subprocess.TimeoutExpired: fpocket ran longer than {timeout}.
+        subprocess.CalledProcessError: fpocket exited with an error.
+        OSError: the fpocketR environment does not exist.
+    """
+    if timeout is None:
+        timeout = get_timeout()
+    if retries is None:
+        retries = get_retries()
+
+    for attempt in range(retries + 1):
+        with SLOTS, open(log, 'wb') as f:
+            try:
+                process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT)
+            except OSError as e:
+                if e.errno not in TRANSIENT_ERRNOS or attempt == retries:
+                    raise
+                process = None
+                print(f'Unable to start fpocket ({e.strerror}). Retrying.')
+            if process:
+                try:
+                    returncode = process.wait(timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                    print(f'fpocket did not finish within {timeout:g} s. See {log}.')
+                    raise subprocess.TimeoutExpired(cmd, timeout, output=read_tail(log))
+
+        if process:
+            if returncode == 0:
+                return
+            tail = read_tail(log)
+            if 'EnvironmentLocationNotFound' in tail:
+                raise OSError('Unable to run fpocket because the fpocketR environment does not exist.\nInstall the fpocketR environment.')
+            if returncode > 0 or attempt == retries:
+                print(f'fpocket exited with code {returncode}. See {log}:\n{tail}')
+                raise subprocess.CalledProcessError(returncode, cmd, output=tail)
+            print(f'fpocket was killed by signal {-returncode}. Retrying.')
+
+        # Waits longer after every transient failure.
+        time.sleep(2 ** attempt)
+
+
+def run_fpocket(
+    pdb : str,
+    chain : str,
+    state : int,
+    m : float,
+    M : float,
+    i : int,
+    D : float,
+    A : int,
+    p : float,
+    timeout : float = None,
+    retries : int = None,
+) -> str:
+    """Runs fpocket on a cleaned .pdb file. fpocket writes its outputs next to
+    its input ({pdb} stem + _out), and its log is kept with the outputs as
+    {pdb stem}_fpocket.log.
+
+    Args:
+        pdb (str): Path to the cleaned .pdb file.
+        chain (str): Chain identifier for desired RNA chain.
+        state (int): Structural state to analyze.
+        m (float): Min. a-sphere radius in angstroms.
+        M (float): Max. a-sphere radius in angstroms.
+        i (int): Min. number of a-spheres per pocket.
+        D (float): a-sphere clustering distance in angstroms.
+        A (int): # of electroneg. atoms to define a polar a-sphere.
+        p (float): Max. ratio of apolar a-spheres in a pocket.
+        timeout (float): Seconds after which fpocket is killed
+                         (Default: get_timeout()).
+        retries (int): Retries of transient failures (Default: get_retries()).
+
+    Returns:
+        str: Path to the fpocket output directory.
+    """
+    stem = os.path.splitext(pdb)[0]
+    log = f'{stem}_fpocket.log'
+    run_command(
+        get_command(pdb, chain, state, m, M, i, D, A, p), log, timeout, retries)
+
+    source_dir = f'{stem}_out'
+    if os.path.isdir(source_dir):
+        os.replace(log, os.path.join(source_dir, os.path.basename(log)))
+    return source_dir
+
+
+def run_many(function, tasks : list[dict], jobs : int) -> list:
+    """Runs a function that runs fpocket (e.g. run_fpocket) for many tasks
+    in {jobs} threads. fpocket is single threaded, so each thread keeps one
+    fpocket process busy while Python waits.
+
+    Args:
+        function (callable): Function that runs fpocket.
+        tasks (list[dict]): Keyword arguments of every task.
+        jobs (int): Number of concurrent tasks.
+
+    Returns:
+        list: Results of the tasks, in order.
+    """
+    if jobs <= 1:
+        return [function(**task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(function, **task) for task in tasks]
+        return [future.result() for future in futures]
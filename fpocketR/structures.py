@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for sharing one parsed input structure across the pipeline
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import gzip
+import os
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+import numpy as np
+from prody import AtomGroup, HierView, parseMMCIFStream, parsePDBStream
+from prody.atomic import Atomic
+from prody.atomic.flags import DEFINITIONS
+
+# Structure file formats (each may be gzip-compressed, e.g. .cif.gz).
+PDB_FORMATS = ('.pdb', '.ent')
+CIF_FORMATS = ('.cif', '.mmcif')
+
+# Number of parsed structures kept per process (e.g. the input and the
+# cleaned copy of a multistate run).
+CONTEXT_CACHE_SIZE = 4
+
+# Bytes read at a time when counting the models of a .pdb file.
+CHUNK_SIZE = 1 << 24
+
+
+@dataclass(eq=False)
+class StructureContext:
+    """Structure shared by the stages of a run. The .pdb header and the
+    first model's chains are read without parsing the structure (chain and
+    state discovery), and the structure is parsed once, on first use.
+
+    Attributes:
+        path (str): Path to the .pdb/.cif file, optionally gzip-compressed
+                    (None for an in-memory structure).
+    """
+    path : str = None
+
+    def __str__(self) -> str:
+        return self.path or self.structure.getTitle()
+
+    @cached_property
+    def structure(self) -> AtomGroup:
+        """ProDy structure (all states)."""
+        return parse_structure(self.path)
+
+    @cached_property
+    def hierview(self) -> HierView:
+        """Hierarchical view (chains and residues) of the active state."""
+        return self.structure.getHierView()
+
+    @cached_property
+    def header(self) -> dict:
+        """Number of states and, for every chain of the first state (in file
+        order), its residue names and first residue number."""
+        if self.path and split_path(self.path)[1] in PDB_FORMATS:
+            try:
+                return read_header(self.path)
+            except ValueError:
+                # Residue fields the text scan cannot read (e.g. blank) are
+                # left to ProDy.
+                pass
+        return get_header(self.hierview, self.structure.numCoordsets())
+
+    @property
+    def num_states(self) -> int:
+        """Number of structural states (models)."""
+        return self.header['states']
+
+    @property
+    def chains(self) -> list[str]:
+        """Chain identifiers in file order."""
+        return list(self.header['chains'])
+
+    def has_residues(self, chain : str, flag : str = 'nucleic') -> bool:
+        """Checks if a chain has residues of a ProDy residue name flag
+        (e.g. 'nucleic' or 'nucleotide')."""
+        chain = self.header['chains'].get(chain)
+        return bool(chain and chain['resnames'] & DEFINITIONS[flag])
+
+    def release(self) -> None:
+        """Drops the parsed structure (it is parsed again when used); the
+        header is kept. In-memory structures are kept."""
+        if not self.path:
+            return
+        self.__dict__.pop('structure', None)
+        self.__dict__.pop('hierview', None)
+
+    def get_offset(self, chain : str) -> int:
+        """Gets the offset between the nucleotide index (start at 1) and the
+        residue number of the first residue of a chain (None if missing)."""
+        chain = self.header['chains'].get(chain)
+        return chain['first'] - 1 if chain else None
+
+
+def split_path(path : str) -> tuple[str, str, bool]:
+    """Splits the file name of a structure into its name, format and
+    compression, e.g. 'data/6zj3.v2.cif.gz' -> ('6zj3.v2', '.cif', True).
+
+    Args:
+        path (str): Path to a structure file.
+
+    Returns:
+        str: Structure name (file name without format and compression).
+        str: Format extension in lower case (e.g. '.pdb' or '.cif').
+        bool: The file is gzip-compressed.
+    """
+    name, extension = os.path.splitext(os.path.basename(path))
+    compressed = extension.lower() == '.gz'
+    if compressed:
+        name, extension = os.path.splitext(name)
+    return name, extension.lower(), compressed
+
+
+def get_name(path : str) -> str:
+    """Gets the name of a structure file (see split_path)."""
+    return split_path(path)[0]
+
+
+def is_structure_path(path : str) -> bool:
+    """Checks if a path names a PDB or mmCIF file (optionally compressed)."""
+    return split_path(path)[1] in PDB_FORMATS + CIF_FORMATS
+
+
+def open_text(path : str):
+    """Opens a structure file for reading text, decompressing gzip files
+    while they are read."""
+    if split_path(path)[2]:
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def parse_structure(path : str, **kwargs) -> AtomGroup:
+    """Parses a PDB or mmCIF file, gzip-compressed or not, in one streamed
+    pass (nothing is decompressed to disk).
+
+    Args:
+        path (str): Path to a .pdb/.ent/.cif/.mmcif file (optionally .gz).
+        **kwargs: Options of prody.parsePDBStream / parseMMCIFStream
+                  (e.g. altloc).
+
+    Returns:
+        object: ProDy structure titled with the structure name.
+    """
+    name, extension, _ = split_path(path)
+    if extension == '.bcif':
+        raise ValueError(
+            f'Unsupported structure format: {path}. BinaryCIF cannot be read; '
+            'use the .cif or .cif.gz file of the entry.')
+    with open_text(path) as stream:
+        if extension in CIF_FORMATS:
+            return parseMMCIFStream(stream, title=name, **kwargs)
+        return parsePDBStream(stream, title=name, **kwargs)
+
+
+def read_resnum(field : bytes) -> int:
+    """Reads a 4-column residue number of a .pdb file, including hybrid-36
+    numbers of large structures (e.g. A000 is 10000, as read by ProDy).
+
+    Args:
+        field (bytes): Residue number columns (23-26) of an atom record.
+
+    Returns:
+        int: Residue number (raises ValueError if the field is not a number).
+    """
+    field = field.strip()
+    if field[:1].isalpha():
+        # Upper case (A000-ZZZZ) follows 9999 and lower case (a000-zzzz)
+        # follows ZZZZ.
+        offset = 10000 - 10 * 36 ** 3 + (26 * 36 ** 3 if field[:1].islower() else 0)
+        return int(field, 36) + offset
+    return int(field)
+
+
+def write_resnum(resnum : int) -> str:
+    """Formats a residue number for the 4 residue number columns of a .pdb
+    file, using hybrid-36 above 9999 (e.g. 10000 is A000, see read_resnum).
+
+    Args:
+        resnum (int): Residue number (-999 to 2436111).
+
+    Returns:
+        str: 4-character residue number.
+    """
+    if -999 <= resnum <= 9999:
+        return f'{resnum:4d}'
+    if 10000 <= resnum < 10000 + 52 * 36 ** 3:
+        value = resnum - 10000 + 10 * 36 ** 3
+        if value >= 36 ** 4:
+            return np.base_repr(value - 26 * 36 ** 3, 36).lower()
+        return np.base_repr(value, 36)
+    raise ValueError(
+        f'Residue number {resnum} cannot be written to a .pdb file '
+        '(-999 to 2436111). Renumber the residues.')
+
+
+def read_header(pdb : str) -> dict:
+    """Reads the chains of the first model of a .pdb file and counts its
+    models without building a structure. Only the first model is split into
+    fields; the remaining models are counted in large chunks.
+
+    Args:
+        pdb (str): Path to a .pdb file (optionally gzip-compressed).
+
+    Returns:
+        dict: 'states' (number of models) and 'chains' (chain identifier:
+              {'resnames': set of residue names, 'first': first residue
+              number}). Raises ValueError if a residue number cannot be
+              read.
+    """
+    chains = {}
+    models = 0
+    with (gzip.open(pdb, 'rb') if split_path(pdb)[2] else open(pdb, 'rb')) as f:
+        for line in f:
+            record = line[:6]
+            if record == b'ATOM  ' or record == b'HETATM':
+                chid = line[21:22].decode().strip()
+                resnum = read_resnum(line[22:26])
+                chain = chains.setdefault(chid, {'resnames': set(), 'first': resnum})
+                chain['resnames'].add(line[17:21].decode().strip())
+                chain['first'] = min(chain['first'], resnum)
+            elif record.startswith(b'MODEL'):
+                models += 1
+                if models > 1:
+                    break
+
+        # Counts the MODEL records of the remaining models.
+        if models > 1:
+            previous = b'\n'
+            while chunk := f.read(CHUNK_SIZE):
+                models += (previous[-5:] + chunk).count(b'\nMODEL')
+                previous = chunk
+
+    return {'states': max(models, 1), 'chains': chains}
+
+
+def get_header(hierview : HierView, states : int) -> dict:
+    """Gets the header (see read_header) of a parsed structure.
+
+    Args:
+        hierview (object): Hierarchical view of the structure.
+        states (int): Number of states of the structure.
+
+    Returns:
+        dict: 'states' and 'chains' of the structure.
+    """
+    chains = {}
+    for chain in hierview:
+        resnums = chain.getResnums()
+        header = chains.setdefault(
+            chain.getChid(), {'resnames': set(), 'first': int(resnums.min())})
+        header['resnames'].update(chain.getResnames())
+        header['first'] = min(header['first'], int(resnums.min()))
+    return {'states': states, 'chains': chains}
+
+
+@lru_cache(maxsize=CONTEXT_CACHE_SIZE)
+def load_context(path : str, mtime : int, size : int) -> StructureContext:
+    """Creates the context of a file version once per process."""
+    return StructureContext(path)
+
+
+def get_context(pdb) -> StructureContext:
+    """Gets the shared context of a structure. Contexts of files are reused
+    until the file changes, so every stage (and state) of a run uses the
+    same parsed structure.
+
+    Args:
+        pdb (str): Path to a .pdb/.cif file, a ProDy structure (or
+                   selection) or a context.
+
+    Returns:
+        StructureContext: Context of the structure.
+    """
+    if isinstance(pdb, StructureContext):
+        return pdb
+    if isinstance(pdb, Atomic):
+        context = StructureContext()
+        context.structure = pdb
+        return context
+    stat = os.stat(pdb)
+    return load_context(os.path.abspath(pdb), stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for calculating pocket volumes and shapes from a-spheres
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import numpy as np
+from fpocketR import util, profiling
+
+# Difference between fpocket a-sphere radii and the a-sphere core radii
+# (vdw = b - 1.65) that make up the pocket surface.
+ASPHERE_CORE_OFFSET = 1.65
+
+
+def get_sphere_union_grid(
+    centers : np.ndarray, radii : np.ndarray, spacing : float = 0.5
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Voxelizes the union of a set of spheres.
+
+    Args:
+        centers (np.ndarray): n x 3 sphere centers.
+        radii (np.ndarray): n sphere radii.
+        spacing (float): Grid spacing in angstroms (default=0.5).
+
+    Returns:
+        np.ndarray: 3D boolean grid, True for voxels inside any sphere.
+        np.ndarray: Coordinates of the first voxel (grid origin).
+    """
+    pad = 2 * spacing
+    origin = (centers - radii[:, None]).min(axis=0) - pad
+    top = (centers + radii[:, None]).max(axis=0) + pad
+    shape = np.ceil((top - origin) / spacing).astype(int) + 1
+    axes = [origin[dim] + spacing * np.arange(shape[dim]) for dim in range(3)]
+
+    # Stamps each sphere into the sub-grid of its bounding box.
+    grid = np.zeros(shape, dtype=bool)
+    first = np.maximum(
+        np.floor((centers - radii[:, None] - origin) / spacing).astype(int), 0)
+    last = np.minimum(
+        np.ceil((centers + radii[:, None] - origin) / spacing).astype(int) + 1,
+        shape)
+    for center, radius, lo, hi in zip(centers, radii, first, last):
+        dx = axes[0][lo[0]:hi[0]] - center[0]
+        dy = axes[1][lo[1]:hi[1]] - center[1]
+        dz = axes[2][lo[2]:hi[2]] - center[2]
+        dist2 = (dx[:, None, None] ** 2 + dy[None, :, None] ** 2
+                 + dz[None, None, :] ** 2)
+        grid[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] |= dist2 <= radius ** 2
+
+    return grid, origin
+
+
+def calc_pocket_inertia_tensors(
+    centers : np.ndarray,
+    radii : np.ndarray,
+    pocket_ids : np.ndarray,
+    spacing : float = 0.5,
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Calculates the volumetric inertia tensor of every pocket from the
+    union of its a-sphere cores (uniform density), without building and
+    reloading a surface mesh.
+
+    Args:
+        centers (np.ndarray): n x 3 a-sphere centers.
+        radii (np.ndarray): n a-sphere core radii.
+        pocket_ids (np.ndarray): n pocket numbers (STP residue numbers).
+        spacing (float): Grid spacing in angstroms (default=0.5).
+
+    Returns:
+        np.ndarray: Sorted unique pocket numbers.
+        np.ndarray: number of pockets x 3 x 3 inertia tensors.
+    """
+    pockets = np.unique(pocket_ids)
+    inertia_tensors = np.full((len(pockets), 3, 3), np.nan)
+    voxel_volume = spacing ** 3
+
+    for idx, pocket in enumerate(pockets):
+        sele = (pocket_ids == pocket) & (radii > 0)
+        if not sele.any():
+            continue
+        grid, origin = get_sphere_union_grid(
+            centers[sele], radii[sele], spacing)
+        voxels = origin + spacing * np.argwhere(grid)
+        inertia_tensors[idx] = util.calc_inertia_tensors(
+            voxels,
+            np.full(len(voxels), voxel_volume),
+            np.zeros(len(voxels), dtype=int),
+        )[0]
+
+    return pockets, inertia_tensors
+
+
+@profiling.profiled('surfaces')
+def calc_pocket_npr(
+    centers : np.ndarray,
+    radii : np.ndarray,
+    pocket_ids : np.ndarray,
+    spacing : float = 0.5,
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Calculates normalized PMI ratios for every pocket.
+
+    Args:
+        centers (np.ndarray): n x 3 a-sphere centers.
+        radii (np.ndarray): n fpocket a-sphere radii (from the _pockets.pqr).
+        pocket_ids (np.ndarray): n pocket numbers (STP residue numbers).
+        spacing (float): Grid spacing in angstroms (default=0.5).
+
+    Returns:
+        np.ndarray: Sorted unique pocket numbers.
+        np.ndarray: number of pockets x 2 array of (NPR1, NPR2).
+    """
+    pockets, inertia_tensors = calc_pocket_inertia_tensors(
+        centers, radii - ASPHERE_CORE_OFFSET, pocket_ids, spacing)
+
+    npr = np.full((len(pockets), 2), np.nan)
+    valid = ~np.isnan(inertia_tensors).any(axis=(1, 2))
+    npr[valid] = util.calc_npr_from_tensors(inertia_tensors[valid])
+
+    return pockets, npr
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for sweeping fpocket parameters over a grid
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import itertools
+import os
+import tempfile
+from concurrent.futures import as_completed
+import numpy as np
+import pandas as pd
+from fpocketR import (
+    analyze, cache, ligands, outputs, parallel, pocket, profiling, runner,
+    structures, util, workspace)
+
+# fpocket parameters that can be swept and their types.
+PARAMETERS = {'m': float, 'M': float, 'i': int, 'D': float, 'A': int, 'p': float}
+
+
+def parse_values(parameter : str, values : str) -> list:
+    """Parses the values of one swept parameter. Values are a comma separated
+    list (e.g. 3.0,3.4) and/or inclusive ranges (start:stop:step, e.g.
+    2.8:3.6:0.2).
+
+    Args:
+        parameter (str): fpocket parameter (see PARAMETERS).
+        values (str): Values of the parameter.
+
+    Returns:
+        list: Sorted unique values.
+    """
+    cast = PARAMETERS[parameter]
+    parsed = []
+    for value in values.split(','):
+        if ':' in value:
+            start, stop, step = (float(x) for x in value.split(':'))
+            if step <= 0:
+                raise ValueError(f'The step of {parameter}={value} must be positive.')
+            count = int(np.floor((stop - start) / step + 1e-9)) + 1
+            parsed.extend(round(start + n * step, 6) for n in range(count))
+        else:
+            parsed.append(float(value))
+    return sorted({cast(value) for value in parsed})
+
+
+def parse_grid(specs : list[str]) -> dict[str, list]:
+    """Parses a parameter grid specification.
+
+    Args:
+        specs (list[str]): Parameter values, e.g. ['m=3.0,3.4', 'i=15:45:10'].
+
+    Returns:
+        dict[str, list]: Values of every swept parameter.
+    """
+    grid = {}
+    for spec in specs:
+        for item in spec.replace(';', ' ').split():
+            parameter, _, values = item.partition('=')
+            if parameter not in PARAMETERS or not values:
+                raise ValueError(
+                    f'Invalid sweep specification: {item}. Use <parameter>=<values> '
+                    f'with a parameter from {", ".join(PARAMETERS)}, '
+                    'e.g. m=3.0,3.4 or i=15:45:10.')
+            grid[parameter] = parse_values(parameter, values)
+    return grid
+
+
+def get_combinations(grid : dict[str, list], defaults : dict) -> list[dict]:
+    """Gets every combination of fpocket parameters in a grid. Parameters that
+    are not swept keep their default (command line) values.
+
+    Args:
+        grid (dict[str, list]): Values of every swept parameter.
+        defaults (dict): Values of all fpocket parameters.
+
+    Returns:
+        list[dict]: fpocket parameters of every combination.
+    """
+    swept = list(grid)
+    return [
+        {**defaults, **dict(zip(swept, values))}
+        for values in itertools.product(*(grid[parameter] for parameter in swept))
+    ]
+
+
+def find_combination_pockets(
+    pdb_clean : str,
+    name : str,
+    chain : str,
+    state : int,
+    parameters : dict,
+    cachedir : str = None,
+    refresh : bool = False,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+) -> str:
+    """Runs fpocket with one combination of parameters on an already cleaned
+    structure (or copies the outputs of an identical earlier run from the
+    cache). fpocket writes its outputs next to its input, so each
+    combination links the shared clean file into its own directory next to
+    {pdb_clean}.
+
+    Args:
+        pdb_clean (str): Path to the cleaned (RNA only) .pdb file.
+        name (str): Output file name prefix.
+        chain (str): Chain identifier(s) for RNA.
+        state (int): Structural state to analyze.
+        parameters (dict): fpocket parameters (m, M, i, D, A, p).
+        cachedir (str): Path to the cache directory (None disables caching).
+        refresh (bool): Reruns fpocket and replaces cached outputs.
+        cachesize (float): Maximum cache size in MB.
+
+    Returns:
+        str: Path to the fpocket output directory.
+    """
+    m, M, i, D, A, p = (parameters[parameter] for parameter in PARAMETERS)
+    workdir = tempfile.mkdtemp(prefix=f'.{name}_', dir=os.path.dirname(pdb_clean))
+    combination_clean = os.path.join(workdir, f'{name}_clean.pdb')
+    os.symlink(os.path.abspath(pdb_clean), combination_clean)
+
+    with profiling.tagged(f'{name}_state{state}' if state else name, state):
+        return pocket.get_fpocket_outputs(
+            combination_clean, name, chain, state, m, M, i, D, A, p,
+            cachedir, refresh, cachesize)
+
+
+def run_combination(
+    pdb : str,
+    source_dir : str,
+    name : str,
+    chain : str,
+    state : int,
+    parameters : dict,
+    ligand : str,
+    ligandchain : str,
+    knownnt : list[int],
+    qualityfilter : float,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
+) -> pd.DataFrame:
+    """Characterizes the pockets fpocket found with one combination of
+    parameters. No output files are kept.
+
+    Args:
+        pdb (str): Path to the cleaned copy of the input .pdb file.
+        source_dir (str): Path to the fpocket output directory.
+        name (str): Output file name prefix.
+        chain (str): Chain identifier(s) for RNA.
+        state (int): Structural state to analyze.
+        parameters (dict): fpocket parameters (m, M, i, D, A, p).
+        ligand (str): Ligand residue name (usually a 3-letter code).
+        ligandchain (str): Chain identifier for the ligand (default=chain).
+        knownnt (list[int]): Residue IDs of nts in known pocket.
+        qualityfilter (float): Minimum fpocket score filter for pockets.
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (bool): Download ligands missing from the ligand store from the PDBe.
+
+    Returns:
+        DataFrame: Pocket characteristics with a column per fpocket parameter.
+    """
+    m, M, i, D, A, p = (parameters[parameter] for parameter in PARAMETERS)
+    prefix = f'{name}_state{state}' if state else name
+
+    with profiling.tagged(prefix, state):
+        stem = os.path.join(source_dir, f'{name}_clean')
+        pc_df, _ = analyze.analyze_structures(
+            structures.get_context(pdb).structure,
+            outputs.get_out_atoms(outputs.read_out_pdb(f'{stem}_out.pdb'), prefix),
+            outputs.get_sphere_atoms(outputs.read_pqr(f'{stem}_pockets.pqr')),
+            source_dir,
+            prefix,
+            f'{stem}_info.txt',
+            os.path.basename(pdb)[0:4],
+            chain,
+            state,
+            ligandchain,
+            ligand,
+            m,
+            M,
+            i,
+            D,
+            A,
+            p,
+            qualityfilter,
+            knownnt,
+            False,
+            ligandstore,
+            fetchligands,
+        )
+        profiling.set_tags(Pockets=len(pc_df))
+
+    for position, parameter in enumerate(PARAMETERS):
+        pc_df.insert(position, parameter, parameters[parameter])
+    return pc_df
+
+
+def summarize_sweep(
+    sweep_df : pd.DataFrame, combinations : list[dict], states : list[int]
+) -> pd.DataFrame:
+    """Summarizes the pockets found with every combination of parameters.
+    Combinations (and states) without pockets are kept with 0 pockets.
+
+    Args:
+        sweep_df (DataFrame): Pocket characteristics of every combination.
+        combinations (list[dict]): fpocket parameters of every combination.
+        states (list[int]): Analyzed states.
+
+    Returns:
+        DataFrame: Number of pockets (all, passing the quality filter and
+                   known), and the maximum and mean score, drug score and
+                   volume of the pockets of every combination (and state).
+    """
+    keys = list(PARAMETERS) + ['State']
+    sweep_df = sweep_df.assign(
+        Passing=sweep_df['Filter'] == 'Pass',
+        Known=sweep_df['Type'] == 'Known',
+    )
+    summary = sweep_df.groupby(keys, dropna=False, sort=True).agg(
+        Pockets=('Pocket', 'count'),
+        Passing=('Passing', 'sum'),
+        Known=('Known', 'sum'),
+        Max_score=('Score', 'max'),
+        Mean_score=('Score', 'mean'),
+        Max_drug_score=('Drug_score', 'max'),
+        Mean_volume=('Volume', 'mean'),
+    ).reset_index()
+
+    grid_df = pd.DataFrame([
+        {**{parameter : parameters[parameter] for parameter in PARAMETERS},
+         'State': np.nan if state is None else state}
+        for parameters in combinations for state in states
+    ])
+    summary['State'] = summary['State'].astype(grid_df['State'].dtype)
+    summary = grid_df.merge(summary, on=keys, how='left')
+    counts = ['Pockets', 'Passing', 'Known']
+    summary[counts] = summary[counts].fillna(0).astype(int)
+    return summary.sort_values(keys, kind='stable', ignore_index=True)
+
+
+def get_parameter_effects(summary_df : pd.DataFrame, grid : dict) -> pd.DataFrame:
+    """Averages the summary over all other parameters for each value of every
+    swept parameter, to show how pocket counts and scores change across the
+    grid.
+
+    Args:
+        summary_df (DataFrame): Sweep summary (see summarize_sweep).
+        grid (dict[str, list]): Values of every swept parameter.
+
+    Returns:
+        DataFrame: Mean pockets, passing pockets and maximum score for
+                   every value of every swept parameter.
+    """
+    effects = []
+    for parameter in grid:
+        effect = summary_df.groupby(parameter)[
+            ['Pockets', 'Passing', 'Known', 'Max_score']].mean()
+        effect.insert(0, 'Value', effect.index)
+        effect.insert(0, 'Parameter', parameter)
+        effects.append(effect.reset_index(drop=True))
+    return pd.concat(effects, ignore_index=True).round(3)
+
+
+def run_sweep(
+    pdb : str,
+    specs : list[str],
+    chain : str,
+    state : int,
+    ligand : str,
+    ligandchain : str,
+    knownnt : list[int],
+    qualityfilter : float,
+    defaults : dict,
+    out : str,
+    name : str,
+    jobs : int = 1,
+    cachedir : str = None,
+    refresh : bool = False,
+    cachesize : float = cache.DEFAULT_CACHE_SIZE,
+    tmpdir : str = workspace.DEFAULT_TMPDIR,
+    ligandstore : str = ligands.DEFAULT_LIGAND_STORE,
+    fetchligands : bool = False,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Runs fpocket and the pocket analysis for every combination of fpocket
+    parameters in a grid. The structure is cleaned and its chains are
+    checked once, fpocket runs for {jobs} combinations at a time, and the
+    pockets are characterized in {jobs} worker processes.
+
+    Writes {out}/{name}_sweep_pocket_characteristics.csv (one row per pocket,
+    keyed by the parameters) and {out}/{name}_sweep_summary.csv (one row per
+    combination and state).
+
+    Args:
+        pdb (str): Path to input .pdb file.
+        specs (list[str]): Parameter grid, e.g. ['m=3.0,3.4', 'i=15:45:10'].
+        chain (str): Chain identifier(s) for RNA (Default: first RNA chain).
+        state (int): Structural state to analyze (0 for all states).
+        ligand (str): Ligand residue name (usually a 3-letter code).
+        ligandchain (str): Chain identifier for the ligand (default=chain).
+        knownnt (list[int]): Residue IDs of nts in known pocket.
+        qualityfilter (float): Minimum fpocket score filter for pockets.
+        defaults (dict): Values of the fpocket parameters that are not swept.
+        out (str): Path to the output parent directory.
+        name (str): Output file name prefix.
+        jobs (int): Number of concurrent fpocket runs and worker processes.
+        cachedir (str): Path to the cache directory (None disables caching).
+        refresh (bool): Reruns fpocket and replaces cached outputs.
+        cachesize (float): Maximum cache size in MB.
+        tmpdir (str): Directory for temporary run workspaces.
+        ligandstore (str): Path to the ligand property store.
+        fetchligands (bool): Download ligands missing from the ligand store from the PDBe.
+
+    Returns:
+        DataFrame: Pocket characteristics of every combination.
+        DataFrame: Summary of every combination and state.
+    """
+    grid = parse_grid(specs)
+    combinations = get_combinations(grid, defaults)
+
+    with profiling.stage('input', Structure=name):
+        util.is_accessible(pdb, 'pdb')
+        context = structures.get_context(pdb)
+        if chain is None:
+            chain = util.get_first_rna_chain(context)
+        else:
+            util.is_rna_chain(context, chain)
+        states = list(range(1, context.num_states + 1)) if state == 0 else [state]
+
+    print(f'Sweeping {len(combinations)} fpocket parameter combinations '
+          f'({" x ".join(f"{len(values)} {parameter}" for parameter, values in grid.items())}) '
+          f'over {len(states)} state(s) using {jobs} jobs.\n')
+
+    os.makedirs(out, exist_ok=True)
+    with workspace.workspace(out, name, tmpdir) as shared:
+        # Cleans the input once for all combinations.
+        pdb_clean = os.path.join(shared, f'{name}_clean.pdb')
+        pdb_copy = os.path.join(shared, f'{structures.get_name(pdb)}.pdb')
+        pocket.clean_pdb(pdb, pdb_clean, pdb_copy)
+
+        # Runs fpocket for every combination at once (fpocket is single
+        # threaded, so {jobs} threads keep {jobs} fpocket processes busy).
+        tasks = [
+            dict(name=name, chain=chain, state=task_state, parameters=parameters)
+            for parameters in combinations for task_state in states
+        ]
+        source_dirs = runner.run_many(
+            find_combination_pockets,
+            [dict(task, pdb_clean=pdb_clean, cachedir=cachedir, refresh=refresh,
+                  cachesize=cachesize) for task in tasks],
+            jobs,
+        )
+
+        # Characterizes the pockets of every combination in {jobs} workers.
+        tasks = [
+            dict(task, pdb=pdb_copy, source_dir=source_dir, ligand=ligand,
+                 ligandchain=ligandchain, knownnt=knownnt,
+                 qualityfilter=qualityfilter, ligandstore=ligandstore,
+                 fetchligands=fetchligands)
+            for task, source_dir in zip(tasks, source_dirs)
+        ]
+        results = []
+        if jobs > 1:
+            with parallel.get_pool(jobs) as pool:
+                futures = [pool.submit(run_combination, **task) for task in tasks]
+                for finished, future in enumerate(as_completed(futures), start=1):
+                    results.append(future.result())
+                    print(f'Finished {finished}/{len(tasks)} combinations.')
+        else:
+            for finished, task in enumerate(tasks, start=1):
+                results.append(run_combination(**task))
+                print(f'Finished {finished}/{len(tasks)} combinations.')
+
+    with profiling.stage('aggregation', Structure=name):
+        sweep_df = pd.concat(results, ignore_index=True).sort_values(
+            list(PARAMETERS) + ['State', 'Pocket'], kind='stable')
+        summary_df = summarize_sweep(sweep_df, combinations, states)
+        sweep_df.to_csv(f'{out}/{name}_sweep_pocket_characteristics.csv', index=False)
+        summary_df.to_csv(f'{out}/{name}_sweep_summary.csv', index=False)
+
+    print(f'\nSweep summary:\n{summary_df.round(3).to_string(index=False)}\n')
+    print('Mean pockets and scores by parameter value:\n'
+          f'{get_parameter_effects(summary_df, grid).to_string(index=False)}\n')
+
+    return sweep_df, summary_df
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for generating large synthetic RNA structures for scale testing
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import argparse
+import string
+import numpy as np
+from prody import AtomGroup
+from fpocketR import pocket, structures
+
+# Single character chain identifiers available in .pdb files.
+CHAIN_IDS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+
+# Largest residue number that fits in a .pdb file.
+MAX_RESNUM = 9999
+
+# Gap (angstroms) between tiled copies of a motif.
+DEFAULT_SPACING = 10.0
+
+
+def load_motif(pdb : str) -> AtomGroup:
+    """Loads the RNA atoms (first state and alternate location) of a
+    structure to use as a motif.
+
+    Args:
+        pdb (str): Path to a .pdb/.cif file (optionally gzip-compressed).
+
+    Returns:
+        object: ProDy atom group of the RNA atoms.
+    """
+    structure = structures.parse_structure(pdb)
+    motif = pocket.clean_structure(structure).copy()
+    if motif.numCoordsets() > 1:
+        motif.delCoordset(list(range(1, motif.numCoordsets())))
+    motif.setTitle(structure.getTitle())
+    return motif
+
+
+def tile_motif(
+    motif : AtomGroup,
+    copies : int,
+    chains : bool = False,
+    spacing : float = DEFAULT_SPACING,
+) -> AtomGroup:
+    """Builds a large RNA by placing copies of a motif side by side (along x).
+    Copies are renumbered into one continuous chain (e.g. a long RNA with
+    many domains), or each copy is its own chain (e.g. replicated chains
+    of a ribosome or crystal asymmetric unit).
+
+    Args:
+        motif (object): ProDy atom group of the motif (one state).
+        copies (int): Number of copies.
+        chains (bool): Place each copy in its own chain.
+        spacing (float): Gap between copies in angstroms.
+
+    Returns:
+        object: ProDy atom group of the tiled structure.
+    """
+    if copies < 1:
+        raise ValueError('The number of copies must be at least 1.')
+
+    num_atoms = motif.numAtoms()
+    coords = motif.getCoords()
+    resnums = motif.getResnums()
+    span = resnums.max() - resnums.min() + 1
+    shift = np.ptp(coords[:, 0]) + spacing
+
+    if chains:
+        chids = list(dict.fromkeys(motif.getChids()))
+        if copies * len(chids) > len(CHAIN_IDS):
+            raise ValueError(
+                f'{copies} copies of {len(chids)} chains need more than the '
+                f'{len(CHAIN_IDS)} chain identifiers of a .pdb file.')
+        chain_map = np.array([chids.index(chid) for chid in motif.getChids()])
+        new_chids = np.concatenate([
+            np.array(list(CHAIN_IDS))[chain_map + copy * len(chids)]
+            for copy in range(copies)])
+        new_resnums = np.tile(resnums, copies)
+    else:
+        if resnums.min() + copies * span - 1 > MAX_RESNUM:
+            raise ValueError(
+                f'{copies} copies of {span} residues do not fit in a .pdb file '
+                f'(residue numbers > {MAX_RESNUM}). Use chains instead.')
+        new_chids = np.tile(motif.getChids(), copies)
+        new_resnums = np.concatenate(
+            [resnums + copy * span for copy in range(copies)])
+
+    offsets = np.repeat(np.arange(copies) * shift, num_atoms)
+    new_coords = np.tile(coords, (copies, 1))
+    new_coords[:, 0] += offsets
+
+    tiled = AtomGroup(f'{motif.getTitle()}_x{copies}')
+    tiled.setCoords(new_coords)
+    tiled.setChids(new_chids)
+    tiled.setResnums(new_resnums)
+    for label in ('Names', 'Resnames', 'Elements', 'Icodes', 'Altlocs',
+                  'Segnames', 'Occupancies', 'Betas'):
+        values = getattr(motif, f'get{label}')()
+        if values is not None:
+            getattr(tiled, f'set{label}')(np.tile(values, copies))
+    tiled.setFlags('hetatm', np.tile(motif.getFlags('hetatm'), copies))
+    return tiled
+
+
+def make_ensemble(
+    structure : AtomGroup,
+    states : int,
+    rmsd : float = 1.0,
+    seed : int = 0,
+) -> AtomGroup:
+    """Builds an N-state ensemble by perturbing the coordinates of a
+    structure (e.g. an NMR ensemble or simulation frames). The first state
+    is the input structure.
+
+    Args:
+        structure (object): ProDy atom group (the active state is used).
+        states (int): Number of states.
+        rmsd (float): Expected RMSD (angstroms) of each state to the first.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        object: ProDy atom group with {states} coordinate sets.
+    """
+    if states < 1:
+        raise ValueError('The number of states must be at least 1.')
+
+    rng = np.random.default_rng(seed)
+    coords = structure.getCoords()
+    noise = rng.normal(0.0, rmsd / np.sqrt(3), (states - 1, *coords.shape))
+
+    ensemble = structure.copy()
+    ensemble.delCoordset(list(range(ensemble.numCoordsets())))
+    ensemble.setCoords(np.concatenate([coords[None], coords[None] + noise]))
+    ensemble.setTitle(f'{structure.getTitle()}_{states}states')
+    return ensemble
+
+
+def make_structure(
+    motif : str,
+    out : str,
+    copies : int = 1,
+    chains : bool = False,
+    states : int = 1,
+    rmsd : float = 1.0,
+    seed : int = 0,
+) -> dict:
+    """Generates a synthetic RNA structure and writes it to a .pdb file.
+
+    Args:
+        motif (str): Path to the motif .pdb file.
+        out (str): Path to the output .pdb file.
+        copies (int): Number of copies of the motif.
+        chains (bool): Place each copy in its own chain.
+        states (int): Number of states.
+        rmsd (float): Expected RMSD (angstroms) of each state to the first.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        dict: Size of the structure (Nucleotides, Chains, States, Atoms).
+    """
+    structure = tile_motif(load_motif(motif), copies, chains)
+    if states > 1:
+        structure = make_ensemble(structure, states, rmsd, seed)
+    pocket.write_pdb(out, structure)
+
+    return {
+        'Nucleotides': structure.numResidues(),
+        'Chains': structure.numChains(),
+        'States': structure.numCoordsets(),
+        'Atoms': structure.numAtoms(),
+    }
+
+
+# -----------------------------------------------------------------------------
+def parseArgs(argv : list[str] = None):
+    prs = argparse.ArgumentParser(prog='fpocketR synthetic')
+
+    prs.add_argument(
+        'motif',
+        type=str,
+        help='Path to the .pdb file of the motif to tile.',
+    )
+    prs.add_argument(
+        '-o',
+        '--out',
+        type=str,
+        required=True,
+        help='Path to the output .pdb file.',
+    )
+    prs.add_argument(
+        '-x',
+        '--copies',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of copies of the motif (1).',
+    )
+    prs.add_argument(
+        '--chains',
+        required=False,
+        action='store_true',
+        help='Places each copy in its own chain instead of one continuous chain (False).',
+    )
+    prs.add_argument(
+        '-s',
+        '--states',
+        type=int,
+        required=False,
+        default=1,
+        help='Number of states of a perturbed ensemble (1).',
+    )
+    prs.add_argument(
+        '--rmsd',
+        type=float,
+        required=False,
+        default=1.0,
+        help='Expected RMSD (Å) of each state to the first state (1.0).',
+    )
+    prs.add_argument(
+        '--seed',
+        type=int,
+        required=False,
+        default=0,
+        help='Seed of the random number generator (0).',
+    )
+
+    args = prs.parse_args(argv)
+    return args
+
+
+def main(
+    motif : str,
+    out : str,
+    copies : int = 1,
+    chains : bool = False,
+    states : int = 1,
+    rmsd : float = 1.0,
+    seed : int = 0,
+):
+    """Generates a synthetic RNA structure for scale testing."""
+    size = make_structure(motif, out, copies, chains, states, rmsd, seed)
+    print(f'Wrote {out}: {size["Nucleotides"]} nucleotides, {size["Chains"]} '
+          f'chains, {size["States"]} states, {size["Atoms"]} atoms.')
+    return size
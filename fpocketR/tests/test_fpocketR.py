@@ -25,6 +25,25 @@ def cleanup_fpocket_files():
     atexit.register(remove_files)
 
 
+# --- Keep the fpocketR cache out of the user's home directory ---
+@pytest.fixture(scope="session", autouse=True)
+def isolated_cache(tmp_path_factory):
+    os.environ["FPOCKETR_CACHE_DIR"] = str(tmp_path_factory.mktemp("fpocketR_cache"))
+    yield os.environ["FPOCKETR_CACHE_DIR"]
+    os.environ.pop("FPOCKETR_CACHE_DIR")
+
+
+# --- Look up ligand QED scores offline from the reference ideal structures ---
+@pytest.fixture(scope="session", autouse=True)
+def ligand_store(tmp_path_factory):
+    from fpocketR import ligands
+    store = str(tmp_path_factory.mktemp("fpocketR_ligands") / "ligands.tsv")
+    ligands.build_store([str(Path(__file__).parent.parent / "data")], store)
+    os.environ["FPOCKETR_LIGAND_STORE"] = store
+    yield store
+    os.environ.pop("FPOCKETR_LIGAND_STORE")
+
+
 # --- Basic Import Test ---
 def test_fpocketR_imported():
     """Sample test, will always pass so long as import statement worked."""
@@ -95,6 +114,24 @@ def single_state_alt_output(tmp_path_factory):
     return out_dir
 
 
+def test_single_state_runs_in_isolated_workspace(tmp_path):
+    """The input file is never modified and no workspace files are left behind."""
+    import shutil
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    pdb_file = Path(shutil.copy(repo_root / "fpocketR" / "data" / "8f4o.pdb", tmp_path))
+    input_bytes = pdb_file.read_bytes()
+    cmd = [
+        "python", "-m", "fpocketR", "-pdb", pdb_file.name, "-l", "no", "-al", "False",
+        "-dpi", "50", "-o", "out", "--no-cache",
+    ]
+    env = {**os.environ, "PYTHONPATH": str(repo_root)}
+    subprocess.run(cmd, check=True, cwd=str(tmp_path), capture_output=True, text=True, env=env)
+    assert pdb_file.read_bytes() == input_bytes
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["8f4o.pdb", "out"]
+    assert [p.name for p in (tmp_path / "out").iterdir()] == ["8f4o_clean_out"]
+    assert (tmp_path / "out" / "8f4o_clean_out" / "8f4o_out_pocket_characteristics.csv").is_file()
+
+
 # --- Alternate Single-State Output Tests ---
 def test_single_state_alt_pdb_match_reference(single_state_alt_output):
     """Compare generated 8f4o_out_real_sphere.pdb to reference file."""
@@ -216,4 +253,784 @@ def test_multistate_summary_files_exist(multistate_output):
     # Accept any file matching *_all_states_out_real_sphere.pse
     assert any(f.name.endswith("_all_states_out_real_sphere.pse") for f in gen_files), "Missing *_all_states_out_real_sphere.pse"
     assert any(f.name.endswith("_pocket_density.png") for f in gen_files), "Missing _pocket_density.png"
-    assert any(f.name.endswith("all_states_pocket_characteristics.csv") for f in gen_files), "Missing all_states_pocket_characteristics.csv"
\ No newline at end of file
+    assert any(f.name.endswith("all_states_pocket_characteristics.csv") for f in gen_files), "Missing all_states_pocket_characteristics.csv"
+
+# --- Parallel Multistate Output Fixture ---
+@pytest.fixture(scope="session")
+def multistate_parallel_output(tmp_path_factory):
+    """Run the multistate fpocketR command with parallel jobs and return output dir."""
+    tmp_path = tmp_path_factory.mktemp("multistate_parallel")
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    data_dir = repo_root / "fpocketR" / "data"
+    pdb_file = (data_dir / "2l1v.pdb").resolve()
+    ss_file = (data_dir / "2l1v.nsd").resolve()
+    out_dir = tmp_path / "2l1v_multistate"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rel_out_dir = os.path.relpath(out_dir, repo_root)
+    cmd = [
+        "python", "-m", "fpocketR",
+        "-pdb", str(pdb_file),
+        "-ss", str(ss_file),
+        "-s", "0", "-j", "2", "-dpi", "50", "-o", rel_out_dir, "--no-cache"
+    ]
+    subprocess.run(cmd, check=True, cwd=str(repo_root), capture_output=True, text=True)
+    return out_dir
+
+
+def test_multistate_parallel_matches_serial(multistate_output, multistate_parallel_output):
+    """Parallel multistate runs produce the same files and pocket table as serial runs."""
+    serial_files = sorted(f.relative_to(multistate_output) for f in multistate_output.rglob("*") if f.is_file())
+    parallel_files = sorted(f.relative_to(multistate_parallel_output) for f in multistate_parallel_output.rglob("*") if f.is_file())
+    assert serial_files == parallel_files
+    serial_csv = multistate_output / "2l1v_all_states_pocket_characteristics.csv"
+    parallel_csv = multistate_parallel_output / "2l1v_all_states_pocket_characteristics.csv"
+    assert tolerant_csv_compare(serial_csv, parallel_csv, atol=0)
+
+
+# --- Batch Manifest Tests ---
+def test_batch_read_manifest_formats(tmp_path):
+    """Tab separated manifests and argument-per-line manifests give the same fpocketR arguments."""
+    from fpocketR import batch
+    tsv = tmp_path / "manifest.tsv"
+    tsv.write_text(
+        "pdb\tstate\tout\tyes\tm\n"
+        "# comment lines are ignored\n"
+        "2l1v.pdb\t0\tpreQ1_RS\ttrue\t\n"
+        "8f4o.pdb\t\tTPP_RS\t\t3.2\n"
+    )
+    txt = tmp_path / "manifest.txt"
+    txt.write_text("-pdb 2l1v.pdb -s 0 -o preQ1_RS -y\n-pdb 8f4o.pdb -o TPP_RS -m 3.2\n")
+    from fpocketR.__main__ import get_parser
+    parse = lambda argv: vars(get_parser().parse_args(argv))
+    tsv_args = [parse(argv) for argv in batch.read_manifest(str(tsv))]
+    txt_args = [parse(argv) for argv in batch.read_manifest(str(txt))]
+    assert tsv_args == txt_args
+    assert tsv_args[0]["state"] == 0 and tsv_args[0]["yes"] is True
+    assert tsv_args[1]["m"] == 3.2 and tsv_args[1]["yes"] is False
+
+
+def test_batch_resolves_relative_paths_before_scratch_dir(tmp_path):
+    """Relative --cache-dir and --profile paths of manifest entries are kept in the manifest directory."""
+    import shutil
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    shutil.copy(repo_root / "fpocketR" / "data" / "8f4o.pdb", tmp_path / "8f4o.pdb")
+    (tmp_path / "manifest.txt").write_text(
+        "-pdb 8f4o.pdb -o out -l no --render none --cache-dir cache --profile profile.jsonl\n")
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(repo_root), os.environ.get("PYTHONPATH", "")])}
+    subprocess.run(
+        ["python", "-m", "fpocketR", "batch", "manifest.txt"],
+        check=True, cwd=str(tmp_path), env=env, capture_output=True, text=True)
+    report = pd.read_csv(tmp_path / "fpocketR_batch_report.tsv", sep="\t")
+    assert report["Status"].tolist() == ["Success"]
+    assert any((tmp_path / "cache").iterdir())
+    assert (tmp_path / "profile.jsonl").stat().st_size > 0
+
+
+# --- Inertia Tensor / NPR Tests ---
+def test_inertia_tensors_match_reference_and_batch():
+    """Batched inertia tensors match a per-point reference calculation for every group."""
+    import numpy as np
+    from fpocketR import util
+    rng = np.random.default_rng(0)
+    coords = rng.normal(size=(60, 3)) * [4.0, 2.0, 1.0]
+    masses = rng.uniform(1, 16, size=60)
+    group_ids = np.repeat([0, 1, 2], [10, 20, 30])
+
+    tensors = util.calc_inertia_tensors(coords, masses, group_ids)
+    for group in range(3):
+        xyz, m = coords[group_ids == group], masses[group_ids == group]
+        r = xyz - (m[:, None] * xyz).sum(axis=0) / m.sum()
+        reference = sum(mi * (ri @ ri * np.eye(3) - np.outer(ri, ri)) for mi, ri in zip(m, r))
+        np.testing.assert_allclose(tensors[group], reference, atol=1e-9)
+
+    npr = util.calc_npr_from_tensors(tensors)
+    assert npr.shape == (3, 2)
+    assert np.all((npr > 0) & (npr <= 1))
+
+    # NPRs of several atom groups at once match one group at a time.
+    from prody import parsePDB
+    structure = parsePDB(str(Path(__file__).parent.parent / "data" / "8f4o.pdb"))
+    groups = [structure.select(f"resnum {resnum}") for resnum in (12, 13, 40)] + [structure.select("resname IRI")]
+    np.testing.assert_allclose(util.calc_npr_batch(groups), [util.calc_npr(group) for group in groups], atol=1e-9)
+    assert util.calc_npr_batch([]).shape == (0, 2)
+
+
+# --- Pocket Shape Tests ---
+@pytest.mark.parametrize("state_idx", range(1, 4))
+def test_pocket_npr_matches_reference_surfaces(state_idx):
+    """In-memory a-sphere volume NPRs match reference NPRs from PyMOL surface meshes."""
+    import numpy as np
+    from prody import parsePQR
+    from fpocketR import surface
+    state_dir = MULTISTATE_DIR / f"2l1v_clean_state{state_idx}_out"
+    pockets = parsePQR(str(state_dir / f"2l1v_clean_state{state_idx}_pockets.pqr"))
+    reference = pd.read_csv(state_dir / f"2l1v_state{state_idx}_out_pocket_characteristics.csv")
+    pocket_nums, npr = surface.calc_pocket_npr(pockets.getCoords(), pockets.getRadii(), pockets.getResnums())
+    assert list(pocket_nums) == reference["Pocket"].tolist()
+    np.testing.assert_allclose(npr, reference[["Pocket_NPR1", "Pocket_NPR2"]].to_numpy(), atol=0.02)
+
+
+# --- PocketNT Tests ---
+@pytest.mark.parametrize("state_idx", range(1, 4))
+def test_pocket_nt_matches_fpocket_pocket_files(state_idx):
+    """Single-pass PocketNT contacts match the residues in fpocket's pocket*_atm.pdb files."""
+    from prody import parsePDB
+    from fpocketR import analyze, util
+    state_dir = MULTISTATE_DIR / f"2l1v_clean_state{state_idx}_out"
+    out_structure = parsePDB(str(state_dir / f"2l1v_clean_state{state_idx}_out.pdb"))
+    stp_coords = out_structure.select("resname STP")
+    pocket_nt = analyze.get_pocket_nt(out_structure, stp_coords, "A")
+    pocket_files = util.natsorted([str(f) for f in (state_dir / "pockets").glob("pocket*_atm.pdb")])
+    assert pocket_nt == [sorted(set(parsePDB(f).getResnums().tolist())) for f in pocket_files]
+
+@pytest.mark.parametrize("state_idx", range(1, 4))
+def test_overlap_scores_match_selection_based_scores(state_idx):
+    """Vectorized overlap scores match per-pocket ProDy 'within 3 of' selections."""
+    import numpy as np
+    from prody import parsePDB, calcCenter, calcDistance
+    from fpocketR import analyze
+    state_dir = MULTISTATE_DIR / f"2l1v_clean_state{state_idx}_out"
+    out_structure = parsePDB(str(state_dir / f"2l1v_clean_state{state_idx}_out.pdb"))
+    stp_coords = out_structure.select("resname STP").copy()
+    # Nucleotides stand in for ligands so every pocket has a near and a far candidate.
+    ligands = {str(resnum): out_structure.select(f"resnum {resnum} and not resname STP").copy()
+               for resnum in (8, 16, 33)}
+    score_df = analyze.score_ligands(stp_coords, ligands)
+
+    for ligand_id, ligand in ligands.items():
+        expected = []
+        for residue in stp_coords.iterResidues():
+            pocket_sele = residue.select("within 3 of ligand", ligand=ligand)
+            ligand_sele = ligand.select("within 3 of pocket", pocket=residue)
+            expected.append([
+                0 if pocket_sele is None else pocket_sele.numAtoms() / residue.numAtoms(),
+                0 if ligand_sele is None else ligand_sele.numAtoms() / ligand.numAtoms(),
+                min(calcDistance(calcCenter(residue.getCoords()), ligand)),
+            ])
+        scores = score_df[score_df["Ligand_ID"] == ligand_id]
+        assert np.allclose(scores[["Pocket_overlap", "Ligand_overlap", "Center_criteria"]], expected)
+
+
+def test_cache_reuses_fpocket_outputs_and_evicts_lru(tmp_path, monkeypatch):
+    """Cached fpocket outputs are restored on a hit, the oldest entries are evicted and keys change with fpocketR."""
+    import time
+    from fpocketR import cache
+    cachedir = str(tmp_path / "cache")
+    source_dir = MULTISTATE_DIR / "2l1v_clean_state1_out"
+    for key in ("old", "new"):
+        cache.store_fpocket(cachedir, key, str(source_dir), cachesize=100)
+        time.sleep(0.01)
+
+    dest_dir = tmp_path / "2l1v_clean_out"
+    assert cache.fetch_fpocket(cachedir, "old", str(dest_dir))
+    assert sorted(p.name for p in dest_dir.rglob("*")) == sorted(p.name for p in source_dir.rglob("*"))
+    assert not cache.fetch_fpocket(cachedir, "missing", str(tmp_path / "missing_out"))
+
+    # "old" was used last, so "new" is evicted when only one entry fits.
+    cache.evict(cachedir, cachesize=1.5 * cache.get_size(str(dest_dir)) / 1024 ** 2)
+    assert cache.get_entry(cachedir, "old", cache.FPOCKET_ENTRY)
+    assert cache.get_entry(cachedir, "new", cache.FPOCKET_ENTRY) is None
+
+    # Upgrading fpocketR (or its cache version) invalidates cached results.
+    pdb = str(MULTISTATE_DIR / "2l1v_clean_state1_out" / "2l1v_clean_state1_out.pdb")
+    args = (pdb, pdb, pdb, pdb, "2l1v", "A", "PRF", "A", 0.0, [], (3.0, 5.7, 42, 1.65, 3, 0.0, 1))
+    keys = [cache.get_characteristics_key(*args)]
+    monkeypatch.setattr(cache, "CACHE_VERSION", cache.CACHE_VERSION + 1)
+    keys.append(cache.get_characteristics_key(*args))
+    monkeypatch.setattr(cache, "get_package_version", lambda: "99.0")
+    keys.append(cache.get_characteristics_key(*args))
+    assert len(set(keys)) == 3
+
+
+@pytest.mark.parametrize("pdb_code", ["2l1v", "8f4o"])
+def test_clean_pdb_matches_reference(tmp_path, pdb_code):
+    """ProDy cleaning keeps the same atoms, alternate locations and states as the reference clean files."""
+    import numpy as np
+    from prody import parsePDB
+    from fpocketR import pocket
+    data_dir = Path(__file__).parent.parent / "data"
+    pdb_clean = str(tmp_path / f"{pdb_code}_clean.pdb")
+    pocket.clean_pdb(str(data_dir / f"{pdb_code}.pdb"), pdb_clean)
+    cleaned = parsePDB(pdb_clean, altloc="all")
+    reference = parsePDB(str(data_dir / f"{pdb_code}_clean.pdb"), altloc="all")
+    assert not cleaned.getFlags("hetatm").any()
+    for attr in ("getChids", "getResnums", "getResnames", "getNames", "getAltlocs"):
+        assert (getattr(cleaned, attr)() == getattr(reference, attr)()).all()
+    assert np.allclose(cleaned.getCoordsets(), reference.getCoordsets())
+
+
+def test_clean_pdb_keeps_linked_modified_nucleotides(tmp_path):
+    """Modified nucleotides bonded into the chain are kept, free ligands and ions are removed."""
+    from prody import parsePDB
+    from fpocketR import pocket
+    data_dir = Path(__file__).parent.parent / "data"
+    pdb_clean, pdb_copy = str(tmp_path / "2gdi_clean.pdb"), str(tmp_path / "2gdi.pdb")
+    pocket.clean_pdb(str(data_dir / "2gdi.pdb"), pdb_clean, pdb_copy)
+    cleaned_resnames = set(parsePDB(pdb_clean).getResnames())
+    assert "CCC" in cleaned_resnames
+    assert not cleaned_resnames & {"TPP", "MG", "K", "NA", "HOH"}
+    copy = parsePDB(pdb_copy)
+    assert set(copy.select("hetatm").getResnames()) >= {"TPP"}
+    assert "CCC" not in set(copy.select("hetatm").getResnames())
+
+
+def test_write_pdb_hybrid36_and_built_atom_groups(tmp_path):
+    """write_pdb keeps columns for residue numbers above 9999 and writes atom groups built in code."""
+    import numpy as np
+    from prody import AtomGroup, parsePDB
+    from fpocketR import pocket
+    data_dir = Path(__file__).parent.parent / "data"
+    structure = parsePDB(str(data_dir / "8f4o.pdb"))
+    structure.setResnums(structure.getResnums() + 10000)
+    pdb = str(tmp_path / "8f4o_10k.pdb")
+    pocket.write_pdb(pdb, structure)
+    written = parsePDB(pdb)
+    assert (written.getResnums() == structure.getResnums()).all()
+    assert np.allclose(written.getCoords(), structure.getCoords())
+
+    # Only names, residues, chains, elements and coordinates (no flags, altlocs or icodes).
+    atoms = AtomGroup("built")
+    atoms.setCoords(structure.getCoords()[:3])
+    atoms.setNames(["P", "OP1", "OP2"])
+    atoms.setResnames(["G"] * 3)
+    atoms.setChids(["A"] * 3)
+    atoms.setResnums([1, 1, 1])
+    atoms.setElements(["P", "O", "O"])
+    pocket.write_pdb(pdb, atoms)
+    written = parsePDB(pdb)
+    assert written.getNames().tolist() == ["P", "OP1", "OP2"] and not written.getFlags("hetatm").any()
+
+    atoms.setChids(["ABC"] * 3)
+    with pytest.raises(ValueError):
+        pocket.write_pdb(pdb, atoms)
+
+
+def test_ligand_store_reads_sdf_and_ccd(tmp_path, ligand_store, monkeypatch):
+    """Ligand properties from ideal .sdf files and CCD entries match RDKit and are looked up without downloads."""
+    from rdkit import Chem
+    from rdkit.Chem import QED
+    from fpocketR import ligands
+    monkeypatch.setattr(ligands, "fetch_ligand", lambda ligand: pytest.fail(f"Downloaded {ligand}"))
+    sdf = Path(__file__).parent.parent / "data" / "preQ1_multistate" / "2l1v_clean_state1_out" / "PRF_ideal.sdf"
+    mol = Chem.MolFromMolFile(str(sdf), removeHs=False)
+    prf = ligands.get_ligand_properties("PRF", ligand_store)
+    assert prf["QED_score"] == pytest.approx(QED.default(Chem.RemoveHs(mol)))
+    assert round(prf["QED_score"], 2) == 0.46
+    assert 100 < prf["MW"] < 200 and prf["Carbon_count"] == 7
+    assert ligands.get_ligand_properties("XXX", ligand_store) is None
+
+    # Writes PRF as a Chemical Component Dictionary entry under a new ID.
+    conf = mol.GetConformer()
+    atom_ids = [f"{a.GetSymbol()}{a.GetIdx()}" for a in mol.GetAtoms()]
+    orders = {1.0: "SING", 2.0: "DOUB", 3.0: "TRIP", 1.5: "AROM"}
+    lines = ["data_PRX", "#", "_chem_comp.id PRX", "#", "loop_"]
+    lines += [f"_chem_comp_atom.{c}" for c in (
+        "comp_id", "atom_id", "type_symbol", "charge",
+        "pdbx_model_Cartn_x_ideal", "pdbx_model_Cartn_y_ideal", "pdbx_model_Cartn_z_ideal")]
+    for atom, atom_id in zip(mol.GetAtoms(), atom_ids):
+        x, y, z = conf.GetAtomPosition(atom.GetIdx())
+        lines.append(f'PRX "{atom_id}" {atom.GetSymbol()} {atom.GetFormalCharge()} {x:.3f} {y:.3f} {z:.3f}')
+    lines += ["#", "loop_"] + [f"_chem_comp_bond.{c}" for c in ("comp_id", "atom_id_1", "atom_id_2", "value_order")]
+    for bond in mol.GetBonds():
+        lines.append(f"PRX {atom_ids[bond.GetBeginAtomIdx()]} {atom_ids[bond.GetEndAtomIdx()]} "
+                     f"{orders[bond.GetBondTypeAsDouble()]}")
+    ccd = tmp_path / "components.cif"
+    ccd.write_text("\n".join(lines + ["#", ""]))
+
+    store = str(tmp_path / "ligands.tsv")
+    ligands.build_store([str(ccd)], store)
+    prx = ligands.get_ligand_properties("PRX", store)
+    for column in ("QED_score", "MW", "Carbon_count", "NPR1", "NPR2"):
+        assert prx[column] == pytest.approx(prf[column], abs=1e-3)
+
+
+def test_deferred_render_matches_inline_outputs(tmp_path):
+    """--render deferred writes a render spec instead of figures, and `fpocketR render` makes the figures from it."""
+    from fpocketR import render
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    data_dir = repo_root / "fpocketR" / "data"
+    cmd = [
+        "python", "-m", "fpocketR", "-pdb", str(data_dir / "2l1v.pdb"), "-ss", str(data_dir / "2l1v.nsd"),
+        "-s", "1", "-dpi", "50", "-o", str(tmp_path / "out"), "--render", "deferred",
+    ]
+    env = {**os.environ, "PYTHONPATH": str(repo_root)}
+    subprocess.run(cmd, check=True, cwd=str(tmp_path), capture_output=True, text=True, env=env)
+    out_dir = tmp_path / "out" / "2l1v_clean_state1_out"
+    assert (out_dir / "2l1v_state1_out_pocket_characteristics.csv").is_file()
+    assert not list(out_dir.glob("*.png")) and not list(out_dir.glob("*.pse"))
+
+    spec = out_dir / "2l1v_state1_render.json"
+    assert render.find_render_specs([str(tmp_path)]) == [str(spec)]
+    report = render.main([str(tmp_path / "out")])
+    assert report["Status"].tolist() == ["Success"]
+    for figure in ("2l1v_state1_2D.png", "2l1v_state1_2D.svg", "2l1v_state1_3D_50.png", "2l1v_state1_out_real_sphere.pse"):
+        assert (out_dir / figure).is_file()
+    assert render.main([str(spec)]).empty
+
+
+def test_multistate_results_database(multistate_output, tmp_path):
+    """Multistate runs store typed, full precision pocket rows and color maps for every state."""
+    import numpy as np
+    from fpocketR import results
+    results_db = str(multistate_output / "2l1v_all_states.sqlite")
+    pc_df = results.read_pockets(results_db)
+    summary = pd.read_csv(multistate_output / "2l1v_all_states_pocket_characteristics.csv")
+    assert pc_df["State"].tolist() == summary["State"].tolist()
+    assert pc_df["Pocket"].tolist() == summary["Pocket"].tolist()
+    assert pc_df["Score"].dtype == np.float64
+    assert all(isinstance(nts, list) for nts in pc_df["PocketNT"])
+    assert results.read_pockets(results_db, states=[2])["State"].eq(2).all()
+    pocket_cmap, pocket_nt_color = results.read_maps(results_db)
+    assert sorted(pocket_cmap) == sorted(pocket_nt_color) == sorted(set(pc_df["State"]))
+
+    # Rewriting a state replaces its rows instead of duplicating them.
+    copy_db = str(tmp_path / "copy.sqlite")
+    for state in (1, 1):
+        state_df = pc_df[pc_df["State"] == 1]
+        results.append_state(copy_db, state, state_df, pocket_cmap[1], pocket_nt_color[1])
+    assert len(results.read_pockets(copy_db)) == len(state_df)
+    assert np.array_equal(results.read_pockets(copy_db)["Score"], state_df["Score"])
+
+
+def test_multistate_resume_redoes_only_unfinished_states(multistate_output, tmp_path):
+    """The run manifest records every state, and a restarted run only repeats missing, failed or changed states."""
+    import shutil
+    import sqlite3
+    from fpocketR import results
+    out_dir = tmp_path / "2l1v_multistate"
+    shutil.copytree(multistate_output, out_dir)
+    results_db = str(out_dir / "2l1v_all_states.sqlite")
+    manifest = results.read_states(results_db)
+    assert manifest["Status"].tolist() == ["done", "done", "done"]
+    assert manifest["Seconds"].notna().all()
+    parameters = manifest["Parameters"][0]
+    assert results.get_pending_states(results_db, [1, 2, 3], parameters) == []
+    assert results.get_pending_states(results_db, [1, 2, 3, 4], "changed") == [1, 2, 3, 4]
+
+    # A failed state, a deleted output and a modified output are all redone.
+    with sqlite3.connect(results_db) as con:
+        con.execute("UPDATE states SET Status = 'failed' WHERE State = 1")
+    (out_dir / "2l1v_clean_state2_out" / "2l1v_state2_out_real_sphere.pdb").unlink()
+    with open(out_dir / "2l1v_clean_state3_out" / "2l1v_state3_out_pocket_characteristics.csv", "a") as f:
+        f.write("\n")
+    assert results.get_pending_states(results_db, [1, 2, 3], parameters) == [1, 2, 3]
+
+    # Files added after a state finished (e.g. deferred figures) are ignored.
+    shutil.copytree(multistate_output / "2l1v_clean_state1_out", out_dir / "2l1v_clean_state1_out", dirs_exist_ok=True)
+    with sqlite3.connect(results_db) as con:
+        con.execute("UPDATE states SET Status = 'done' WHERE State = 1")
+    (out_dir / "2l1v_clean_state1_out" / "2l1v_state1_3D_600.png").write_bytes(b"")
+    assert results.get_pending_states(results_db, [1], parameters) == []
+
+    # A failing state is recorded with its error.
+    with pytest.raises(RuntimeError):
+        with results.track_state(results_db, 5, parameters):
+            raise RuntimeError("preempted")
+    failed = results.read_states(results_db).set_index("State").loc[5]
+    assert failed["Status"] == "failed" and "preempted" in failed["Error"]
+
+
+def test_find_pockets_api_matches_reference(tmp_path):
+    """The in-memory API matches the command line outputs, for paths, AtomGroups and coordinate arrays."""
+    import numpy as np
+    import prody
+    import fpocketR
+    data_dir = Path(__file__).parent.parent / "data"
+    reference_dir = data_dir / "TPP_apo_holo" / "8f4o_clean_out"
+    structure = prody.parsePDB(str(data_dir / "8f4o.pdb"))
+
+    result = fpocketR.find_pockets(str(data_dir / "8f4o.pdb"), cachedir=None)
+    assert isinstance(result, fpocketR.PocketResult)
+    assert result.chain == "A" and result.params == fpocketR.FpocketParameters()
+    assert result.pocket_nt == {1: [19, 20, 39, 40, 42, 43]}
+    assert set(result.pocket_cmap) == {1}
+    assert len(result.sphere_radii) == (result.structure.getResnames() == "STP").sum()
+    reference = prody.parsePDB(str(reference_dir / "8f4o_out_real_sphere.pdb"))
+    assert np.allclose(result.structure.getCoords(), reference.getCoords(), atol=1e-3)
+    assert np.allclose(result.structure.getBetas(), reference.getBetas(), atol=1e-2)
+
+    # Nothing is written until asked.
+    assert list(tmp_path.iterdir()) == []
+    out_dir = Path(result.write(str(tmp_path)))
+    assert tolerant_csv_compare(
+        out_dir / "8f4o_out_pocket_characteristics.csv",
+        reference_dir / "8f4o_out_pocket_characteristics.csv")
+
+    frame = fpocketR.find_pockets(structure, coords=structure.getCoords(), params={"m": 3.0})
+    assert frame.pocket_nt == result.pocket_nt
+    assert frame.pockets.equals(result.pockets)
+    assert np.array_equal(structure.getCoords(), prody.parsePDB(str(data_dir / "8f4o.pdb")).getCoords())
+
+    # AtomGroups built in code (no hetatm flags, altlocs, icodes or masses), e.g. converted from MD tools.
+    source = prody.parsePDB(str(data_dir / "8f4o.pdb"), altloc="all")
+    built = prody.AtomGroup("8f4o")
+    built.setCoords(source.getCoords())
+    for field in ("Names", "Resnames", "Chids", "Resnums", "Elements"):
+        getattr(built, f"set{field}")(getattr(source, f"get{field}")())
+    ligand = fpocketR.find_pockets(str(data_dir / "8f4o.pdb"), ligand="IRI", ligandchain="A")
+    built_result = fpocketR.find_pockets(built, ligand="IRI", ligandchain="A")
+    assert built_result.pocket_nt == result.pocket_nt
+    assert built_result.pockets.equals(ligand.pockets)
+    assert built_result.structure.numAtoms() == result.structure.numAtoms()
+
+
+def test_profile_records_every_stage(tmp_path):
+    """--profile / profiling.enable() writes one tagged JSON line per pipeline stage."""
+    import fpocketR
+    from fpocketR import profiling
+    data_dir = Path(__file__).parent.parent / "data"
+    report = tmp_path / "profile.jsonl"
+    profiling.enable(str(report))
+    try:
+        result = fpocketR.find_pockets(str(data_dir / "8f4o.pdb"), ligand="IRI", ligandchain="A")
+    finally:
+        profiling.disable()
+    profile_df = profiling.read_profile(str(report))
+    assert {"clean", "fpocket", "characteristics", "pocket_nt", "surfaces", "ligand"} <= set(profile_df["Stage"])
+    assert (profile_df["Structure"] == "8f4o").all()
+    assert (profile_df["Pockets"] == len(result.pockets)).all()
+    assert (profile_df[["Wall", "CPU", "RSS", "Traced"]] >= 0).all().all()
+    summary = profiling.summarize(profile_df)
+    assert summary["Stage"].iloc[0] == "clean" and summary["Wall_share"].sum() == pytest.approx(1, abs=0.01)
+
+    # Nothing is recorded once profiling is disabled.
+    fpocketR.find_pockets(str(data_dir / "8f4o.pdb"))
+    assert len(profiling.read_profile(str(report))) == len(profile_df)
+
+
+def test_benchmark_reports_slowdown_against_baseline(tmp_path):
+    """Benchmarks time a reference workload per stage and flag regressions against a stored baseline."""
+    import copy
+    from fpocketR import benchmark
+    current = benchmark.run_benchmarks(["8f4o"], repeat=1, dpi=50)
+    result = current["workloads"]["8f4o"]
+    assert result["mode"] == "single" and result["wall"] > 0
+    assert {"input", "clean", "fpocket", "3D_figure"} <= set(result["stages"])
+
+    baseline_path = str(tmp_path / "baseline.json")
+    benchmark.write_benchmarks(baseline_path, current)
+    baseline = benchmark.read_benchmarks(baseline_path)
+    report_df = benchmark.compare_benchmarks(current, baseline)
+    assert (report_df["Status"] == "OK").all()
+    assert report_df.set_index("Stage").loc["total", "Slowdown"] == 1
+
+    # A twice as fast baseline is a regression; a missing workload is new.
+    fast_baseline = copy.deepcopy(baseline)
+    fast_baseline["workloads"]["8f4o"]["wall"] = result["wall"] / 2
+    report_df = benchmark.compare_benchmarks(current, fast_baseline).set_index("Stage")
+    assert report_df.loc["total", "Status"] == "Slower"
+    assert report_df.loc["total", "Slowdown"] == pytest.approx(2, rel=0.01)
+    baseline["workloads"].clear()
+    assert (benchmark.compare_benchmarks(current, baseline)["Status"] == "New").all()
+
+
+def test_synthetic_structures_scale_nucleotides_chains_and_states(tmp_path):
+    """Synthetic structures tile a motif into one chain or many chains and perturb it into ensembles."""
+    import numpy as np
+    import pandas as pd
+    import prody
+    from fpocketR import benchmark, synthetic
+    motif = synthetic.load_motif(str(Path(__file__).parent.parent / "data" / "8f4o.pdb"))
+
+    tiled = synthetic.tile_motif(motif, 3)
+    assert tiled.numAtoms() == 3 * motif.numAtoms()
+    assert tiled.numResidues() == 3 * motif.numResidues()
+    assert sorted(set(tiled.getChids())) == sorted(set(motif.getChids()))
+    assert len(set(zip(tiled.getChids(), tiled.getResnums()))) == tiled.numResidues()
+
+    chains = synthetic.tile_motif(motif, 3, chains=True)
+    assert chains.numChains() == 3 * motif.numChains()
+    assert np.array_equal(chains.getResnums(), np.tile(motif.getResnums(), 3))
+
+    ensemble = synthetic.make_ensemble(tiled, 5, rmsd=1.0, seed=1)
+    assert ensemble.numCoordsets() == 5
+    assert np.array_equal(ensemble.getCoordsets()[0], tiled.getCoords())
+    rmsd = np.sqrt(((ensemble.getCoordsets()[1:] - tiled.getCoords()) ** 2).sum(-1).mean())
+    assert rmsd == pytest.approx(1.0, abs=0.05)
+
+    pdb = str(tmp_path / "8f4o_x2.pdb")
+    size = synthetic.make_structure(
+        str(Path(__file__).parent.parent / "data" / "8f4o.pdb"), pdb, copies=2, chains=True, states=3)
+    written = prody.parsePDB(pdb)
+    assert (written.numAtoms(), written.numChains(), written.numCoordsets()) == (size["Atoms"], size["Chains"], 3)
+
+    # Growth exponents are log-log slopes: linear and quadratic measures.
+    scaling_df = pd.DataFrame({
+        "Axis": "nucleotides", "Nucleotides": [100, 200, 400], "Pockets": [2, 4, 8],
+        "Wall": [1.0, 2.0, 4.0], "RSS": [100.0, 100.0, 100.0], "clean": [1.0, 4.0, 16.0]})
+    exponents = benchmark.get_scaling_exponents(scaling_df).set_index("Measure")
+    assert exponents.loc["Wall", "vs_Nucleotides"] == 1
+    assert exponents.loc["RSS", "vs_Nucleotides"] == 0
+    assert exponents.loc["clean", "vs_Pockets"] == 2
+
+
+def test_sweep_runs_every_parameter_combination(tmp_path):
+    """--sweep cleans once and writes one table keyed by the fpocket parameters of every combination."""
+    from fpocketR import sweep
+    data_dir = Path(__file__).parent.parent / "data"
+    grid = sweep.parse_grid(["m=3.0,3.4", "i=30:50:20"])
+    assert grid == {"m": [3.0, 3.4], "i": [30, 50]}
+    assert sweep.parse_grid(["D=1.5:1.7:0.1"]) == {"D": [1.5, 1.6, 1.7]}
+    with pytest.raises(ValueError):
+        sweep.parse_grid(["x=1,2"])
+    defaults = dict(m=3.0, M=5.7, i=42, D=1.65, A=3, p=0.0)
+    assert len(sweep.get_combinations(grid, defaults)) == 4
+
+    sweep_df, summary_df = sweep.run_sweep(
+        str(data_dir / "8f4o.pdb"), ["m=3.0,3.4"], None, None, "none", None, None, 0.0,
+        defaults, str(tmp_path), "8f4o", jobs=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "8f4o_sweep_pocket_characteristics.csv", "8f4o_sweep_summary.csv"]
+    assert summary_df["m"].tolist() == [3.0, 3.4]
+    assert (summary_df["i"] == 42).all() and (summary_df["Pockets"] > 0).all()
+    assert len(sweep_df) == summary_df["Pockets"].sum()
+    written = pd.read_csv(tmp_path / "8f4o_sweep_pocket_characteristics.csv")
+    assert written["Volume"].tolist() == pytest.approx(sweep_df["Volume"].tolist())
+
+    # Combinations without pockets count as 0 pockets.
+    combinations = sweep.get_combinations({"m": [3.0, 3.4]}, defaults)
+    summary = sweep.summarize_sweep(sweep_df[sweep_df["m"] == 3.0], combinations, [None])
+    assert summary["Pockets"].tolist() == [summary_df["Pockets"][0], 0]
+    effects = sweep.get_parameter_effects(summary, {"m": [3.0, 3.4]})
+    assert effects["Pockets"].tolist() == [summary_df["Pockets"][0], 0]
+
+    # The default combination matches a regular run.
+    default_csv = tmp_path / "default.csv"
+    sweep_df[sweep_df["m"] == 3.0].drop(columns=list(sweep.PARAMETERS)).to_csv(
+        default_csv, index=False, float_format="%.2g")
+    assert tolerant_csv_compare(
+        default_csv, data_dir / "TPP_apo_holo" / "8f4o_clean_out" / "8f4o_out_pocket_characteristics.csv")
+
+
+def test_fpocket_runner_logs_times_out_and_retries(tmp_path):
+    """fpocket output is streamed to a log; errors use the exit code, hangs time out and killed runs are retried."""
+    import subprocess
+    from fpocketR import runner
+    log = str(tmp_path / "fpocket.log")
+
+    runner.run_command([sys.executable, "-c", "print('pocket hunting')"], log)
+    assert open(log).read() == "pocket hunting\n"
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        runner.run_command([sys.executable, "-c", "import sys; print('bad input'); sys.exit(3)"], log)
+    assert error.value.returncode == 3 and "bad input" in error.value.output
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        runner.run_command([sys.executable, "-c", "import time; time.sleep(30)"], log, timeout=0.5)
+
+    # Killed by a signal on the first attempt only.
+    marker = tmp_path / "killed"
+    script = (f"import os, signal, pathlib; m = pathlib.Path({str(marker)!r})\n"
+              "if not m.exists(): m.touch(); os.kill(os.getpid(), signal.SIGKILL)\n"
+              "print('retried')")
+    runner.run_command([sys.executable, "-c", script], log, retries=1)
+    assert marker.exists() and open(log).read() == "retried\n"
+
+    # Many fpocket runs share a bounded number of threads.
+    results = runner.run_many(
+        runner.run_command,
+        [dict(cmd=[sys.executable, "-c", f"print({n})"], log=str(tmp_path / f"{n}.log")) for n in range(4)], 2)
+    assert results == [None] * 4
+    assert [open(tmp_path / f"{n}.log").read() for n in range(4)] == [f"{n}\n" for n in range(4)]
+
+
+def test_consensus_pockets_group_pockets_across_states(multistate_output):
+    """Pockets of all states are grouped into persistent sites by shared nucleotides and centroid distance."""
+    import numpy as np
+    from fpocketR import ensemble
+    # Two sites seen in every state, one of them split in state 3, and a one-off pocket.
+    pc_df = pd.DataFrame({
+        "State": [1, 1, 2, 2, 3, 3, 3, 3],
+        "Pocket": [1, 2, 1, 2, 1, 2, 3, 4],
+        "Filter": ["Pass"] * 7 + ["Fail"],
+        "PocketNT": [[1, 2, 3, 4], [20, 21, 22], [1, 2, 3], [20, 21, 22, 23], [2, 3, 4], [21, 22], [40, 41], [1, 2]],
+        "Score": [0.5, 0.3, 0.7, 0.2, 0.6, 0.4, 0.1, 0.9],
+        "Drug_score": 0.1, "Volume": [300.0, 200.0, 320.0, 220.0, 310.0, 210.0, 100.0, 50.0],
+        "Pocket_NPR1": 0.3, "Pocket_NPR2": 0.8,
+    })
+    centroids_df = pd.DataFrame({
+        "State": [1, 1, 2, 2, 3, 3, 3], "Pocket": [1, 2, 1, 2, 1, 2, 3],
+        "X": [0.0, 20.0, 1.0, 21.0, 0.5, np.nan, 0.0], "Y": 0.0, "Z": 0.0})
+    members_df, sites_df = ensemble.find_sites(pc_df, centroids_df, num_states=3)
+    assert len(members_df) == 7 and sites_df["Pockets"].tolist() == [3, 3, 1]
+    assert sites_df["Occupancy"].tolist() == pytest.approx([1, 1, 1 / 3])
+    first = sites_df.iloc[0]
+    assert first["PocketNT"] == [1, 2, 3, 4] and first["Score_mean"] == pytest.approx(0.6)
+    assert first["Volume_var"] == pytest.approx(np.var([300, 320, 310]))
+    assert (first["Representative_state"], first["Representative_pocket"]) == (1, 1)
+    assert members_df.set_index(["State", "Pocket"]).loc[(3, 2), "Site"] == 2
+
+    # Multistate runs write the consensus pockets of all states.
+    sites = pd.read_csv(multistate_output / "2l1v_consensus_pockets.csv")
+    members = pd.read_csv(multistate_output / "2l1v_consensus_pocket_members.csv")
+    all_states = pd.read_csv(multistate_output / "2l1v_all_states_pocket_characteristics.csv")
+    assert len(members) == (all_states["Filter"] == "Pass").sum() == sites["Pockets"].sum()
+    assert sites["Occupancy"].between(0, 1).all() and sites["Occupancy"].is_monotonic_decreasing
+
+
+def test_trajectory_frames_stream_as_states(tmp_path):
+    """--traj streams DCD frames of a topology into single model inputs analyzed as states."""
+    import numpy as np
+    import prody
+    from fpocketR import trajectory
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    pdb = str(repo_root / "fpocketR" / "data" / "2l1v.pdb")
+    ensemble = prody.parsePDB(pdb)
+    traj = str(tmp_path / "2l1v.dcd")
+    prody.writeDCD(traj, ensemble)
+
+    assert trajectory.parse_frames("10:100:5") == slice(10, 100, 5)
+    assert trajectory.parse_frames("7") == slice(7, 8)
+    with pytest.raises(ValueError):
+        trajectory.parse_frames("0:10:0")
+    with pytest.raises(ValueError):
+        trajectory.open_trajectory(str(tmp_path / "2l1v.xtc"))
+    frames = trajectory.get_frames(pdb, traj, "::2")
+    assert list(frames) == [0, 2]
+
+    frame_copy, frame_clean = trajectory.write_frame(pdb, traj, 2, str(tmp_path), "2l1v")
+    copy, clean = prody.parsePDB(frame_copy), prody.parsePDB(frame_clean)
+    assert copy.numCoordsets() == clean.numCoordsets() == 1
+    assert np.allclose(copy.getCoords(), ensemble.getCoordsets()[2], atol=1e-3)
+    assert clean.select("not nucleic") is None
+
+    out_dir = tmp_path / "out"
+    subprocess.run(
+        ["python", "-m", "fpocketR", "-pdb", pdb, "--traj", traj, "--frames", "::2",
+         "--render", "none", "-o", str(out_dir), "--no-cache"],
+        check=True, cwd=str(repo_root), capture_output=True, text=True)
+    assert pd.read_csv(out_dir / "2l1v_frames.csv").to_dict("list") == {"State": [1, 2], "Frame": [0, 2]}
+    assert (out_dir / "2l1v_clean_state2_out" / "2l1v_state2_out_pocket_characteristics.csv").exists()
+    assert sorted(pd.read_csv(out_dir / "2l1v_all_states_pocket_characteristics.csv")["State"].unique()) == [1, 2]
+    assert not list(out_dir.rglob("*frame*.pdb"))
+
+
+def test_structure_context_parses_once(monkeypatch, tmp_path):
+    """Chain and state discovery read the header only, and the structure is parsed once and shared."""
+    import prody
+    from fpocketR import structures, util
+    data_dir = Path(__file__).parent.parent / "data"
+    parsed = []
+    parse_structure = structures.parse_structure
+    monkeypatch.setattr(structures, "parse_structure", lambda pdb: parsed.append(pdb) or parse_structure(pdb))
+    structures.load_context.cache_clear()
+
+    for pdb in ("2l1v.pdb", "8f4o.pdb"):
+        context = structures.get_context(str(data_dir / pdb))
+        reference = prody.parsePDB(str(data_dir / pdb))
+        assert context.num_states == reference.numCoordsets()
+        assert context.chains == [chain.getChid() for chain in reference.getHierView()]
+        assert util.get_first_rna_chain(context) == "A"
+        util.is_rna_chain(str(data_dir / pdb), "A")
+        assert util.get_offset(str(data_dir / pdb), "A", None) == reference["A"].getResnums().min() - 1
+    assert parsed == []
+
+    assert structures.get_context(str(data_dir / "2l1v.pdb")).structure is structures.get_context(str(data_dir / "2l1v.pdb")).structure
+    assert len(parsed) == 1
+    with pytest.raises(KeyError):
+        util.is_rna_chain(str(data_dir / "8f4o.pdb"), "Z")
+
+    # Hybrid-36 residue numbers (>9999) are read like ProDy; unreadable ones fall back to ProDy.
+    import numpy as np
+    lines = (data_dir / "8f4o.pdb").read_text().splitlines(keepends=True)
+    renumber = {
+        "hybrid36": lambda n: f"{n + 9987:4d}" if n + 9987 < 10000 else np.base_repr(n + 9987 - 10000 + 10 * 36 ** 3, 36),
+        "blank": lambda n: "    " if n == 12 else f"{n:4d}",
+    }
+    for label, encode in renumber.items():
+        pdb = tmp_path / f"8f4o_{label}.pdb"
+        pdb.write_text("".join(
+            line[:22] + encode(int(line[22:26])) + line[26:] if line.startswith(("ATOM", "HETATM")) and line[21] == "A" else line
+            for line in lines))
+        reference = prody.parsePDB(str(pdb))
+        context = structures.get_context(str(pdb))
+        assert context.chains == [chain.getChid() for chain in reference.getHierView()]
+        assert context.get_offset("A") == reference["A"].getResnums().min() - 1
+        assert context.num_states == 1
+    assert structures.read_resnum(b"A000") == 10000 and structures.read_resnum(b"a000") == 10000 + 26 * 36 ** 3
+
+
+def test_fpocket_output_parser(tmp_path):
+    """outputs parses fpocket files into typed arrays and atom groups in one pass; real_sphere output is replaced, not appended."""
+    import numpy as np
+    import prody
+    from fpocketR import analyze, outputs
+    reference_dir = Path(__file__).parent.parent / "data" / "8f4o_clean_out"
+    stem = str(reference_dir / "8f4o_clean")
+
+    info_df = outputs.read_info(f"{stem}_info.txt")
+    assert info_df["Pocket"].tolist() == [1]
+    assert info_df["a-sphere"].dtype == int and info_df.loc[0, "Volume"] == 213.358
+
+    spheres, out = analyze.get_real_sphere(f"{stem}_pockets.pqr", f"{stem}_out.pdb", str(tmp_path), "8f4o")
+    pqr = prody.parsePQR(f"{stem}_pockets.pqr")
+    assert np.allclose(spheres["coords"], pqr.getCoords()) and np.allclose(spheres["radii"], pqr.getRadii())
+    assert (spheres["pockets"] == 1).all() and not spheres["polar"].any()
+
+    analyze.get_real_sphere(f"{stem}_pockets.pqr", f"{stem}_out.pdb", str(tmp_path), "8f4o")
+    assert (tmp_path / "8f4o_out_real_sphere.pdb").read_text() == (reference_dir / "8f4o_out_real_sphere.pdb").read_text()
+
+    # The output structure is built from the same pass over *_out.pdb.
+    out_atoms, reference = outputs.get_out_atoms(out), prody.parsePDB(f"{stem}_out.pdb")
+    assert out_atoms.numAtoms() == reference.numAtoms()
+    assert np.allclose(out_atoms.getCoords(), reference.getCoords())
+    for field in ("Names", "Resnames", "Chids", "Resnums", "Elements"):
+        assert (getattr(out_atoms, f"get{field}")() == getattr(reference, f"get{field}")()).all()
+    assert (out_atoms.getFlags("hetatm") == reference.getFlags("hetatm")).all()
+
+
+def test_max_memory_bounds_parallel_states(tmp_path, multistate_output):
+    """--max-memory runs one state until a worker's peak RSS is known, then packs states into the budget left after the parent."""
+    from fpocketR import memory
+    assert memory.get_job_limit(8, None, 1000, used=0) == 1
+    assert memory.get_job_limit(8, 300, 1000, used=0) == 3
+    assert memory.get_job_limit(8, 300, 1000, used=400) == 2
+    assert memory.get_job_limit(8, 3000, 1000, used=0) == 1
+    assert 0 < memory.get_current_rss() <= memory.get_peak_rss()
+
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    out_dir = tmp_path / "out"
+    run = subprocess.run(
+        ["python", "-m", "fpocketR", "-pdb", str(repo_root / "fpocketR" / "data" / "2l1v.pdb"),
+         "-s", "0", "-j", "2", "--max-memory", "100000", "--render", "none", "-o", str(out_dir), "--no-cache"],
+        check=True, cwd=str(repo_root), capture_output=True, text=True)
+    assert "Running 2 states at once" in run.stdout
+    assert "Peak memory:" in run.stdout and "budget: 100000 MB" in run.stdout
+    assert tolerant_csv_compare(
+        out_dir / "2l1v_all_states_pocket_characteristics.csv",
+        multistate_output / "2l1v_all_states_pocket_characteristics.csv", atol=0)
+
+
+def test_compressed_and_mmcif_inputs(tmp_path):
+    """Gzip-compressed .pdb and .cif inputs are read directly and named without their extensions."""
+    import gzip
+    import shutil
+    from fpocketR import structures, util
+    repo_root = Path(__file__).parent.parent.parent.resolve()
+    data_dir = repo_root / "fpocketR" / "data"
+
+    assert structures.split_path("data/6zj3.v2.cif.gz") == ("6zj3.v2", ".cif", True)
+    assert util.is_pdb_id("8f4o") and not util.is_pdb_id(str(data_dir / "8f4o.pdb"))
+    with pytest.raises(ValueError):
+        structures.parse_structure(str(tmp_path / "8f4o.bcif"))
+
+    from pymol import cmd
+    cmd.load(str(data_dir / "2l1v.pdb"), "2l1v")
+    cmd.save(str(tmp_path / "2l1v.cif"), "2l1v", state=0)
+    cmd.delete("2l1v")
+    for source, target in ((tmp_path / "2l1v.cif", tmp_path / "2l1v.cif.gz"),
+                           (data_dir / "8f4o.pdb", tmp_path / "8f4o.pdb.gz")):
+        with open(source, "rb") as f_in, gzip.open(target, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    context = structures.get_context(str(tmp_path / "2l1v.cif.gz"))
+    assert context.num_states == 3 and context.chains == ["A"] and context.get_offset("A") == 0
+    assert structures.get_context(str(tmp_path / "8f4o.pdb.gz")).chains[0] == "A"
+
+    out_dir = tmp_path / "out"
+    subprocess.run(
+        ["python", "-m", "fpocketR", "-pdb", str(tmp_path / "8f4o.pdb.gz"), "-l", "no",
+         "--render", "none", "-o", str(out_dir), "--no-cache"],
+        check=True, cwd=str(repo_root), capture_output=True, text=True)
+    assert tolerant_csv_compare(
+        out_dir / "8f4o_clean_out" / "8f4o_out_pocket_characteristics.csv",
+        data_dir / "TPP_apo_holo" / "8f4o_clean_out" / "8f4o_out_pocket_characteristics.csv")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for streaming the frames of molecular dynamics trajectories
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import os
+from functools import lru_cache
+import numpy as np
+from prody import AtomGroup, Trajectory
+from fpocketR import cache, pocket, profiling, structures
+
+# Trajectory formats ProDy can stream.
+TRAJECTORY_FORMATS = ('.dcd',)
+
+
+def parse_frames(frames : str = None) -> slice:
+    """Parses a frame range (start:stop:step, 0-based, stop excluded as in
+    Python). Any part can be left out, e.g. '::10' for every 10th frame.
+
+    Args:
+        frames (str): Frame range (None selects all frames).
+
+    Returns:
+        slice: Frame range.
+    """
+    if not frames:
+        return slice(None)
+    try:
+        parts = [int(part) if part else None for part in frames.split(':')]
+    except ValueError:
+        raise ValueError(f'Invalid frame range: {frames}. Use start:stop:step, e.g. 0:1000:10.')
+    if len(parts) > 3 or (len(parts) == 3 and parts[2] is not None and parts[2] < 1):
+        raise ValueError(f'Invalid frame range: {frames}. Use start:stop:step, e.g. 0:1000:10.')
+    if len(parts) == 1:
+        return slice(parts[0], parts[0] + 1 if parts[0] != -1 else None)
+    return slice(*parts)
+
+
+@lru_cache(maxsize=2)
+def open_trajectory(traj : str) -> Trajectory:
+    """Opens a trajectory once per process.
+
+    Args:
+        traj (str): Path to a trajectory file (see TRAJECTORY_FORMATS).
+
+    Returns:
+        object: ProDy trajectory.
+    """
+    if os.path.splitext(traj)[1].lower() not in TRAJECTORY_FORMATS:
+        raise ValueError(
+            f'Unsupported trajectory format: {traj}. Supported formats: '
+            f'{", ".join(TRAJECTORY_FORMATS)} (convert other formats, e.g. '
+            'XTC, with `mdconvert` or `catdcd`).')
+    return Trajectory(traj)
+
+
+def get_frames(pdb : str, traj : str, frames : str = None) -> range:
+    """Gets the frames of a trajectory to analyze and checks that they match
+    the topology.
+
+    Args:
+        pdb (str): Path to the topology .pdb file.
+        traj (str): Path to the trajectory file.
+        frames (str): Frame range (start:stop:step; None selects all frames).
+
+    Returns:
+        range: Indices of the frames to analyze (state N is frame range[N-1]).
+    """
+    trajectory = open_trajectory(traj)
+    num_atoms = load_topology(pdb)[0].numAtoms()
+    if trajectory.numAtoms() != num_atoms:
+        raise ValueError(
+            f'{traj} has {trajectory.numAtoms()} atoms per frame but its '
+            f'topology {pdb} has {num_atoms} atoms.')
+    selected = range(trajectory.numFrames())[parse_frames(frames)]
+    if not len(selected):
+        raise ValueError(f'No frames of {traj} are in the range {frames}.')
+    return selected
+
+
+def get_trajectory_key(traj : str, frames : range) -> str:
+    """Identifies a trajectory and its selected frames without reading the
+    (often very large) file.
+
+    Args:
+        traj (str): Path to the trajectory file.
+        frames (range): Indices of the frames to analyze.
+
+    Returns:
+        str: Hexadecimal sha256 digest.
+    """
+    stat = os.stat(traj)
+    return cache.get_key(
+        os.path.abspath(traj), stat.st_size, stat.st_mtime_ns,
+        frames.start, frames.stop, frames.step)
+
+
+@lru_cache(maxsize=2)
+def load_topology(pdb : str) -> tuple[AtomGroup, np.ndarray, np.ndarray]:
+    """Parses a topology once per process and finds the atoms written for
+    each frame.
+
+    Args:
+        pdb (str): Path to the topology .pdb file.
+
+    Returns:
+        object: ProDy structure of the topology.
+        np.ndarray: Indices of the atoms of the frame copy (all but waters
+                    and ions, so ligands can be found).
+        np.ndarray: Indices of the RNA atoms (cleaned frame).
+    """
+    structure = structures.parse_structure(pdb)
+    if structure.numCoordsets() > 1:
+        structure.delCoordset(list(range(1, structure.numCoordsets())))
+    rna = pocket.clean_structure(structure).getIndices()
+    kept = np.flatnonzero(~structure.getFlags('water') & ~structure.getFlags('ion'))
+    return structure, kept, rna
+
+
+@profiling.profiled('clean')
+def write_frame(
+    pdb : str, traj : str, frame : int, workdir : str, name : str
+) -> tuple[str, str]:
+    """Reads one frame of a trajectory and writes it as a small single model
+    input: a copy without waters and ions (for ligands) and a cleaned RNA
+    .pdb file for fpocket.
+
+    Args:
+        pdb (str): Path to the topology .pdb file.
+        traj (str): Path to the trajectory file.
+        frame (int): Index of the frame (0-based).
+        workdir (str): Directory to write the frame to (e.g. a workspace).
+        name (str): Output file name prefix.
+
+    Returns:
+        str: Path to the copy of the frame.
+        str: Path to the cleaned frame.
+    """
+    structure, kept, rna = load_topology(pdb)
+    trajectory = open_trajectory(traj)
+    trajectory.goto(frame)
+    structure.setCoords(trajectory.nextCoordset())
+
+    frame_copy = os.path.join(workdir, f'{name}_frame{frame}.pdb')
+    frame_clean = os.path.join(workdir, f'{name}_frame{frame}_clean.pdb')
+    pocket.write_pdb(frame_copy, structure[kept])
+    pocket.write_pdb(frame_clean, structure[rna])
+    return frame_copy, frame_clean
@@ -10,9 +10,10 @@
 # -----------------------------------------------------
 import os
 import re
-from glob import glob
 from prody import *
+from prody.utilities.misctools import getMasses
 import numpy as np
+from fpocketR import structures
 
 
 def fetch_pdb(pdb_id : str) -> str:
@@ -27,6 +28,34 @@ def fetch_pdb(pdb_id : str) -> str:
     pdb_filename = fetchPDB(f'{pdb_id_lower}', compressed=False, quiet=False)
     return pdb_filename
 
+def is_pdb_id(pdb : str) -> bool:
+    """Checks if an input is a 4 character PDB identifier (and not a local
+    file) to fetch from the PDB.
+
+    Args:
+        pdb (str): Path to a structure file or PDB identifier.
+
+    Returns:
+        bool: {pdb} is a PDB identifier.
+    """
+    return not os.path.exists(pdb) and re.fullmatch('[0-9][A-Za-z0-9]{3}', pdb) is not None
+
+
+def get_default_out(pdb : str, state : int) -> str:
+    """Gets the default output parent directory for a pipeline run.
+
+    Args:
+        pdb (str): Path to input .pdb file.
+        state (int): Structural state to analyze (0 for all states).
+
+    Returns:
+        str: Path to the output parent directory.
+    """
+    if state == 0:
+        return f'Multistate_{structures.get_name(pdb)}'
+    return 'fpocketR_out'
+
+
 def natsorted(filenames : list) -> list:
     """ Sorts filenames by digits in the filenames.
     Supports multiple numbers in a filename.
@@ -80,25 +109,25 @@ def get_first_rna_chain(pdb : str) -> str:
     """Identifies first RNA chain in .pdb/.cif file.
 
     Args:
-        pdb (str): Path to input .pdb/.cif file.
+        pdb (str): Path to input .pdb/.cif file (or a ProDy structure or
+                   structures.StructureContext).
 
     Returns:
         str: Chain identifier of the first chain containing RNA.
     """
 
-    structure = prody.parsePDB(pdb)
+    context = structures.get_context(pdb)
         
-    for ch in structure.getHierView():
-        chid = ch.getChid()
-        if structure.select(f'chain {chid} and nucleotide'):
+    for chid in context.chains:
+        if context.has_residues(chid, 'nucleotide'):
             print(f'\nAutomatically selecting chain: {chid}\n'
                   'Use --chain to manually specify an RNA chain.\n')
             return chid
         
-    print(f'No RNA chain found in {pdb}.\n'
+    print(f'No RNA chain found in {context}.\n'
                     'Verify that your pdb structure contains RNA.\n'
                     'Or manually set an RNA chain with (--chain) option.')
-    raise ValueError(f'No RNA chain found in {pdb}.\n'
+    raise ValueError(f'No RNA chain found in {context}.\n'
                     'Verify that your pdb structure contains RNA.\n'
                     'Or manually set an RNA chain with (--chain) option.')
 
@@ -107,39 +136,39 @@ def is_rna_chain(pdb : str, chain : str) -> None:
     """Identifies if a chain an a .pdb/.cif file contains rna.
 
     Args:
-        pdb (str): Path to input .pdb/.cif file.
+        pdb (str): Path to input .pdb/.cif file (or a ProDy structure or
+                   structures.StructureContext).
         chain (str): Chain identifier for RNA chain.
 
     Returns:
         None
     """
-    structure = prody.parsePDB(pdb)
+    context = structures.get_context(pdb)
     chains = chain.split(',')
-    hv = structure.getHierView()
-    chids = list(hv)
+    chids = context.chains
 
     for chain in chains:
-        if not structure.select(f'chain {chain}'):
-            print(f'KeyError: The input {pdb} does not contain the chain: {chain}.\n'
+        if chain not in chids:
+            print(f'KeyError: The input {context} does not contain the chain: {chain}.\n'
             'Input a valid chain id using the (--chain) option.\n'
             'NOTE: Chain identifiers are case sensitive.\n'
-            f'Chain(s) present in {pdb}:\n{chids}')
-            raise KeyError(f'The input {pdb} does not contain the chain: {chain}.'
+            f'Chain(s) present in {context}:\n{chids}')
+            raise KeyError(f'The input {context} does not contain the chain: {chain}.'
             'Input a valid chain id using the (--chain) option.'
             'NOTE: Chain identifiers are case sensitive.')
-        elif not structure.select(f'chain {chain} nucleic'):
-            print(f'KeyError: Chain {chain} of {pdb} does not contain rna.\n'
+        elif not context.has_residues(chain, 'nucleic'):
+            print(f'KeyError: Chain {chain} of {context} does not contain rna.\n'
             'Input a valid RNA chain id using the (--chain) option.\n'
             'NOTE: Chain identifiers are case sensitive.'
-            f'Chain(s) present in {pdb}:\n{chids}')
-            raise KeyError(f'Chain {chain} of {pdb} does not contain rna.'
+            f'Chain(s) present in {context}:\n{chids}')
+            raise KeyError(f'Chain {chain} of {context} does not contain rna.'
             'Input a valid RNA chain id using the (--chain) option.\n'
             'NOTE: Chain identifiers are case sensitive.')
 
 
 def get_file_paths(
     analysis : str, name :str , pdb : str, state : int
-    )-> tuple[str, str, str, str, list[str], str, str]:
+    )-> tuple[str, str, str, str, str, str]:
     """Gets paths to required input files and check if they are accessible.
 
     Args:
@@ -153,7 +182,6 @@ def get_file_paths(
         str: valid path to fpocket generated *_out.pdb file
         str: valid path to fpocket generated *_out.pqr file
         str: valid path to fpocket generated *_info.txt file
-        str: valid paths to pockets/pocket*_atm.pdb files
         str: 4 character pdb code
         str: filename prefix for analysis and figure output files
     """
@@ -177,11 +205,6 @@ def get_file_paths(
                             f'{analysis_basename}_info.txt')
     is_accessible(info_txt, 'info_txt')
 
-    pockets_dir = os.path.join(cwd, analysis, 'pockets')
-    
-    # Sort pockets_out filenames naturally (eg: 1,2,3...10,11....20,21)
-    pockets_out = natsorted(glob(f'{pockets_dir}/pocket*_atm.pdb'))
-
     # Get PDB identifiers from the path to the fpocket out.pdb.
     pdb_basename = os.path.basename(pdb)
     pdb_code = pdb_basename[0:4]
@@ -189,7 +212,7 @@ def get_file_paths(
     if state:
         name = f'{name}_state{state}'
 
-    return pdb, pdb_out, pqr_out, info_txt, pockets_out, pdb_code, name
+    return pdb, pdb_out, pqr_out, info_txt, pdb_code, name
 
 
 def calc_npr(atom_group: object) -> tuple[float, float]:
@@ -218,90 +241,139 @@ def calc_npr(atom_group: object) -> tuple[float, float]:
     return npr1, npr2
 
 
-def calc_inertia_tensor(atom_group: object) -> np.array:
-    """Generates an interia tensor for a prody atomgroup object.
+def calc_npr_batch(atom_groups: list[object]) -> np.ndarray:
+    """Generates normalized PMI ratios for many prody atomgroups at once
+    (e.g. all ligands, all pockets or all states).
 
     Args:
-        atomgroup (object): prody atomgroup
+        atom_groups (list[object]): prody atomgroups
 
     Returns:
-        np.array: 3x3 inertia tensor
+        np.ndarray: n x 2 array of normalized principle ratios
+                    (NPR1 = I1/I3, NPR2 = I2/I3) in input order.
     """
-    # Calculate center of mass
-    totmass = 0.0
-    x_com, y_com, z_com = 0, 0, 0
-
-    for atom in atom_group:
+    if len(atom_groups) == 0:
+        return np.empty((0, 2))
 
-        atom_coords = atom.getCoords()
+    coords, masses = zip(*(get_coords_masses(group) for group in atom_groups))
+    group_ids = np.repeat(np.arange(len(atom_groups)),
+                          [len(group_coords) for group_coords in coords])
 
-        if atom.getResname() == 'STP':
-            atom_mass = 1
-        else:
-            atom_mass = atom.getMass()
+    inertia_tensors = calc_inertia_tensors(
+        np.concatenate(coords), np.concatenate(masses), group_ids)
 
-        x_com += atom_coords[0] * atom_mass
-        y_com += atom_coords[1] * atom_mass
-        z_com += atom_coords[2] * atom_mass
-        totmass += atom_mass
+    return calc_npr_from_tensors(inertia_tensors)
 
-    x_com /= totmass
-    y_com /= totmass
-    z_com /= totmass
 
-    # Make and populate inertia tensor
+def calc_npr_from_tensors(inertia_tensors : np.ndarray) -> np.ndarray:
+    """Generates normalized PMI ratios from a stack of inertia tensors.
 
-    I = []
-    for _ in range(9):
-        I.append(0)
+    Args:
+        inertia_tensors (np.ndarray): n x 3 x 3 inertia tensors
 
-    for atom in atom_group:
-        atom_coords = atom.getCoords()
-        if atom.getResname() == 'STP':
-            atom_mass = 1
-        else:
-            atom_mass = atom.getMass()
+    Returns:
+        np.ndarray: n x 2 array of normalized principle ratios (NPR1, NPR2)
+    """
+    pmi = calc_pmi(inertia_tensors)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pmi[..., :2] / pmi[..., 2:3]
 
-        temp_x, temp_y, temp_z = atom_coords[0], atom_coords[1], atom_coords[2]
-        temp_x -= x_com
-        temp_y -= y_com
-        temp_z -= z_com
 
-        I[0] += atom_mass * (temp_y ** 2 + temp_z ** 2)
-        I[4] += atom_mass * (temp_x ** 2 + temp_z ** 2)
-        I[8] += atom_mass * (temp_x ** 2 + temp_y ** 2)
-        I[1] -= atom_mass * temp_x * temp_y
-        I[3] -= atom_mass * temp_x * temp_y
-        I[2] -= atom_mass * temp_x * temp_z
-        I[6] -= atom_mass * temp_x * temp_z
-        I[5] -= atom_mass * temp_y * temp_z
-        I[7] -= atom_mass * temp_y * temp_z
+def get_coords_masses(atom_group: object) -> tuple[np.ndarray, np.ndarray]:
+    """Gets coordinate and mass arrays for a prody atomgroup.
+    a-spheres (STP) have no atomic mass and are given a mass of 1. Atom
+    groups built without masses get the masses of their elements, as
+    parsed structures do (or 1 without elements).
 
-    # generate inertia tensor
-    inertia_tensor = np.array([(I[0:3]), (I[3:6]), (I[6:9])])
+    Args:
+        atomgroup (object): prody atomgroup
 
-    return inertia_tensor
+    Returns:
+        np.ndarray: n x 3 atom coordinates
+        np.ndarray: n atom masses
+    """
+    coords = atom_group.getCoords()
+    masses = atom_group.getMasses()
+    if masses is None:
+        elements = atom_group.getElements()
+        masses = (np.ones(len(coords)) if elements is None
+                  else getMasses(np.char.strip(elements.astype(str))))
+    masses = np.where(atom_group.getResnames() == 'STP', 1.0, masses)
+    return coords, masses
 
 
-def calc_pmi(inertia_tensor : np.array) -> list:
-    """Calaculates sorted eigen values (principle moments of inertia) 
-    for an imput inertia tensor.
+def calc_inertia_tensor(atom_group: object) -> np.array:
+    """Generates an interia tensor for a prody atomgroup object.
 
     Args:
-        inertia_tensor (array): 3x3 inertia tensor
+        atomgroup (object): prody atomgroup
 
     Returns:
-        list: sorted principle moments of inertia (PMI) [I1, I2, I3]
+        np.array: 3x3 inertia tensor
     """
-    # calculate eigen values and eigen vectors
-    eigvals, _ = np.linalg.eig(inertia_tensor)
+    coords, masses = get_coords_masses(atom_group)
+    group_ids = np.zeros(len(coords), dtype=int)
+
+    return calc_inertia_tensors(coords, masses, group_ids)[0]
+
 
-    # sort eigen values > (I1, I2, I3)
-    eig_ord = np.argsort(eigvals)
+def calc_inertia_tensors(
+    coords : np.ndarray, masses : np.ndarray, group_ids : np.ndarray
+    ) -> np.ndarray:
+    """Generates inertia tensors for many groups of points in one pass.
 
-    sorted_eigvals = eigvals[eig_ord]
+    Args:
+        coords (np.ndarray): n x 3 point coordinates
+        masses (np.ndarray): n point masses
+        group_ids (np.ndarray): n group indices (0 to number of groups - 1)
+
+    Returns:
+        np.ndarray: number of groups x 3 x 3 inertia tensors
+    """
+    coords = np.asarray(coords, dtype=float)
+    masses = np.asarray(masses, dtype=float)
+    group_ids = np.asarray(group_ids)
+    num_groups = group_ids.max() + 1 if len(group_ids) else 0
+
+    # Calculate center of mass of each group
+    totmass = np.bincount(group_ids, weights=masses, minlength=num_groups)
+    com = np.stack([
+        np.bincount(group_ids, weights=masses * coords[:, dim],
+                    minlength=num_groups)
+        for dim in range(3)
+    ], axis=1) / totmass[:, None]
+
+    # Sum mass weighted outer products of coordinates about the center of mass
+    centered = coords - com[group_ids]
+    second_moments = np.zeros((num_groups, 3, 3))
+    for row in range(3):
+        for col in range(row, 3):
+            second_moments[:, row, col] = np.bincount(
+                group_ids,
+                weights=masses * centered[:, row] * centered[:, col],
+                minlength=num_groups,
+            )
+            second_moments[:, col, row] = second_moments[:, row, col]
+
+    # I = trace(S) * identity - S
+    trace = np.trace(second_moments, axis1=1, axis2=2)
+    inertia_tensors = trace[:, None, None] * np.eye(3) - second_moments
+
+    return inertia_tensors
+
+
+def calc_pmi(inertia_tensor : np.array) -> np.array:
+    """Calaculates sorted eigen values (principle moments of inertia) 
+    for an imput inertia tensor (or a stack of inertia tensors).
+
+    Args:
+        inertia_tensor (array): 3x3 (or n x 3 x 3) inertia tensor
 
-    return sorted_eigvals
+    Returns:
+        array: sorted principle moments of inertia (PMI) [I1, I2, I3]
+    """
+    # inertia tensors are symmetric, eigvalsh returns sorted eigen values
+    return np.linalg.eigvalsh(inertia_tensor)
 
 
 def get_offset(pdb : str, chain : str, offset : int) -> int:
@@ -309,7 +381,8 @@ def get_offset(pdb : str, chain : str, offset : int) -> int:
     and residue number for the first nucleotide in the first chain.
 
     Args:
-        pdb (str): Path to input .pdb file.
+        pdb (str): Path to input .pdb file (or a ProDy structure or
+                   structures.StructureContext).
         chain (str): Chain identifier for RNA chain.
         offset (int): Sequence offset between .pdb and .nsd file (default=None).
 
@@ -320,42 +393,44 @@ def get_offset(pdb : str, chain : str, offset : int) -> int:
     if ',' in chain:
         chain = chain.split(',')[0]
 
-    if pdb.endswith('.pdb'):
-        structure = parsePDB(pdb)
-    elif pdb.endswith('.cif'):
-        structure = parsePDB(pdb)
-    else:
+    if isinstance(pdb, str) and not structures.is_structure_path(pdb):
         print(f'Could not parse structure: {pdb}')
         return None
 
-    if structure:
-        hv = structure.getHierView()
-        ch = hv[chain]
-
-    else:
-        print(f'Could not parse structure: {pdb}')
-        return None
-    
-    if ch:
-        resn = ch.getResnums().min()
-        offset = resn - 1
-    
-    else:
-        print(f'Chain {chain} not found in structure: {pdb}')
-        return None
+    context = structures.get_context(pdb)
+    offset = context.get_offset(chain)
+    if offset is None:
+        print(f'Chain {chain} not found in structure: {context}')
     
     return offset
 
-# Function to get the last processed state
-def get_last_processed_state(state_tracker_filename):
-    if os.path.exists(state_tracker_filename):
-        with open(state_tracker_filename, 'r') as f:
-            return int(f.read().strip())  # Read the last state
-    else:
-        return 0  # If no tracker file, start from state 1
-
-# Function to update the state tracker
-def update_last_processed_state(state_tracker_filename, state):
-    with open(state_tracker_filename, 'w') as f:
-        f.write(str(state))  # Write the current state to the file
-        
\ No newline at end of file
+def confirm_overwrite(paths : list[str], yes : bool) -> bool:
+    """Prompts user once before overwriting any existing output directories.
+    Exits the program if the user declines.
+
+    Args:
+        paths (list[str]): Output directories that will be written.
+        yes (bool): Overwrite output files and directories with same name.
+
+    Returns:
+        bool: True if existing directories may be overwritten.
+    """
+    existing = [path for path in paths if os.path.isdir(path)]
+    if yes or not existing:
+        return yes
+
+    remove = input(
+        f'{len(existing)} output directories already exist, e.g.:\n'
+        f'{existing[0]}\n\n'
+        'Overwrite directories? [y/n]: '
+    )
+    print()
+    if remove in ('y', 'Y', 'yes', 'Yes'):
+        return True
+
+    print(
+        'Exiting program. \n'
+        'The name of the output directory can '
+        'be changed with the --name flag.'
+    )
+    exit()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------------
+# Module for isolating pipeline runs in temporary workspaces
+# Seth Veenbaas
+# Weeks Lab, UNC-CH
+# 2024
+#
+# Version 1.3.0
+#
+# -----------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Parent directory for workspaces (e.g. /dev/shm for tmpfs).
+DEFAULT_TMPDIR = os.environ.get('FPOCKETR_TMPDIR')
+
+
+@contextmanager
+def workspace(out : str, prefix : str, tmpdir : str = None):
+    """Creates a private temporary directory for a single pipeline run and
+    removes it (and anything left in it) on exit. By default the workspace
+    is a hidden directory inside {out}, so finished results can be renamed
+    into place without copying.
+
+    Args:
+        out (str): Path to the output parent directory.
+        prefix (str): Workspace directory name prefix.
+        tmpdir (str): Directory in which to create the workspace instead of
+                      {out} (e.g. /dev/shm for tmpfs).
+
+    Yields:
+        str: Absolute path to the workspace.
+    """
+    parent = tmpdir if tmpdir else out
+    os.makedirs(parent, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix=f'.{prefix}_', dir=parent)
+    try:
+        yield os.path.abspath(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def commit(src : str, dest : str) -> str:
+    """Moves a finished output directory from a workspace to its final
+    location. Outputs are staged next to {dest} and renamed into place, so
+    {dest} never contains a partially written run. An existing {dest} is
+    replaced.
+
+    Args:
+        src (str): Path to the output directory in the workspace.
+        dest (str): Path to the final output directory.
+
+    Returns:
+        str: Path to the final output directory.
+    """
+    parent = os.path.dirname(os.path.abspath(dest))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(
+        prefix=f'.{os.path.basename(dest)}_', dir=parent)
+    try:
+        # Renames within a filesystem, copies from tmpfs.
+        staged = shutil.move(src, os.path.join(staging, 'new'))
+        if os.path.isdir(dest):
+            os.rename(dest, os.path.join(staging, 'old'))
+        os.rename(staged, dest)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return dest